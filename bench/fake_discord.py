@@ -0,0 +1,204 @@
+"""
+Discord のインプロセス偽実装（ベンチマーク用）
+
+TranslatorCog が使う REST 呼び出し（fetch_message / create_thread / thread.edit /
+thread.history / thread.send 等）だけを再現する。各呼び出しは FakeDiscordAPI で
+回数を数え、設定した遅延を入れ、一定の確率で HTTP 500 を返す。
+
+スレッドとチャンネルは discord.Thread / discord.TextChannel を継承しているので、
+コグの isinstance 判定はそのまま通る（親クラスの __init__ は呼ばない）。
+"""
+
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+
+import discord
+
+_snowflakes = itertools.count(10_000_000)
+
+
+def next_id() -> int:
+    return next(_snowflakes)
+
+
+class _Response:
+    """discord.HTTPException の生成に必要な最小限のレスポンス。"""
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+class FakeDiscordAPI:
+    """
+    REST 呼び出しの計測と障害注入。
+
+    latency:    1 呼び出しあたりの平均遅延（秒）。実際の遅延は 0.5〜1.5 倍でばらつかせる
+    error_rate: HTTP 500 を返す確率（0〜1）
+    """
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls: Counter[str] = Counter()
+        self.errors: Counter[str] = Counter()
+        self.bot_user: FakeUser | None = None     # FakeBot が設定する（投稿の author）
+        self._random = random.Random(seed)
+
+    async def call(self, name: str) -> None:
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors[name] += 1
+            raise discord.HTTPException(_Response(500, "Internal Server Error"), "注入されたエラー")
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+class FakeUser:
+    def __init__(self, user_id: int, bot: bool = False):
+        self.id = user_id
+        self.bot = bot
+
+    def __eq__(self, other) -> bool:
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self) -> int:
+        return self.id
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.threads: dict[int, "FakeThread"] = {}
+
+    def get_thread(self, thread_id: int) -> "FakeThread | None":
+        # アーカイブ済みスレッドはゲートウェイキャッシュから消える
+        thread = self.threads.get(thread_id)
+        if thread is None or thread.archived:
+            return None
+        return thread
+
+
+class FakeMessage:
+    def __init__(self, api: FakeDiscordAPI, channel, content: str, author: FakeUser):
+        self.id = next_id()
+        self.api = api
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.author = author
+        self.created_at = time.monotonic()
+        self.thread: FakeThread | None = None
+
+    async def create_thread(self, name: str) -> "FakeThread":
+        await self.api.call("create_thread")
+        # Discord ではメッセージから作ったスレッドの ID は元メッセージの ID と同じ
+        thread = FakeThread(self.api, self.channel, name, self.id)
+        self.thread = thread
+        self.guild.threads[thread.id] = thread
+        return thread
+
+
+class FakeThread(discord.Thread):
+    def __init__(self, api: FakeDiscordAPI, parent: "FakeTextChannel", name: str, thread_id: int):
+        self.id = thread_id
+        self.api = api
+        self.guild = parent.guild
+        self.parent_id = parent.id
+        self.archived = False
+        self.posts: list[FakeMessage] = []
+
+    def __repr__(self) -> str:
+        return f"<FakeThread id={self.id}>"
+
+    async def edit(self, *, archived: bool | None = None, **kwargs) -> "FakeThread":
+        await self.api.call("thread_edit")
+        if archived is not None:
+            self.archived = archived
+        return self
+
+    async def send(self, content: str, **kwargs) -> FakeMessage:
+        await self.api.call("send")
+        message = FakeMessage(self.api, self, content, self.api.bot_user)
+        self.posts.append(message)
+        return message
+
+    def history(self, *, limit: int | None = 100):
+        async def iterate():
+            await self.api.call("history")
+            for message in reversed(self.posts[-limit:] if limit else self.posts):
+                yield message
+
+        return iterate()
+
+
+class FakeTextChannel(discord.TextChannel):
+    def __init__(self, api: FakeDiscordAPI, guild: FakeGuild):
+        self.id = next_id()
+        self.api = api
+        self.guild = guild
+        self.messages: dict[int, FakeMessage] = {}
+
+    def __repr__(self) -> str:
+        return f"<FakeTextChannel id={self.id}>"
+
+    def post(self, content: str, author: FakeUser) -> FakeMessage:
+        """ベンチマーク用のメッセージを置く（REST 呼び出しとしては数えない）。"""
+        message = FakeMessage(self.api, self, content, author)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self.api.call("fetch_message")
+        message = self.messages.get(message_id)
+        if message is None:
+            raise discord.NotFound(_Response(404, "Not Found"), "Unknown Message")
+        return message
+
+
+class FakeBot:
+    """コグが参照する commands.Bot の属性だけを持つ偽ボット。"""
+
+    def __init__(self, api: FakeDiscordAPI):
+        self.api = api
+        self.user = FakeUser(next_id(), bot=True)
+        api.bot_user = self.user
+        self.users: dict[int, FakeUser] = {}
+        self.channels: dict[int, FakeTextChannel] = {}
+        self.cached_messages: list[FakeMessage] = []
+
+    def get_user(self, user_id: int) -> FakeUser | None:
+        return self.users.get(user_id)
+
+    async def fetch_user(self, user_id: int) -> FakeUser:
+        await self.api.call("fetch_user")
+        return self.users.setdefault(user_id, FakeUser(user_id))
+
+    def get_channel(self, channel_id: int):
+        # スレッドはギルドのスレッドキャッシュ（アクティブなものだけ）から引く
+        channel = self.channels.get(channel_id)
+        if channel is not None:
+            return channel
+        for channel in self.channels.values():
+            thread = channel.guild.get_thread(channel_id)
+            if thread is not None:
+                return thread
+        return None
+
+    async def fetch_channel(self, channel_id: int):
+        await self.api.call("fetch_channel")
+        for channel in self.channels.values():
+            thread = channel.guild.threads.get(channel_id)
+            if thread is not None:
+                return thread
+        raise discord.NotFound(_Response(404, "Not Found"), "Unknown Channel")
+
+    async def wait_until_ready(self) -> None:
+        return None
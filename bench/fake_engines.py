@@ -0,0 +1,138 @@
+"""
+DeepL / MyMemory のスタブサーバー（ベンチマーク用）
+
+127.0.0.1 の空きポートで aiohttp の Web サーバーを立て、本物の DeepLEngine /
+MyMemoryEngine をそこに向ける。HTTP クライアント・ルーター・キャッシュを含めた
+実際の経路を、外部 API なしで計測できる。
+
+訳文は "[ターゲット言語] 原文" を返す。遅延と HTTP 503 の確率は StubEngineServer で設定する。
+"""
+
+import asyncio
+import random
+from collections import Counter
+
+from aiohttp import web
+
+from utils.flag_map import FLAG_TO_LANG
+
+
+class StubEngineServer:
+    """
+    翻訳 API のスタブ。
+
+    latency:    1 リクエストあたりの平均遅延（秒）。実際の遅延は 0.5〜1.5 倍でばらつかせる
+    error_rate: HTTP 503 を返す確率（0〜1）
+    """
+
+    name = ""
+
+    def __init__(self, latency: float = 0.1, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.characters = 0
+        self.texts = 0
+        self.targets: Counter[str] = Counter()
+        self._random = random.Random(seed)
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    def routes(self) -> list[web.RouteDef]:
+        raise NotImplementedError
+
+    async def start(self) -> str:
+        """サーバーを起動してベース URL を返す。"""
+        app = web.Application()
+        app.add_routes(self.routes())
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _simulate(self) -> web.Response | None:
+        """遅延を入れ、障害を注入する場合はエラーレスポンスを返す。"""
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, text="injected error")
+        return None
+
+    def _count(self, texts: list[str], target: str) -> None:
+        self.texts += len(texts)
+        self.characters += sum(len(text) for text in texts)
+        self.targets[target] += len(texts)
+
+
+class DeepLStub(StubEngineServer):
+    """/v2/languages・/v2/usage・/v2/translate を持つ DeepL API のスタブ。"""
+
+    name = "DeepL"
+    character_limit = 500_000
+
+    def routes(self) -> list[web.RouteDef]:
+        return [
+            web.get("/v2/languages", self.languages),
+            web.get("/v2/usage", self.usage),
+            web.post("/v2/translate", self.translate),
+        ]
+
+    async def languages(self, request: web.Request) -> web.Response:
+        codes = sorted({info["deepl"] for info in FLAG_TO_LANG.values() if info["deepl"]})
+        return web.json_response([{"language": code, "name": code} for code in codes])
+
+    async def usage(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {"character_count": self.characters, "character_limit": self.character_limit}
+        )
+
+    async def translate(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        texts = [str(text) for text in form.getall("text", [])]
+        target = str(form.get("target_lang", ""))
+        error = await self._simulate()
+        if error is not None:
+            return error
+        self._count(texts, target)
+        return web.json_response({
+            "translations": [
+                {"detected_source_language": "EN", "text": f"[{target}] {text}"}
+                for text in texts
+            ]
+        })
+
+
+class MyMemoryStub(StubEngineServer):
+    """/get を持つ MyMemory API のスタブ。"""
+
+    name = "MyMemory"
+
+    def routes(self) -> list[web.RouteDef]:
+        return [web.get("/get", self.translate)]
+
+    async def translate(self, request: web.Request) -> web.Response:
+        if request.method == "HEAD":      # 起動時の事前接続
+            return web.Response()
+        text = request.query.get("q", "")
+        target = request.query.get("langpair", "|").split("|", 1)[1]
+        error = await self._simulate()
+        if error is not None:
+            return error
+        self._count([text], target)
+        return web.json_response({
+            "responseStatus": 200,
+            "responseDetails": "",
+            "quotaFinished": False,
+            "responseData": {"translatedText": f"[{target}] {text}"},
+        })
@@ -0,0 +1,318 @@
+"""
+オフラインのベンチマーク・負荷試験
+
+合成した RawReactionActionEvent を TranslatorCog.on_raw_reaction_add に流し込み、
+国旗リアクションから訳文の投稿までのホットパスを計測する。
+Discord はインプロセスの偽実装（bench.fake_discord）、DeepL / MyMemory は
+ローカルのスタブサーバー（bench.fake_engines）なので、トークンも API キーも不要。
+
+  python -m bench.run
+  python -m bench.run --reactions 2000 --rate 200 --discord-latency 0.08 --engine-error-rate 0.05
+  python -m bench.run --json > bench_output.json
+
+報告する指標:
+  - reactions/s（最初のリアクションからすべての投稿が終わるまで）
+  - リアクション → 投稿のレイテンシ p50 / p95 / p99
+  - リアクション 1 件あたりの Discord API 呼び出し数
+  - リアクション 1 件あたりのエンジン送信文字数
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+
+import aiohttp
+import discord
+
+import cogs.translator as translator_cog
+from bench.fake_discord import FakeBot, FakeDiscordAPI, FakeGuild, FakeTextChannel, FakeUser, next_id
+from bench.fake_engines import DeepLStub, MyMemoryStub
+from utils.engines import DeepLEngine, MyMemoryEngine, TranslationEngine
+from utils.flag_map import FLAG_TO_LANG
+
+# ベンチマークを外部の状態（.env のファイルパスや Redis）から切り離す
+ISOLATED_ENV = ("TRANSLATION_CACHE_DB", "THREAD_INDEX_PATH", "JOB_JOURNAL_PATH", "STATE_BACKEND_URL")
+
+SENTENCES = (
+    "The release is scheduled for next Friday afternoon.",
+    "Please check the attached log before the meeting.",
+    "We moved the staging database to the new cluster.",
+    "Could someone review the pull request when you have time?",
+    "The build failed again because of a flaky network test.",
+    "Thanks everyone for the quick response last night.",
+    "I will be out of office until Wednesday.",
+    "The new onboarding guide is ready for feedback.",
+    "Latency went up after the last deploy, so I rolled it back.",
+    "Let's keep the discussion in this channel from now on.",
+)
+EXTRAS = (
+    "",
+    " See `config.yaml` for details.",
+    " Docs: https://example.com/docs/setup",
+    " Ping <@123456789012345678> if it breaks.",
+)
+
+
+@dataclass
+class ReactionEvent:
+    message_id: int    # スレッド ID も同じ（メッセージから作ったスレッド）
+    label: str
+    sent_at: float
+
+
+def target_flags(count: int) -> list[str]:
+    """ベンチマークで使う国旗（英語以外・ラベルが重複しないもの）を先頭から count 個返す。"""
+    flags: list[str] = []
+    labels: set[str] = set()
+    for emoji, info in FLAG_TO_LANG.items():
+        if info["mymemory"] == "en" or info["label"] in labels:
+            continue
+        labels.add(info["label"])
+        flags.append(emoji)
+    return flags[:count]
+
+
+def make_content(rng: random.Random, index: int) -> str:
+    """英語の投稿本文を作る（文の組み合わせを変え、翻訳メモリが一部だけ効くようにする）。"""
+    body = " ".join(rng.sample(SENTENCES, rng.randint(1, 3)))
+    return f"Update #{index}: {body}{rng.choice(EXTRAS)}"
+
+
+def reaction_payload(message, emoji: str, user_id: int) -> discord.RawReactionActionEvent:
+    data = {
+        "message_id": message.id,
+        "channel_id": message.channel.id,
+        "guild_id": message.guild.id,
+        "user_id": user_id,
+        "type": 0,
+    }
+    return discord.RawReactionActionEvent(data, discord.PartialEmoji(name=emoji), "REACTION_ADD")
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """最近傍順位法のパーセンタイル（値が無ければ None）。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+async def run(args: argparse.Namespace) -> dict:
+    for name in ISOLATED_ENV:
+        os.environ[name] = ""
+    os.environ["JOB_WORKERS"] = str(args.workers)
+    os.environ["JOB_GUILD_CONCURRENCY"] = str(args.guild_concurrency)
+    os.environ["JOB_QUEUE_MAX"] = str(args.queue_max)
+    os.environ["DISCORD_OUTBOUND_RATE"] = str(args.outbound_rate)
+    os.environ["THREAD_ARCHIVE_DELAY"] = str(args.archive_delay)
+
+    translator_cog.COALESCE_WINDOW = args.window
+    rng = random.Random(args.seed)
+
+    # --- スタブの翻訳 API とエンジン ---
+    deepl = DeepLStub(args.engine_latency, args.engine_error_rate, seed=args.seed)
+    mymemory = MyMemoryStub(args.engine_latency, args.engine_error_rate, seed=args.seed + 1)
+    stubs = [deepl, mymemory]
+    for stub in stubs:
+        await stub.start()
+    session = aiohttp.ClientSession()
+    engines: list[TranslationEngine] = []
+    if "deepl" in args.engines:
+        engines.append(DeepLEngine("bench:fx", session, base_url=f"{deepl.url}/v2"))
+    if "mymemory" in args.engines:
+        engines.append(MyMemoryEngine(session, "bench@example.com", api_url=f"{mymemory.url}/get"))
+
+    # --- 偽の Discord ---
+    api = FakeDiscordAPI(args.discord_latency, args.discord_error_rate, seed=args.seed)
+    bot = FakeBot(api)
+    users = [FakeUser(next_id()) for _ in range(args.users)]
+    bot.users = {user.id: user for user in users}
+    messages = []
+    for _ in range(args.guilds):
+        guild = FakeGuild(next_id())
+        channel = FakeTextChannel(api, guild)
+        bot.channels[channel.id] = channel
+        for _ in range(max(1, args.messages // args.guilds)):
+            messages.append(channel.post(make_content(rng, len(messages)), rng.choice(users)))
+    if args.cached:
+        bot.cached_messages = list(messages)
+    flags = target_flags(args.languages)
+
+    cog = translator_cog.TranslatorCog(bot)
+    cog.scheduler.grace_period = args.timeout
+    await cog.warm_up(engines)
+
+    # --- リアクションを流す ---
+    events: list[ReactionEvent] = []
+    started = time.monotonic()
+    for i in range(args.reactions):
+        if args.rate:
+            delay = started + i / args.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        message = rng.choice(messages)
+        emoji = rng.choice(flags)
+        events.append(ReactionEvent(message.id, FLAG_TO_LANG[emoji]["label"], time.monotonic()))
+        await cog.on_raw_reaction_add(reaction_payload(message, emoji, rng.choice(users).id))
+
+    # 待ち時間中のジョブがすべて投入されてから、キューを処理し切る
+    await asyncio.gather(*list(cog._tasks))
+    await cog.cog_unload()
+    elapsed = time.monotonic() - started
+    await session.close()
+    for stub in stubs:
+        await stub.close()
+
+    return report(args, events, bot, api, stubs, elapsed)
+
+
+def report(args, events, bot, api, stubs, elapsed: float) -> dict:
+    """投稿時刻とリアクション時刻を突き合わせて指標をまとめる。"""
+    posted: dict[tuple[int, str], list[float]] = {}
+    for channel in bot.channels.values():
+        for thread in channel.guild.threads.values():
+            for post in thread.posts:
+                for label in {info["label"] for info in FLAG_TO_LANG.values()}:
+                    if f"**{label} Translation" in post.content:
+                        posted.setdefault((thread.id, label), []).append(post.created_at)
+
+    latencies: list[float] = []
+    duplicates = unserved = 0
+    for event in events:
+        times = posted.get((event.message_id, event.label), [])
+        after = [t for t in times if t >= event.sent_at]
+        if after:
+            latencies.append(min(after) - event.sent_at)
+        elif times:
+            duplicates += 1      # 投稿済みの言語へのリアクション（投稿しないのが正しい）
+        else:
+            unserved += 1
+
+    reactions = len(events)
+
+    def ms(value: float | None) -> float | None:
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "config": {
+            "reactions": args.reactions, "messages": args.messages, "guilds": args.guilds,
+            "languages": args.languages, "rate": args.rate, "window": args.window,
+            "workers": args.workers, "engines": args.engines,
+            "outbound_rate": args.outbound_rate, "archive_delay": args.archive_delay,
+            "discord_latency": args.discord_latency, "discord_error_rate": args.discord_error_rate,
+            "engine_latency": args.engine_latency, "engine_error_rate": args.engine_error_rate,
+            "cached": args.cached, "seed": args.seed,
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "reactions_per_second": round(reactions / elapsed, 1) if elapsed else None,
+        "served": len(latencies),
+        "duplicates": duplicates,
+        "unserved": unserved,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(max(latencies) if latencies else None),
+        },
+        "discord_calls_per_reaction": round(api.total_calls / reactions, 3) if reactions else None,
+        "discord_calls": dict(api.calls),
+        "discord_errors": dict(api.errors),
+        "engine_chars_per_reaction": (
+            round(sum(stub.characters for stub in stubs) / reactions, 1) if reactions else None
+        ),
+        "engines": {
+            stub.name: {
+                "requests": stub.requests, "errors": stub.errors,
+                "texts": stub.texts, "characters": stub.characters,
+            }
+            for stub in stubs
+        },
+    }
+
+
+def print_report(result: dict) -> None:
+    config = result["config"]
+    latency = result["latency_ms"]
+    print(
+        f"reactions: {config['reactions']} on {config['messages']} messages / "
+        f"{config['guilds']} guilds / {config['languages']} languages"
+    )
+    print(
+        f"  served {result['served']}, duplicate {result['duplicates']}, "
+        f"unserved {result['unserved']} in {result['elapsed_seconds']:.2f}s"
+    )
+    print(f"throughput:            {result['reactions_per_second']} reactions/s")
+    print(
+        f"reaction -> post (ms): p50={latency['p50']} p95={latency['p95']} "
+        f"p99={latency['p99']} max={latency['max']}"
+    )
+    calls = ", ".join(f"{name}={count}" for name, count in sorted(result["discord_calls"].items()))
+    print(f"Discord calls/reaction: {result['discord_calls_per_reaction']} ({calls})")
+    if result["discord_errors"]:
+        errors = ", ".join(f"{name}={count}" for name, count in sorted(result["discord_errors"].items()))
+        print(f"  injected errors: {errors}")
+    print(f"engine chars/reaction: {result['engine_chars_per_reaction']}")
+    for name, stats in result["engines"].items():
+        print(
+            f"  {name}: requests={stats['requests']} errors={stats['errors']} "
+            f"texts={stats['texts']} chars={stats['characters']}"
+        )
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="翻訳ボットのオフラインベンチマーク")
+    parser.add_argument("--reactions", type=int, default=500, help="流すリアクション数")
+    parser.add_argument("--messages", type=int, default=100, help="リアクション対象のメッセージ数")
+    parser.add_argument("--guilds", type=int, default=5, help="ギルド数（メッセージを均等に配置）")
+    parser.add_argument("--languages", type=int, default=6, help="使う言語（国旗）の数")
+    parser.add_argument("--users", type=int, default=50, help="リアクションするユーザー数")
+    parser.add_argument("--rate", type=float, default=100.0,
+                        help="リアクションの到着レート（件/秒）。0 なら待たずに流す")
+    parser.add_argument("--window", type=float, default=0.2, help="リアクションをまとめる待ち時間（秒）")
+    parser.add_argument("--workers", type=int, default=8, help="JOB_WORKERS")
+    parser.add_argument("--guild-concurrency", type=int, default=2, help="JOB_GUILD_CONCURRENCY")
+    parser.add_argument("--queue-max", type=int, default=500, help="JOB_QUEUE_MAX")
+    parser.add_argument("--outbound-rate", type=float, default=0.0,
+                        help="DISCORD_OUTBOUND_RATE（既定 0 = 無制限。偽 Discord にはレート制限が無いため）")
+    parser.add_argument("--archive-delay", type=float, default=5.0, help="THREAD_ARCHIVE_DELAY（秒）")
+    parser.add_argument("--engines", default="deepl,mymemory",
+                        help="使うエンジン（優先順・カンマ区切り: deepl,mymemory）")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="Discord API の平均遅延（秒）")
+    parser.add_argument("--discord-error-rate", type=float, default=0.0, help="Discord API のエラー率")
+    parser.add_argument("--engine-latency", type=float, default=0.1, help="翻訳 API の平均遅延（秒）")
+    parser.add_argument("--engine-error-rate", type=float, default=0.0, help="翻訳 API のエラー率")
+    parser.add_argument("--cached", action="store_true",
+                        help="メッセージをゲートウェイのキャッシュに載せる（fetch_message を省く）")
+    parser.add_argument("--timeout", type=float, default=120.0, help="処理し切るまで待つ上限（秒）")
+    parser.add_argument("--seed", type=int, default=1, help="乱数シード")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    parser.add_argument("--log-level", default="ERROR", help="ボット側のログレベル")
+    args = parser.parse_args(argv)
+    args.engines = [name.strip().lower() for name in args.engines.split(",") if name.strip()]
+    return args
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        stream=sys.stderr,
+    )
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
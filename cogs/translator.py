@@ -1,19 +1,141 @@
 """
 TranslatorCog: 国旗リアクション → 翻訳 → スレッド投稿 → スレッドクローズ
+
+同じメッセージへの国旗リアクションは短い待ち時間（COALESCE_WINDOW）の間まとめて受け付け、
+1 つのジョブとして「メッセージ取得 1 回・アーカイブ解除 1 回・翻訳は並行・投稿は最少件数・
+アーカイブ 1 回」で処理する。ジョブは utils.jobs のスケジューラ（ギルド単位で公平な
+ワーカープール）を通して実行し、終了時は猶予時間内に処理し切る。
+Discord への送信は utils.outbound を通し、レート制限に掛かる前に待つ。スレッドのアーカイブは
+THREAD_ARCHIVE_DELAY 秒遅らせ、その間に続いたジョブはアーカイブ解除・アーカイブを省く。
+
+元メッセージが編集されたら、投稿済みの訳文をその場で書き換える
+（翻訳メモリにより、エンジンに送るのは変わった文だけ）。
+PREFETCH_CHANNELS のチャンネルでは、よく付く国旗の言語へ新着メッセージを先読み翻訳する（utils.prefetch）。
+/translate-history でチャンネルの過去のメッセージをまとめて翻訳できる（utils.history）。
 """
 
+import asyncio
 import logging
+import os
+import re
+import time
 
 import discord
+from discord import app_commands
 from discord.ext import commands
 
-from utils.flag_map import FLAG_TO_LANG, is_flag_emoji
-from utils.translator import translate
+from utils.cache import text_digest
+from utils.detection import detect_language
+from utils.detection import warmup as warmup_detection
+from utils.engines import TranslationEngine
+from utils.history import HistoryCheckpoint, HistoryItem, checkpoints_from_env, history_pipeline
+from utils.jobs import TranslationJob, scheduler_from_env
+from utils.languages import FlagEntry, Language, LanguageRegistry, registry_for
+from utils.markup import segment
+from utils.memory import memory_profile, register_caches
+from utils.metrics import HISTORY_MESSAGES, REACTION_TO_POST_SECONDS, REACTIONS, STAGE_SECONDS
+from utils.outbound import outbound_from_env
+from utils.prefetch import prefetcher_from_env
+from utils.resolver import DiscordResolver
+from utils.startup import STARTUP, WARMUP
+from utils.state import close_state
+from utils.thread_index import index_from_env
+from utils.translator import close_engines, get_cache, start_engines, translate_many
 
 logger = logging.getLogger(__name__)
 
 TRANSLATION_THREAD_PREFIX = "💬 Translations"
 TRANSLATION_MARKER = "Translation (via"
+DISCORD_MESSAGE_LIMIT = 2000
+TRANSLATION_LABEL_PATTERN = re.compile(r"\*\*(.+?) " + re.escape(TRANSLATION_MARKER))
+
+# 同じメッセージへのリアクションをまとめる待ち時間（秒）
+COALESCE_WINDOW = float(os.getenv("REACTION_COALESCE_WINDOW", "1.5"))
+
+# /translate-history
+HISTORY_MAX_LIMIT = 5000          # 1 回の実行で走査するメッセージ数の上限
+HISTORY_POST_INTERVAL = 1.0       # 履歴スレッドへの投稿間隔（秒）
+HISTORY_IDLE_POLL_INTERVAL = 0.5  # 国旗リアクションのジョブが捌けるのを待つ間隔（秒）
+
+
+def format_post(emoji: str, label: str, translated_text: str | None, engine: str) -> str:
+    """スレッドに投稿する 1 言語分のブロックを作る（translated_text が None なら失敗表示）。"""
+    if translated_text is None:
+        return (
+            f"{emoji} **{label} Translation failed.**\n"
+            "（すべての翻訳エンジンが利用できませんでした）"
+        )
+    return f"{emoji} **{label} {TRANSLATION_MARKER} {engine}):**\n{translated_text}"
+
+
+# 長いブロックを分ける位置（粗い順）: 行 → 文 → 単語。どれでも収まらなければ文字数で切る
+SPLIT_POINTS = (
+    re.compile(r"\n"),
+    re.compile(r"(?<=[.!?])\s+|(?<=[。！？])"),
+    re.compile(r"\s+"),
+)
+
+
+def _split_units(text: str, limit: int, level: int = 0) -> list[str]:
+    """text を区切り位置で分け、limit を超える部分だけさらに細かい区切りで分ける。"""
+    if len(text) <= limit:
+        return [text]
+    if level == len(SPLIT_POINTS):
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+    units: list[str] = []
+    pos = 0
+    for match in SPLIT_POINTS[level].finditer(text):
+        if match.end() > pos:
+            units.extend(_split_units(text[pos:match.end()], limit, level + 1))
+            pos = match.end()
+    if pos < len(text):
+        units.extend(_split_units(text[pos:], limit, level + 1))
+    return units
+
+
+def _split_block(text: str, limit: int) -> list[str]:
+    """text を limit 文字以下の断片に分ける。区切りの単位を先頭から詰め、断片の数を最少にする。"""
+    pieces: list[str] = []
+    current = ""
+    for unit in _split_units(text, limit):
+        if len(current) + len(unit) > limit:
+            pieces.append(current)
+            current = ""
+        current += unit
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def pack_posts(posts: list[str], limit: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    """
+    投稿ブロックを Discord の文字数上限に収まる最少件数のメッセージに詰める。
+    1 ブロックが上限を超える場合は行・文・単語の境界（それでも超える場合は文字数）で分割する。
+    """
+    chunks: list[str] = []
+    for post in posts:
+        for piece in _split_block(post, limit):
+            piece = piece.strip("\n")
+            if not piece:
+                continue
+            if chunks and len(chunks[-1]) + 2 + len(piece) <= limit:
+                chunks[-1] += "\n\n" + piece
+            else:
+                chunks.append(piece)
+    return chunks
+
+
+def format_history_post(item: HistoryItem) -> str:
+    """履歴スレッドに投稿する 1 メッセージ分のブロックを作る（元メッセージへのリンク付き）。"""
+    header = f"{item.message.jump_url} **{item.message.author.display_name}**"
+    if item.translated is None:
+        return f"{header}: Translation failed."
+    return f"{header} (via {item.engine}):\n{item.translated}"
+
+
+def _posted_targets(registry: LanguageRegistry, labels: set[str]) -> set[Language]:
+    """投稿済みの表示ラベルを翻訳ターゲットに直す（🇪🇸 の訳があれば 🇲🇽 も投稿済みとみなす）。"""
+    return {flag.language for label in labels if (flag := registry.by_label(label)) is not None}
 
 
 class TranslatorCog(commands.Cog):
@@ -21,6 +143,110 @@ class TranslatorCog(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self._pending: dict[int, TranslationJob] = {}
+        self._tasks: set[asyncio.Task] = set()
+        # 訳文の書き換え中のタスク（アンロード時にエンジンを閉じる前に待つ）
+        self._edits: set[asyncio.Task] = set()
+        self._unloading = False
+        self.index = index_from_env()
+        self.resolver = DiscordResolver(bot, max_entries=memory_profile().resolver_entries)
+        self.scheduler = scheduler_from_env(self._process_job)
+        self.prefetcher = prefetcher_from_env(self.scheduler)
+        self.history = checkpoints_from_env()
+        self.outbound = outbound_from_env()
+        self._history_runs: dict[tuple[int, Language], asyncio.Task] = {}
+        self._warmed = asyncio.Event()
+        self._warmup_task: asyncio.Task | None = None
+        register_caches("cog", self._cache_sizes)
+
+    def _cache_sizes(self) -> dict[str, int]:
+        return {**self.resolver.cache_sizes(), "thread_index": len(self.index)}
+
+    async def cog_load(self) -> None:
+        """
+        コグ読み込み時にウォームアップを裏で始める（ゲートウェイへのログイン・接続と並行して進む）。
+        翻訳ジョブ・編集の追従・履歴翻訳はウォームアップの完了を待ってから処理する。
+        """
+        self._warmup_task = asyncio.create_task(self.warm_up(), name="warmup")
+
+    async def warm_up(self, engines: list[TranslationEngine] | None = None) -> None:
+        """
+        初回のリアクションで払っていた準備をまとめて済ませる。
+        言語検出のプロファイル・翻訳エンジン（接続プール・DeepL の対応言語と使用量）・
+        翻訳キャッシュ DB は並行して用意し、その後に前回終了時に残った翻訳ジョブを再投入する。
+        engines を渡した場合はそれを使う（ベンチマークの偽エンジン等）。
+        ウォームアップに失敗してもスケジューラのワーカーは必ず起動する。
+        """
+        warmed = False
+        try:
+            with STARTUP.phase(WARMUP):
+                try:
+                    await asyncio.gather(
+                        self._timed("langdetect", asyncio.to_thread(warmup_detection)),
+                        self._timed("engines", start_engines(engines)),
+                        self._timed("cache", asyncio.to_thread(get_cache)),
+                    )
+                    warmed = True
+                except Exception:
+                    # 言語検出・エンジン・キャッシュは初回の呼び出しで改めて用意される
+                    logger.exception("ウォームアップに失敗しました（準備完了になりません）")
+                with STARTUP.phase("journal"):
+                    # ジャーナルの読み込みに失敗しても再投入を諦めてワーカーは起動する
+                    await self.scheduler.start()
+            if self.prefetcher is not None:
+                self.prefetcher.start()
+            if warmed:
+                STARTUP.mark_ready(WARMUP)
+        finally:
+            # 待っている処理は失敗しても進める
+            self._warmed.set()
+
+    @staticmethod
+    async def _timed(name: str, awaitable) -> None:
+        with STARTUP.phase(name):
+            await awaitable
+
+    async def cog_unload(self) -> None:
+        """
+        コグのアンロード時（bot.close() の中で呼ばれる）。
+        待ち時間中のジョブもキューに入れ、書き換え中の訳文とあわせて猶予時間内に処理し切ってから
+        翻訳エンジンと HTTP セッションを閉じ、インデックスを保存して状態バックエンドを閉じる。
+        """
+        # 以降の編集イベントは受け付けない（閉じたエンジンを作り直さないため）
+        self._unloading = True
+        if self._warmup_task is not None:
+            await asyncio.gather(self._warmup_task, return_exceptions=True)
+        if self.prefetcher is not None:
+            await self.prefetcher.stop()
+        # 履歴の一括翻訳は中断する（再開位置はバッチごとに保存済み）
+        runs = list(self._history_runs.values())
+        for task in runs:
+            task.cancel()
+        await asyncio.gather(*runs, return_exceptions=True)
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for job in pending:
+            await self.scheduler.submit(job)
+        await self.scheduler.drain()
+        await self._drain_edits(self.scheduler.grace_period)
+        await self.outbound.flush()
+        await close_engines()
+        await self.index.flush()
+        self.index.close()
+        self.history.close()
+        await close_state()
+
+    async def _drain_edits(self, timeout: float) -> None:
+        """書き換え中の訳文を timeout 秒まで待ち、終わらなければ中断する（元の訳文が残る）。"""
+        edits = list(self._edits)
+        if not edits:
+            return
+        _, pending = await asyncio.wait(edits, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            logger.warning("猶予時間内に終わらなかった訳文の書き換えを中断しました: %d 件", len(pending))
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
@@ -30,164 +256,602 @@ class TranslatorCog(commands.Cog):
         if payload.user_id == self.bot.user.id:
             return
 
+        # 国旗（とギルド設定のカスタム絵文字）以外は 1 回の辞書引きで弾く
         emoji = str(payload.emoji)
-
-        if not is_flag_emoji(emoji):
+        flag = registry_for(payload.guild_id).get(emoji)
+        if flag is None:
+            REACTIONS.inc(result="ignored")
             return
 
-        lang_info = FLAG_TO_LANG.get(emoji)
-        if lang_info is None:
+        # ユーザー情報の取得（member → キャッシュ → fetch の順）
+        user = await self.resolver.user(payload)
+        if user is None or user.bot:
+            REACTIONS.inc(result="ignored")
             return
+        REACTIONS.inc(result="flag")
+
+        # 同じメッセージのジョブが待機中ならそこに合流する
+        job = self._pending.get(payload.message_id)
+        if job is None:
+            job = TranslationJob(payload.guild_id, payload.channel_id, payload.message_id)
+            self._pending[payload.message_id] = job
+            task = asyncio.create_task(self._run_job_after_window(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        job.emojis.setdefault(emoji, flag)
 
-        # チャンネルの取得
-        channel = self.bot.get_channel(payload.channel_id)
-        if channel is None:
-            try:
-                channel = await self.bot.fetch_channel(payload.channel_id)
-            except (discord.NotFound, discord.Forbidden, discord.HTTPException):
-                return
+    # ─────────────────────────────────────────────────────────────────────
 
-        # メッセージの取得
-        try:
-            message = await channel.fetch_message(payload.message_id)
-        except (discord.NotFound, discord.Forbidden, discord.HTTPException):
-            logger.error("メッセージの取得に失敗: message_id=%s", payload.message_id)
+    async def _run_job_after_window(self, job: TranslationJob) -> None:
+        """待ち時間の経過後にジョブを締め切ってスケジューラに投入する。"""
+        await asyncio.sleep(COALESCE_WINDOW)
+        # アンロード時に投入済みなら何もしない
+        if self._pending.pop(job.message_id, None) is None:
+            return
+        await self.scheduler.submit(job)
+
+    async def _process_job(self, job: TranslationJob) -> None:
+        """スケジューラのワーカーから呼ばれる（再投入されたジョブは接続とウォームアップの完了を待つ）。"""
+        await self.bot.wait_until_ready()
+        await self._warmed.wait()
+        await self._run_job(job)
+
+    async def _run_job(self, job: TranslationJob) -> None:
+        """まとめた国旗リアクションを 1 回のメッセージ取得・スレッド操作で処理する。"""
+
+        # チャンネル・メッセージの取得（キャッシュ優先）
+        with STAGE_SECONDS.time(stage="fetch_message"):
+            channel = await self.resolver.channel(job.channel_id)
+            message = await self.resolver.message(channel, job.message_id) if channel else None
+        if message is None:
             return
 
         # ボットへのメッセージへのリアクションは無視
         if message.author == self.bot.user:
             return
-
-        # ユーザー情報の取得（member が None の場合は fetch する）
-        user = payload.member
-        if user is None:
-            try:
-                user = await self.bot.fetch_user(payload.user_id)
-            except discord.HTTPException:
-                return
-
-        if user.bot:
-            return
+        if self.prefetcher is not None:
+            self.prefetcher.on_reactions(
+                job.channel_id, message.id, [flag.language for flag in job.emojis.values()]
+            )
 
         content = message.content.strip()
-        if not content:
-            logger.debug("テキストが空のため翻訳スキップ: message_id=%s", message.id)
+        segmented = segment(content)
+        if not segmented.prose:
+            logger.debug("翻訳対象の文章が無いため翻訳スキップ: message_id=%s", message.id)
             return
 
-        deepl_lang    = lang_info["deepl"]      # None = DeepL非対応
-        mymemory_lang = lang_info["mymemory"]
-        lang_label    = lang_info["label"]
+        # 同じ翻訳ターゲットに対応する国旗は最初の 1 つだけ残す。
+        # インデックスで投稿済みと分かっているターゲットは翻訳もしない。
+        registry = registry_for(job.guild_id)
+        entry = await self.index.fetch(message.id)
+        posted = _posted_targets(registry, entry.languages) if entry is not None else set()
+        by_target: dict[Language, FlagEntry] = {}
+        for flag in job.emojis.values():
+            if flag.language in posted:
+                logger.debug("翻訳済みのためスキップ: lang=%s, message_id=%s", flag.label, message.id)
+                continue
+            by_target.setdefault(flag.language, flag)
+        if not by_target:
+            return
 
         # --- 翻訳実行（スレッド作成前に行い、同言語ならスキップ） ---
-        logger.info("翻訳開始: emoji=%s lang=%s message_id=%s", emoji, lang_label, message.id)
-        translated_text, engine = translate(content, deepl_lang, mymemory_lang)
-
-        # ソース言語とターゲット言語が同じ場合は何もしない
-        if engine == "same_language":
-            logger.info("同言語のため翻訳スキップ: lang=%s message_id=%s", lang_label, message.id)
+        labels = ", ".join(flag.label for flag in by_target.values())
+        logger.info("翻訳開始: langs=%s message_id=%s", labels, message.id)
+        with STAGE_SECONDS.time(stage="detect"):
+            source_lang = detect_language(segmented.prose_text)
+        targets = list(by_target)
+        with STAGE_SECONDS.time(stage="translate"):
+            results = await translate_many(content, targets, source_lang=source_lang)
+
+        pending: list[tuple[FlagEntry, str | None, str]] = []
+        for target, (translated_text, engine) in zip(targets, results):
+            flag = by_target[target]
+            # ソース言語とターゲット言語が同じ場合は何もしない
+            if engine == "same_language":
+                logger.info("同言語のため翻訳スキップ: lang=%s message_id=%s", flag.label, message.id)
+                continue
+            pending.append((flag, translated_text, engine))
+        if not pending:
             return
 
+        # 同じメッセージへの処理はロックで直列化する（スレッドの二重作成防止）
+        lock = self.index.lock(message.id)
+        try:
+            async with lock:
+                await self._post_translations(message, registry, pending, job.created_at)
+        finally:
+            self.index.release(message.id)
+
+    async def _post_translations(
+        self,
+        message: discord.Message,
+        registry: LanguageRegistry,
+        pending: list[tuple[FlagEntry, str | None, str]],
+        started_at: float,
+    ) -> None:
+        """スレッドを用意し、未投稿の言語だけをまとめて投稿してアーカイブする。"""
+
         # --- スレッドの取得または作成 ---
-        thread, was_archived = await self._get_or_create_thread(message)
+        with STAGE_SECONDS.time(stage="thread"):
+            thread = await self._get_or_create_thread(message)
         if thread is None:
             logger.error("スレッドの取得・作成に失敗: message_id=%s", message.id)
             return
 
-        # --- 重複チェック ---
-        if await self._already_translated(thread, lang_label):
-            logger.debug("翻訳済みのためスキップ: lang=%s, message_id=%s", lang_label, message.id)
-            # アーカイブを元に戻す（元々閉じていた場合）
-            if was_archived:
-                await self._archive_thread(thread)
+        # --- 重複チェック（インデックス参照・無ければ履歴を 1 回だけ走査） ---
+        with STAGE_SECONDS.time(stage="dedupe"):
+            done = _posted_targets(registry, await self._posted_languages(message, thread))
+        posts: list[str] = []
+        entries: list[tuple[FlagEntry, bool]] = []     # 投稿順の (国旗, 翻訳できたか)
+        for flag, translated_text, engine in pending:
+            if flag.language in done:
+                logger.debug("翻訳済みのためスキップ: lang=%s, message_id=%s", flag.label, message.id)
+                continue
+            if translated_text is None:
+                logger.error("翻訳失敗: lang=%s message_id=%s", flag.label, message.id)
+            posts.append(format_post(flag.emoji, flag.label, translated_text, engine))
+            entries.append((flag, translated_text is not None))
+
+        # 投稿するものが無ければスレッドの状態には触れない
+        if not posts:
             return
 
-        if translated_text is None:
-            logger.error("翻訳失敗: message_id=%s", message.id)
-            await thread.send(
-                f"{emoji} **{lang_label} Translation failed.**\n"
-                "（すべての翻訳エンジンが利用できませんでした）"
-            )
-        else:
-            post = (
-                f"{emoji} **{lang_label} Translation (via {engine}):**\n"
-                f"{translated_text}"
+        chunks = pack_posts(posts)
+        sent: list[discord.Message] = []
+        try:
+            # アーカイブ待ちなら取り消し、アーカイブされていれば一時的に開く
+            with STAGE_SECONDS.time(stage="unarchive"):
+                thread = await self._open_thread(message.id, thread)
+            with STAGE_SECONDS.time(stage="post"):
+                await self.outbound.send_all(thread, chunks, sent)
+        except discord.HTTPException as e:
+            logger.error(
+                "翻訳投稿が途中で失敗: %d/%d 件 message_id=%s: %s",
+                len(sent), len(chunks), message.id, e,
             )
-            await thread.send(post)
-            logger.info("翻訳投稿完了: engine=%s lang=%s message_id=%s", engine, lang_label, message.id)
-
-        # --- スレッドをクローズ（アーカイブ）---
-        await self._archive_thread(thread)
-
-    # ─────────────────────────────────────────────────────────────────────
+        finally:
+            # --- スレッドをクローズ（続けて翻訳が来たら開いたまま使えるよう、少し遅らせる）---
+            # 投稿に失敗しても開いたままにしない
+            self._archive_later(message.id, thread)
+        if not sent:
+            return
 
-    async def _get_or_create_thread(
-        self, message: discord.Message
-    ) -> tuple[discord.Thread | None, bool]:
+        # 最後の断片まで投稿できた言語だけを投稿済みとして記録する（残りは次のリアクションで投稿し直す）。
+        # 途中までの断片を含むメッセージも記録し、編集の追従で書き換え・削除の対象にする
+        if len(sent) < len(chunks):
+            entries = [
+                entry for i, entry in enumerate(entries)
+                if len(pack_posts(posts[:i + 1])) <= len(sent)
+            ]
+        else:
+            REACTION_TO_POST_SECONDS.observe(time.monotonic() - started_at)
+        self.index.add_languages(message.id, {flag.label for flag, ok in entries if ok})
+        self.index.add_post(
+            message.id,
+            [m.id for m in sent],
+            {flag.label: flag.emoji for flag, _ in entries},
+            text_digest(message.content, exact=True),
+        )
+        logger.info(
+            "翻訳投稿完了: langs=%d messages=%d message_id=%s",
+            len(entries), len(sent), message.id,
+        )
+
+    async def _get_or_create_thread(self, message: discord.Message) -> discord.Thread | None:
         """
-        メッセージに紐付くスレッドを返す。
-        既存スレッドがあればそれを（アーカイブ済みなら解除して）、
-        なければ新規作成する。
-
-        Returns:
-            (thread, was_archived)
-            was_archived: 元々アーカイブ済みだったかどうか
+        メッセージに紐付くスレッドを返す（アーカイブ状態はそのまま）。
+        既存スレッドはキャッシュ優先で探し、なければ新規作成する。
         """
         if not isinstance(message.channel, (discord.TextChannel, discord.Thread)):
-            return None, False
+            return None
 
         # 既にスレッド内のメッセージの場合はそのスレッドを使う
         if isinstance(message.channel, discord.Thread):
-            return message.channel, False
+            return message.channel
 
         # メッセージに紐付く既存スレッドを探す
-        try:
-            fetched = await message.channel.fetch_message(message.id)
-            if fetched.thread:
-                thread = fetched.thread
-                was_archived = thread.archived
-                if was_archived:
-                    # アーカイブされていた場合は一時的に開く
-                    try:
-                        await thread.edit(archived=False)
-                    except (discord.Forbidden, discord.HTTPException) as e:
-                        logger.warning("スレッドのアーカイブ解除失敗: %s", e)
-                return thread, was_archived
-        except discord.NotFound:
-            return None, False
+        thread = await self.resolver.thread_for(message)
+        if thread is not None:
+            return thread
 
         # スレッドがない場合は新規作成
         try:
             thread = await message.create_thread(name=TRANSLATION_THREAD_PREFIX)
-            return thread, False
         except discord.Forbidden:
             logger.error("スレッド作成権限がありません: channel=%s", message.channel.id)
-            return None, False
+            return None
         except discord.HTTPException as e:
             logger.error("スレッド作成失敗: %s", e)
-            return None, False
+            return None
+        # 新規スレッドは投稿済み言語なしとして登録する（履歴走査不要）
+        self.index.set_thread(message.id, thread.id)
+        self.resolver.remember_thread(message.id, thread)
+        return thread
+
+    async def _open_thread(self, message_id: int, thread: discord.Thread) -> discord.Thread:
+        """
+        投稿の前に呼ぶ（メッセージ単位のロック内で）。アーカイブの予約があれば取り消し
+        （スレッドは開いたまま）、アーカイブ済みなら一時的に開く。
+        """
+        self.outbound.cancel_archive(thread.id)
+        return await self._unarchive(message_id, thread)
+
+    async def _unarchive(self, message_id: int, thread: discord.Thread) -> discord.Thread:
+        """アーカイブされていた場合は一時的に開き、更新後のスレッドを返す。"""
+        if not thread.archived:
+            return thread
+        try:
+            thread = await self.outbound.edit_thread(thread, archived=False)
+            self.resolver.remember_thread(message_id, thread)
+        except (discord.Forbidden, discord.HTTPException) as e:
+            logger.warning("スレッドのアーカイブ解除失敗: %s", e)
+        return thread
+
+    def _archive_later(self, message_id: int, thread: discord.Thread) -> None:
+        """THREAD_ARCHIVE_DELAY 秒後にアーカイブする（その間に次の投稿があれば取り消される）。"""
+
+        async def archive() -> None:
+            lock = self.index.lock(message_id)
+            try:
+                async with lock:
+                    with STAGE_SECONDS.time(stage="archive"):
+                        await self._archive_thread(message_id, thread)
+            finally:
+                self.index.release(message_id)
 
-    async def _archive_thread(self, thread: discord.Thread) -> None:
+        self.outbound.archive_later(thread.id, archive)
+
+    async def _archive_thread(self, message_id: int, thread: discord.Thread) -> None:
         """スレッドをアーカイブ（クローズ）する。"""
         try:
-            await thread.edit(archived=True)
+            thread = await self.outbound.edit_thread(thread, archived=True)
+            self.resolver.remember_thread(message_id, thread)
             logger.info("スレッドをクローズしました: thread_id=%s", thread.id)
         except discord.Forbidden:
             logger.warning("スレッドのアーカイブ権限がありません: thread_id=%s", thread.id)
         except discord.HTTPException as e:
             logger.warning("スレッドのアーカイブ失敗: %s", e)
 
-    async def _already_translated(self, thread: discord.Thread, lang_label: str) -> bool:
-        """同じ言語への翻訳が既にスレッドに投稿されているか確認する。"""
-        marker = f"**{lang_label} {TRANSLATION_MARKER}"
+    # ── 編集への追従 ───────────────────────────────────────────────────────
+
+    async def _run_edit(self, guild_id: int | None, message_id: int, content: str) -> None:
+        """編集された元メッセージの訳文を、メッセージ単位のロック内で書き換える。"""
+        await self._warmed.wait()
+        lock = self.index.lock(message_id)
         try:
-            async for msg in thread.history(limit=50):
-                if msg.author == self.bot.user and marker in msg.content:
-                    return True
+            async with lock:
+                await self._rewrite_posts(registry_for(guild_id), message_id, content.strip())
+        except Exception:
+            logger.exception("訳文の更新で予期しないエラー: message_id=%s", message_id)
+        finally:
+            self.index.release(message_id)
+
+    async def _rewrite_posts(
+        self, registry: LanguageRegistry, message_id: int, content: str
+    ) -> None:
+        """
+        投稿済みの訳文を新しい本文で作り直し、同じメッセージを編集する。
+        いずれかの言語の翻訳に失敗した投稿は書き換えず、元の訳文を残す。
+        """
+        entry = await self.index.fetch(message_id)
+        if entry is None or not entry.posts:
+            return
+        # 埋め込みの展開など、本文が変わらない更新は無視する
+        # （空白だけの編集もコードブロックの字下げ修正等なので、畳み込まずに比べる）
+        digest = text_digest(content, exact=True)
+        if digest == entry.source_digest:
+            return
+        segmented = segment(content)
+        if not segmented.prose:
+            return
+
+        flags = {label: emoji for post in entry.posts for label, emoji in post.flags.items()}
+        known = {label: registry.get(emoji) for label, emoji in flags.items()}
+        labels = [label for label, flag in known.items() if flag is not None]
+        targets = [known[label].language for label in labels]
+        logger.info("訳文の更新開始: langs=%s message_id=%s", ", ".join(labels), message_id)
+        with STAGE_SECONDS.time(stage="detect"):
+            source_lang = detect_language(segmented.prose_text)
+        with STAGE_SECONDS.time(stage="translate"):
+            results = await translate_many(content, targets, source_lang=source_lang)
+        rendered = {
+            label: format_post(flags[label], label, translated_text, engine)
+            for label, (translated_text, engine) in zip(labels, results)
+            if translated_text is not None
+        }
+
+        thread = self.resolver.cached_thread(message_id) or await self.resolver.channel(
+            entry.thread_id
+        )
+        if not isinstance(thread, discord.Thread):
+            logger.warning("訳文を更新するスレッドが見つかりません: message_id=%s", message_id)
+            return
+
+        updated_all = True
+        opened = False
+        for post in entry.posts:
+            if any(label not in rendered for label in post.flags):
+                logger.warning(
+                    "翻訳できない言語があるため訳文を更新しません: langs=%s message_id=%s",
+                    ", ".join(post.flags), message_id,
+                )
+                updated_all = False
+                continue
+            if not opened:
+                with STAGE_SECONDS.time(stage="unarchive"):
+                    thread = await self._open_thread(message_id, thread)
+                opened = True
+            chunks = pack_posts([rendered[label] for label in post.flags])
+            with STAGE_SECONDS.time(stage="edit"):
+                message_ids = await self._replace_messages(thread, post.message_ids, chunks)
+            self.index.update_post(message_id, post, message_ids)
+            self.index.add_languages(message_id, set(post.flags))
+
+        if updated_all:
+            self.index.set_source_digest(message_id, digest)
+        if opened:
+            logger.info("訳文を更新しました: message_id=%s", message_id)
+            self._archive_later(message_id, thread)
+
+    async def _replace_messages(
+        self, thread: discord.Thread, message_ids: list[int], chunks: list[str]
+    ) -> list[int]:
+        """
+        投稿済みメッセージを新しい内容に書き換える。
+        分割数が増えた分は新規投稿し、減った分は削除する。書き換え後のメッセージ ID を返す。
+        """
+        new_ids: list[int] = []
+        for i, chunk in enumerate(chunks):
+            if i < len(message_ids):
+                try:
+                    await self.outbound.edit_message(
+                        thread.id, thread.get_partial_message(message_ids[i]), chunk
+                    )
+                    new_ids.append(message_ids[i])
+                    continue
+                except discord.NotFound:
+                    pass    # 削除されていたら新規投稿する
+                except discord.HTTPException as e:
+                    logger.warning("訳文の編集に失敗: %s", e)
+                    new_ids.append(message_ids[i])
+                    continue
+            try:
+                new_ids.append((await self.outbound.send(thread, chunk)).id)
+            except discord.HTTPException as e:
+                logger.warning("訳文の投稿に失敗: %s", e)
+        for surplus in message_ids[len(chunks):]:
+            try:
+                await self.outbound.delete_message(thread.id, thread.get_partial_message(surplus))
+            except discord.HTTPException as e:
+                logger.warning("不要になった訳文の削除に失敗: %s", e)
+        return new_ids
+
+    async def _posted_languages(self, message: discord.Message, thread: discord.Thread) -> set[str]:
+        """
+        スレッドに投稿済みの言語ラベルを返す。
+        インデックスに無い場合だけ履歴を 1 回走査して、ボット自身の投稿から再構築する。
+        """
+        entry = await self.index.fetch(message.id)
+        if entry is not None and entry.thread_id == thread.id:
+            return entry.languages
+
+        found: set[str] = set()
+        try:
+            async for msg in thread.history(limit=100):
+                if msg.author == self.bot.user:
+                    found.update(TRANSLATION_LABEL_PATTERN.findall(msg.content))
         except discord.Forbidden:
             logger.warning("スレッド履歴の読み取り権限がありません: thread=%s", thread.id)
         except discord.HTTPException as e:
             logger.warning("スレッド履歴取得エラー: %s", e)
-        return False
+            return found
+
+        self.index.set_thread(message.id, thread.id)
+        self.index.add_languages(message.id, found)
+        return found
+
+    # ── 履歴の一括翻訳 ─────────────────────────────────────────────────────
+
+    @app_commands.command(
+        name="translate-history",
+        description="チャンネルの過去のメッセージをまとめて翻訳し、スレッドに投稿します",
+    )
+    @app_commands.describe(
+        channel="翻訳するチャンネル",
+        lang="翻訳先の国旗絵文字（例: 🇯🇵）",
+        limit="走査するメッセージ数（新しい順）",
+        resume="前回の続きから再開する（False なら最新から新しいスレッドに翻訳し直す）",
+    )
+    @app_commands.guild_only()
+    @app_commands.default_permissions(manage_messages=True)
+    async def translate_history(
+        self,
+        interaction: discord.Interaction,
+        channel: discord.TextChannel,
+        lang: str,
+        limit: app_commands.Range[int, 1, HISTORY_MAX_LIMIT] = 100,
+        resume: bool = True,
+    ):
+        flag = registry_for(interaction.guild_id).get(lang.strip())
+        if flag is None:
+            await interaction.response.send_message(
+                f"{lang} は翻訳に使える国旗ではありません。", ephemeral=True
+            )
+            return
+        if not channel.permissions_for(interaction.user).read_message_history:
+            await interaction.response.send_message(
+                f"{channel.mention} の履歴を読む権限がありません。", ephemeral=True
+            )
+            return
+        key = (channel.id, flag.language)
+        if key in self._history_runs:
+            await interaction.response.send_message(
+                f"{channel.mention} の {flag.label} への翻訳は実行中です。", ephemeral=True
+            )
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        task = asyncio.create_task(self._run_history(interaction, channel, flag, limit, resume))
+        self._history_runs[key] = task
+        task.add_done_callback(lambda _: self._history_runs.pop(key, None))
+
+    async def _run_history(
+        self,
+        interaction: discord.Interaction,
+        channel: discord.TextChannel,
+        flag: FlagEntry,
+        limit: int,
+        resume: bool,
+    ) -> None:
+        try:
+            summary = await self._translate_history(interaction, channel, flag, limit, resume)
+        except asyncio.CancelledError:
+            await self._history_progress(interaction, "ボットの停止により中断しました（次回は続きから再開できます）。")
+            raise
+        except discord.Forbidden:
+            logger.error("履歴翻訳の権限がありません: channel=%s", channel.id)
+            summary = "ボットに履歴の読み取り・スレッドの作成・投稿の権限がありません。"
+        except Exception:
+            logger.exception("履歴翻訳で予期しないエラー: channel=%s", channel.id)
+            summary = "予期しないエラーで中断しました（次回は続きから再開できます）。"
+        await self._history_progress(interaction, summary)
+
+    async def _translate_history(
+        self,
+        interaction: discord.Interaction,
+        channel: discord.TextChannel,
+        flag: FlagEntry,
+        limit: int,
+        resume: bool,
+    ) -> str:
+        """履歴を新しい順に翻訳して 1 本のスレッドに投稿し、結果の要約を返す。"""
+        await self._warmed.wait()
+        language = flag.language
+        checkpoint = await self.history.get(channel.id, language.key) if resume else None
+        thread = await self._history_thread(channel, checkpoint)
+        if thread is None:
+            thread = await channel.create_thread(
+                name=f"{TRANSLATION_THREAD_PREFIX} ({flag.label} history)",
+                type=discord.ChannelType.public_thread,
+            )
+            checkpoint = HistoryCheckpoint(channel.id, language.key, thread.id)
+        logger.info(
+            "履歴翻訳を開始: channel=%s lang=%s limit=%d before=%s",
+            channel.id, flag.label, limit, checkpoint.last_message_id,
+        )
+
+        scanned = translated = 0
+        pipeline = history_pipeline(
+            channel, language, self.bot.user, limit, before=checkpoint.last_message_id
+        )
+        async for batch in pipeline:
+            failed = sum(1 for item in batch.items if item.translated is None)
+            if batch.items and failed == len(batch.items):
+                # エンジンが全滅している。再開位置は進めずに止める
+                HISTORY_MESSAGES.inc(failed, result="failed")
+                return (
+                    f"翻訳エンジンが利用できないため中断しました（{scanned} 件走査・{translated} 件翻訳）。"
+                    "しばらくしてから再実行すると続きから再開します。"
+                )
+
+            # 国旗リアクションの翻訳を優先する
+            while not self.scheduler.idle:
+                await asyncio.sleep(HISTORY_IDLE_POLL_INTERVAL)
+            for chunk in pack_posts([format_history_post(item) for item in batch.items]):
+                await self.outbound.send(thread, chunk)
+                await asyncio.sleep(HISTORY_POST_INTERVAL)
+
+            HISTORY_MESSAGES.inc(len(batch.items) - failed, result="translated")
+            HISTORY_MESSAGES.inc(batch.skipped, result="skipped")
+            HISTORY_MESSAGES.inc(failed, result="failed")
+            scanned += batch.scanned
+            translated += len(batch.items) - failed
+            checkpoint.last_message_id = batch.last_message_id
+            checkpoint.processed += batch.scanned
+            checkpoint.translated += len(batch.items) - failed
+            await self.history.save(checkpoint)
+            await self._history_progress(
+                interaction,
+                f"{channel.mention} → {flag.emoji} {flag.label}: "
+                f"{scanned} / {limit} 件走査・{translated} 件翻訳（{thread.mention}）",
+            )
+
+        logger.info(
+            "履歴翻訳が完了: channel=%s lang=%s scanned=%d translated=%d",
+            channel.id, flag.label, scanned, translated,
+        )
+        where = "チャンネルの先頭まで" if scanned < limit else "指定の件数まで"
+        return f"{where}翻訳しました（{scanned} 件走査・{translated} 件を {thread.mention} に投稿）。"
+
+    async def _history_thread(
+        self, channel: discord.TextChannel, checkpoint: HistoryCheckpoint | None
+    ) -> discord.Thread | None:
+        """再開するスレッドを返す（記録が無い・スレッドが消えていれば None）。アーカイブされていれば開く。"""
+        if checkpoint is None:
+            return None
+        thread = channel.guild.get_thread(checkpoint.thread_id)
+        if thread is None:
+            try:
+                thread = await self.bot.fetch_channel(checkpoint.thread_id)
+            except (discord.NotFound, discord.Forbidden):
+                await self.history.delete(checkpoint.channel_id, checkpoint.language)
+                return None
+        if not isinstance(thread, discord.Thread):
+            return None
+        if thread.archived:
+            thread = await self.outbound.edit_thread(thread, archived=False)
+        return thread
+
+    async def _history_progress(self, interaction: discord.Interaction, content: str) -> None:
+        """コマンドの応答（実行者にだけ見える）を進捗で書き換える。応答の期限切れ等は無視する。"""
+        try:
+            await interaction.edit_original_response(content=content)
+        except discord.HTTPException as e:
+            logger.debug("履歴翻訳の進捗を更新できません: %s", e)
+
+    # ── 先読み翻訳 ─────────────────────────────────────────────────────────
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        """先読み翻訳が有効なチャンネルの新着メッセージを統計に加え、必要なら先読みを予約する。"""
+        if self.prefetcher is None or message.guild is None or message.author.bot:
+            return
+        self.prefetcher.on_message(message)
+
+    # ── キャッシュの追従 ───────────────────────────────────────────────────
+
+    @commands.Cog.listener()
+    async def on_raw_thread_update(self, payload: discord.RawThreadUpdateEvent):
+        """スレッドのアーカイブ状態の変化をキャッシュに反映する。"""
+        self.resolver.on_thread_update(payload)
+
+    @commands.Cog.listener()
+    async def on_raw_thread_delete(self, payload: discord.RawThreadDeleteEvent):
+        """削除されたスレッドをインデックスとキャッシュから外す。"""
+        self.index.forget_thread(payload.thread_id)
+        self.resolver.forget_thread(payload.thread_id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        """
+        編集されたメッセージはキャッシュから外し、次回は最新の本文を使う。
+        訳文を投稿済みのメッセージなら、訳文も書き換える。
+        """
+        self.resolver.forget_message(payload.message_id)
+
+        content = payload.data.get("content")
+        if content is None or self._unloading:
+            return
+        entry = await self.index.fetch(payload.message_id)
+        if entry is None or not entry.posts or self._unloading:
+            return
+        task = asyncio.create_task(self._run_edit(payload.guild_id, payload.message_id, content))
+        self._edits.add(task)
+        task.add_done_callback(self._edits.discard)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.resolver.forget_message(payload.message_id)
 
 
 async def setup(bot: commands.Bot):
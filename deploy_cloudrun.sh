@@ -67,7 +67,7 @@ gcloud run deploy "$SERVICE_NAME" \
   --memory=512Mi \
   --timeout=3600 \
   --set-secrets="DISCORD_TOKEN=DISCORD_TOKEN:latest,DEEPL_API_KEY=DEEPL_API_KEY:latest" \
-  --set-env-vars="MYMEMORY_EMAIL=$(grep '^MYMEMORY_EMAIL=' .env 2>/dev/null | cut -d'=' -f2- || echo '')"
+  --set-env-vars="LOW_MEMORY=1,MYMEMORY_EMAIL=$(grep '^MYMEMORY_EMAIL=' .env 2>/dev/null | cut -d'=' -f2- || echo '')"
 
 echo ""
 echo "✅ デプロイ完了！"
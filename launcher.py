@@ -0,0 +1,169 @@
+"""
+シャード分割ランチャー
+
+main.py を SHARD_PROCESSES 個（既定は CPU コア数）のプロセスで起動し、
+シャード ID を振り分ける。各プロセスは自分の担当シャードだけ Discord に接続するので、
+ゲートウェイイベントの処理を複数コアに分散できる。
+
+  python launcher.py
+
+- SHARD_COUNT が未設定（または auto）なら Discord 推奨のシャード数を /gateway/bot から取得する。
+- IDENTIFY のレート制限（max_concurrency ごとに 5 秒に 1 回）に合わせて起動をずらす。
+- プロセス i のヘルスチェックサーバーは PORT + i で待ち受ける。
+- SQLite / JSON のファイルパス（ジョブジャーナル・スレッドインデックス）はプロセスごとに分ける。
+  複数プロセスで状態を共有するには STATE_BACKEND_URL（Redis 等）を設定する。
+- SIGTERM / SIGINT は全プロセスに転送し、異常終了したプロセスは再起動する。
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("launcher")
+
+DISCORD_GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+IDENTIFY_INTERVAL = 5.0       # 同じ max_concurrency バケットの IDENTIFY 間隔（秒）
+RESTART_BACKOFF = (1, 5, 15, 60)
+
+# プロセスごとに別のファイルにする環境変数（SQLite / JSON の同時書き込みを避ける）
+PER_PROCESS_PATHS = ("JOB_JOURNAL_PATH", "THREAD_INDEX_PATH", "HISTORY_CHECKPOINT_PATH")
+
+
+async def fetch_recommended_shards(token: str) -> tuple[int, int]:
+    """Discord 推奨のシャード数と IDENTIFY の max_concurrency を返す。"""
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(DISCORD_GATEWAY_BOT_URL, headers=headers) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    limit = data.get("session_start_limit", {})
+    return int(data["shards"]), int(limit.get("max_concurrency", 1))
+
+
+def assign_shards(shard_count: int, processes: int) -> list[list[int]]:
+    """シャード ID をプロセスに順番に配る（空のプロセスは作らない）。"""
+    groups = [list(range(i, shard_count, processes)) for i in range(processes)]
+    return [group for group in groups if group]
+
+
+def per_process_path(path: str, index: int) -> str:
+    """"jobs.db" → "jobs.0.db" のようにプロセス番号を付ける。"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{index}{ext}"
+
+
+def child_env(index: int, shard_ids: list[int], shard_count: int) -> dict[str, str]:
+    env = dict(os.environ)
+    env["SHARD_COUNT"] = str(shard_count)
+    env["SHARD_IDS"] = ",".join(map(str, shard_ids))
+    env["PORT"] = str(int(os.getenv("PORT", "8080")) + index)
+    for name in PER_PROCESS_PATHS:
+        path = os.getenv(name, "").strip()
+        if path:
+            env[name] = per_process_path(path, index)
+    return env
+
+
+class ShardProcess:
+    """1 プロセス分（担当シャードの組）。異常終了したら再起動する。"""
+
+    def __init__(self, index: int, shard_ids: list[int], shard_count: int):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process: asyncio.subprocess.Process | None = None
+
+    async def run(self, start_delay: float, stopping: asyncio.Event) -> None:
+        if start_delay:
+            try:
+                await asyncio.wait_for(stopping.wait(), start_delay)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+        restarts = 0
+        while not stopping.is_set():
+            logger.info("プロセス %d を起動: shards=%s", self.index, self.shard_ids)
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, "main.py",
+                env=child_env(self.index, self.shard_ids, self.shard_count),
+            )
+            code = await self.process.wait()
+            if stopping.is_set():
+                break
+            delay = RESTART_BACKOFF[min(restarts, len(RESTART_BACKOFF) - 1)]
+            logger.warning(
+                "プロセス %d が終了しました（code=%s）。%d 秒後に再起動します", self.index, code, delay
+            )
+            restarts += 1
+            try:
+                await asyncio.wait_for(stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        logger.info("プロセス %d を停止しました", self.index)
+
+    def terminate(self) -> None:
+        if self.process is not None and self.process.returncode is None:
+            self.process.send_signal(signal.SIGTERM)
+
+
+async def main() -> None:
+    token = os.getenv("DISCORD_TOKEN", "").strip()
+    if not token:
+        raise ValueError("環境変数 DISCORD_TOKEN が設定されていません。.env ファイルを確認してください。")
+
+    max_concurrency = 1
+    shard_count_env = os.getenv("SHARD_COUNT", "").strip().lower()
+    if shard_count_env and shard_count_env != "auto":
+        shard_count = int(shard_count_env)
+    else:
+        shard_count, max_concurrency = await fetch_recommended_shards(token)
+    processes = int(os.getenv("SHARD_PROCESSES", "") or os.cpu_count() or 1)
+    groups = assign_shards(shard_count, processes)
+    logger.info("シャード数 %d を %d プロセスで起動します", shard_count, len(groups))
+    if not os.getenv("STATE_BACKEND_URL", "").strip() and len(groups) > 1:
+        logger.warning(
+            "STATE_BACKEND_URL が未設定のため、キャッシュ・使用量・投稿済み言語はプロセスごとに別管理です"
+        )
+
+    stopping = asyncio.Event()
+    children = [ShardProcess(i, shard_ids, shard_count) for i, shard_ids in enumerate(groups)]
+
+    def stop() -> None:
+        if stopping.is_set():
+            return
+        logger.info("停止シグナルを受信しました。全プロセスに転送します")
+        stopping.set()
+        for child in children:
+            child.terminate()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop)
+        except NotImplementedError:
+            pass
+
+    # 先に起動したプロセスの IDENTIFY が終わる頃に次を起動する
+    delays = []
+    identified = 0
+    for shard_ids in groups:
+        delays.append(identified / max_concurrency * IDENTIFY_INTERVAL)
+        identified += len(shard_ids)
+    await asyncio.gather(*(child.run(delay, stopping) for child, delay in zip(children, delays)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
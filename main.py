@@ -2,17 +2,35 @@
 Discord 翻訳ボット エントリポイント
 
 国旗絵文字リアクションをトリガーに、メッセージを翻訳してスレッドに投稿する。
+
+SHARD_COUNT を設定するとシャード分割モード（AutoShardedBot）で起動する。
+SHARD_IDS で担当するシャードを指定でき、launcher.py が複数プロセスに振り分けて使う。
+
+ウォームアップ（cogs.translator）はゲートウェイへのログイン・接続と並行して進み、
+両方が済むとヘルスチェックサーバーの /ready が 200 を返す（起動時間の内訳もログに出す）。
 """
 
 import asyncio
 import logging
 import os
+import signal
+import time
+
+_started = time.perf_counter()   # import 時間の計測用（以降の import より前に取る）
 
 import discord
 from aiohttp import web
 from discord.ext import commands
 from dotenv import load_dotenv
 
+from utils import metrics
+from utils.memory import gateway_cache_sizes, gateway_options, register_caches
+from utils.outbound import NO_MENTIONS, RATE_LIMITS
+from utils.startup import GATEWAY, STARTUP
+
+STARTUP.started_at = _started
+STARTUP.record("import", time.perf_counter() - _started)
+
 # .env ファイルを読み込む
 load_dotenv()
 
@@ -30,20 +48,70 @@ intents.message_content = True   # メッセージ本文の読み取り
 intents.reactions = True          # リアクションの検知
 intents.guild_messages = True     # ギルドのメッセージ
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+def _create_bot() -> commands.Bot:
+    """
+    SHARD_COUNT 未設定なら通常の Bot、設定されていれば AutoShardedBot を作る。
+      SHARD_COUNT=auto    Discord 推奨のシャード数をこのプロセスで全部受け持つ
+      SHARD_COUNT=N       全体のシャード数（SHARD_IDS=0,2,4 等で担当分だけ接続）
+    LOW_MEMORY=1 なら intents とキャッシュを絞る（utils.memory）。
+    HTTP の応答ヘッダからレート制限を追跡する（utils.outbound）。
+    訳文は原文のメンションを含むので、既定で誰にも通知しない（コマンドの応答も含む）。
+    """
+    options = gateway_options(intents)
+    options["http_trace"] = RATE_LIMITS.trace_config()
+    options["allowed_mentions"] = NO_MENTIONS
+    shard_count = os.getenv("SHARD_COUNT", "").strip().lower()
+    if not shard_count:
+        return commands.Bot(command_prefix="!", **options)
+
+    shard_ids = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None
+    if shard_count == "auto":
+        if shard_ids is not None:
+            raise ValueError("SHARD_IDS を指定する場合は SHARD_COUNT に全体のシャード数を設定してください。")
+        return commands.AutoShardedBot(command_prefix="!", **options)
+    return commands.AutoShardedBot(
+        command_prefix="!",
+        shard_count=int(shard_count),
+        shard_ids=shard_ids,
+        **options,
+    )
+
+
+bot = _create_bot()
+register_caches("gateway", lambda: gateway_cache_sizes(bot))
 
 
 # ── ヘルスチェック HTTP サーバー（Cloud Run 用） ──────────────────────────
 async def _health(_request: web.Request) -> web.Response:
-    """Cloud Run / ロードバランサ向けヘルスチェック"""
+    """Cloud Run / ロードバランサ向けヘルスチェック（プロセスが動いていれば ok）"""
     return web.Response(text="ok")
 
 
+async def _ready(_request: web.Request) -> web.Response:
+    """準備完了チェック。ゲートウェイ接続とウォームアップが済むまでは 503 を返す。"""
+    if bot.is_closed():
+        return web.Response(status=503, text="closed")
+    if not STARTUP.ready:
+        return web.Response(status=503, text="starting: " + ", ".join(STARTUP.waiting))
+    return web.Response(text="ready")
+
+
+async def _metrics(_request: web.Request) -> web.Response:
+    """Prometheus 形式のメトリクス"""
+    return web.Response(
+        text=metrics.render(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
 async def _start_health_server() -> None:
     """バックグラウンドでヘルスチェック用 HTTP サーバーを起動する。"""
     port = int(os.getenv("PORT", "8080"))
     app = web.Application()
     app.router.add_get("/health", _health)
+    app.router.add_get("/ready", _ready)
+    app.router.add_get("/metrics", _metrics)
     app.router.add_get("/", _health)          # Cloud Run デフォルト
     runner = web.AppRunner(app)
     await runner.setup()
@@ -52,10 +120,60 @@ async def _start_health_server() -> None:
     logger.info("ヘルスチェックサーバー起動: 0.0.0.0:%d", port)
 
 
+# ── 終了処理 ──────────────────────────────────────────────────────────────
+async def _shutdown(sig: signal.Signals) -> None:
+    """bot.close() でコグをアンロードし、処理中・待機中の翻訳ジョブを終えてから切断する。"""
+    logger.info("%s を受信しました。翻訳ジョブを処理し切ってから終了します", sig.name)
+    await bot.close()
+
+
+def _install_signal_handlers() -> None:
+    """SIGTERM（Cloud Run / Fly.io の停止）と SIGINT で穏やかに終了する。"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, lambda s=sig: asyncio.create_task(_shutdown(s)))
+        except NotImplementedError:
+            # Windows ではシグナルハンドラを登録できない（Ctrl+C は従来どおり）
+            pass
+
+
 @bot.event
 async def on_ready():
+    STARTUP.end(GATEWAY)
+    STARTUP.mark_ready(GATEWAY)
     logger.info("ボット起動完了: %s (ID: %s)", bot.user, bot.user.id)
     logger.info("接続サーバー数: %d", len(bot.guilds))
+    if isinstance(bot, commands.AutoShardedBot):
+        logger.info("担当シャード: %s / 全 %s", sorted(bot.shards), bot.shard_count)
+    global _sync_task
+    if _sync_task is None and _should_sync_commands():
+        # 準備完了を待たせないよう裏で行う（再接続で on_ready が再び呼ばれても 1 回だけ）
+        _sync_task = asyncio.create_task(_sync_commands(), name="command-sync")
+
+
+_sync_task: asyncio.Task | None = None
+
+
+def _should_sync_commands() -> bool:
+    """
+    SYNC_COMMANDS=1 のときだけスラッシュコマンドを登録する。登録は Discord 側に残り、
+    1 日の登録回数にも上限があるので、コマンドを追加・変更したデプロイでだけ有効にする。
+    シャード分割時はシャード 0 を担当するプロセスだけが行う。
+    """
+    if os.getenv("SYNC_COMMANDS", "").strip().lower() not in ("1", "true", "yes"):
+        return False
+    shard_ids = getattr(bot, "shard_ids", None)
+    return shard_ids is None or 0 in shard_ids
+
+
+async def _sync_commands() -> None:
+    """スラッシュコマンド（/translate-history）を Discord に登録する。"""
+    try:
+        synced = await bot.tree.sync()
+        logger.info("スラッシュコマンドを登録しました: %d 件", len(synced))
+    except discord.HTTPException as e:
+        logger.error("スラッシュコマンドの登録に失敗: %s", e)
 
 
 async def main():
@@ -66,10 +184,23 @@ async def main():
     # ヘルスチェック用 HTTP サーバーを起動（Cloud Run / GCP 用）
     await _start_health_server()
 
-    async with bot:
-        await bot.load_extension("cogs.translator")
-        logger.info("コグ cogs.translator を読み込みました")
-        await bot.start(token)
+    # メトリクス: イベントループ遅延の監視と Discord レート制限待ちの計数
+    metrics.install_rate_limit_hook()
+    lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag())
+    _install_signal_handlers()
+
+    try:
+        async with bot:
+            # コグの読み込みはウォームアップを裏で始めるだけなので、すぐにログインへ進む
+            with STARTUP.phase("extension"):
+                await bot.load_extension("cogs.translator")
+            logger.info("コグ cogs.translator を読み込みました")
+            with STARTUP.phase("login"):
+                await bot.login(token)
+            STARTUP.begin(GATEWAY)      # on_ready で締める
+            await bot.connect(reconnect=True)
+    finally:
+        lag_monitor.cancel()
 
 
 if __name__ == "__main__":
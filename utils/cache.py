@@ -0,0 +1,348 @@
+"""
+翻訳結果キャッシュ
+
+2 層構成:
+  1. メモリ上の LRU（件数上限 + TTL）
+  2. SQLite（オプション・再起動後も保持）
+共有の状態バックエンド（utils.state、Redis 等）があれば 1 と 2 の間に挟み、
+シャードを分けた複数プロセスで同じ翻訳を共有する。
+
+キーは「テキストのハッシュ + ターゲット言語コード」。
+同じ告知文が複数チャンネルで同じ国旗リアクションを受けても、
+DeepL / MyMemory の文字数枠を消費するのは初回だけになる。
+メッセージ全文に加えて文単位でも保存する（翻訳メモリ）ため、編集されたメッセージや
+一部だけ変えたテンプレートでも、変わった文だけを翻訳すればよい。
+文単位のキーは空白を畳み込んだテキストから作るが、メッセージ全文のキーは原文どおり
+（exact=True）にする。全文の訳にはコードブロック等の保護スパンがそのまま入っているので、
+空白だけ違うメッセージに別のメッセージのコードブロックを返さないように。
+
+汎用の小さな TTL 付き LRU（TTLCache）もここに置く。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Generic, Hashable, TypeVar
+
+from utils.memory import memory_profile
+from utils.state import StateBackend, get_state
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 7 * 24 * 60 * 60    # 7 日
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """件数上限と有効期限つきのメモリ LRU。"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if time.monotonic() > expires_at:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> V | None:
+        item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+@dataclass(frozen=True)
+class CachedTranslation:
+    """キャッシュされた翻訳結果。"""
+    text: str
+    engine: str
+    created_at: float
+
+
+def normalize_text(text: str) -> str:
+    """キャッシュキー用にテキストを正規化する（NFC・前後空白除去・空白の畳み込み）。"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_digest(text: str, exact: bool = False) -> str:
+    """
+    正規化テキストの SHA-256（16 進）。
+    exact=True なら空白を畳み込まない（NFC と前後空白の除去だけ）。
+    """
+    if exact:
+        normalized = unicodedata.normalize("NFC", text).strip()
+    else:
+        normalized = normalize_text(text)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def make_key(text: str, target: str, exact: bool = False) -> str:
+    """テキストの SHA-256 とターゲット言語コードからキーを作る（exact は text_digest と同じ）。"""
+    return f"{target}:{text_digest(text, exact)}"
+
+
+class TranslationCache:
+    """メモリ LRU + SQLite の 2 層翻訳キャッシュ。"""
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL,
+        db_path: str | None = None,
+        shared: StateBackend | None = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._memory: OrderedDict[str, CachedTranslation] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if db_path:
+            self._open_db(db_path)
+
+    # ── SQLite ─────────────────────────────────────────────────────────────
+
+    def _open_db(self, db_path: str) -> None:
+        """SQLite を開き、テーブル作成と期限切れ行の削除を行う。"""
+        try:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                " key TEXT PRIMARY KEY,"
+                " text TEXT NOT NULL,"
+                " engine TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "DELETE FROM translations WHERE created_at < ?",
+                (time.time() - self.ttl,),
+            )
+            conn.commit()
+            self._db = conn
+            logger.info("翻訳キャッシュ DB を開きました: %s", db_path)
+        except sqlite3.Error as e:
+            logger.warning("翻訳キャッシュ DB を開けません（メモリのみで動作）: %s", e)
+            self._db = None
+
+    def _db_get_many(self, keys: list[str]) -> dict[str, CachedTranslation]:
+        placeholders = ",".join("?" * len(keys))
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT key, text, engine, created_at FROM translations"
+                f" WHERE key IN ({placeholders})",
+                keys,
+            ).fetchall()
+        return {row[0]: CachedTranslation(*row[1:]) for row in rows}
+
+    def _db_put_many(self, items: list[tuple[str, CachedTranslation]]) -> None:
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO translations (key, text, engine, created_at)"
+                " VALUES (?, ?, ?, ?)",
+                [(key, e.text, e.engine, e.created_at) for key, e in items],
+            )
+            self._db.commit()
+
+    def _db_delete_many(self, keys: list[str]) -> None:
+        with self._db_lock:
+            self._db.executemany("DELETE FROM translations WHERE key = ?", [(k,) for k in keys])
+            self._db.commit()
+
+    # ── 共有バックエンド ───────────────────────────────────────────────────
+
+    async def _shared_get_many(self, keys: list[str]) -> dict[str, CachedTranslation]:
+        try:
+            values = await self.shared.get_many([self.shared.key(f"tr:{k}") for k in keys])
+        except Exception as e:
+            logger.warning("共有キャッシュの読み込み失敗: %s", e)
+            return {}
+        found = {}
+        for key, value in zip(keys, values):
+            if value is not None:
+                text, engine, created_at = json.loads(value)
+                found[key] = CachedTranslation(text, engine, created_at)
+        return found
+
+    async def _shared_put_many(self, entries: list[tuple[str, CachedTranslation]]) -> None:
+        items = {
+            self.shared.key(f"tr:{key}"): json.dumps(
+                [entry.text, entry.engine, entry.created_at], ensure_ascii=False
+            )
+            for key, entry in entries
+        }
+        try:
+            await self.shared.set_many(items, self.ttl)
+        except Exception as e:
+            logger.warning("共有キャッシュの書き込み失敗: %s", e)
+
+    # ── メモリ LRU ─────────────────────────────────────────────────────────
+
+    def _expired(self, entry: CachedTranslation) -> bool:
+        return time.time() - entry.created_at > self.ttl
+
+    def _memory_put(self, key: str, entry: CachedTranslation) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _memory_get(self, key: str) -> CachedTranslation | None:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            del self._memory[key]
+            self.expirations += 1
+            return None
+        self._memory.move_to_end(key)
+        return entry
+
+    # ── 公開 API ───────────────────────────────────────────────────────────
+
+    async def get(self, text: str, target: str, exact: bool = False) -> CachedTranslation | None:
+        """キャッシュを引く。メモリ → SQLite の順に探し、なければ None。"""
+        return (await self.get_many([text], target, exact))[0]
+
+    async def get_many(
+        self, texts: list[str], target: str, exact: bool = False
+    ) -> list[CachedTranslation | None]:
+        """
+        複数のテキスト（文単位の翻訳メモリ等）をまとめて引く。
+        メモリに無いものだけを SQLite に 1 回のクエリで問い合わせる。
+        exact=True はメッセージ全文用（空白を畳み込まないキー）。
+        """
+        keys = [make_key(text, target, exact) for text in texts]
+        found: dict[str, CachedTranslation] = {}
+        for key in keys:
+            entry = self._memory_get(key)
+            if entry is not None:
+                found[key] = entry
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing and self.shared is not None:
+            for key, entry in (await self._shared_get_many(missing)).items():
+                self._memory_put(key, entry)
+                found[key] = entry
+                self.shared_hits += 1
+            missing = [key for key in missing if key not in found]
+
+        if missing and self._db is not None:
+            try:
+                rows = await asyncio.to_thread(self._db_get_many, missing)
+            except sqlite3.Error as e:
+                logger.warning("翻訳キャッシュ DB 読み込み失敗: %s", e)
+                rows = {}
+            expired = []
+            for key, entry in rows.items():
+                if self._expired(entry):
+                    expired.append(key)
+                    continue
+                self._memory_put(key, entry)
+                found[key] = entry
+                self.disk_hits += 1
+            if expired:
+                self.expirations += len(expired)
+                try:
+                    await asyncio.to_thread(self._db_delete_many, expired)
+                except sqlite3.Error:
+                    pass
+
+        results = [found.get(key) for key in keys]
+        hits = sum(entry is not None for entry in results)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    async def put(
+        self, text: str, target: str, translated: str, engine: str, exact: bool = False
+    ) -> None:
+        """翻訳結果をキャッシュに保存する。"""
+        await self.put_many([(text, translated)], target, engine, exact)
+
+    async def put_many(
+        self, items: list[tuple[str, str]], target: str, engine: str, exact: bool = False
+    ) -> None:
+        """(原文, 訳文) の組をまとめて保存する（SQLite への書き込みは 1 トランザクション）。"""
+        now = time.time()
+        entries = [(make_key(text, target, exact), CachedTranslation(translated, engine, now))
+                   for text, translated in items]
+        for key, entry in entries:
+            self._memory_put(key, entry)
+        if self.shared is not None and entries:
+            await self._shared_put_many(entries)
+        if self._db is not None and entries:
+            try:
+                await asyncio.to_thread(self._db_put_many, entries)
+            except sqlite3.Error as e:
+                logger.warning("翻訳キャッシュ DB 書き込み失敗: %s", e)
+
+    def stats(self) -> dict[str, int]:
+        """ヒット/ミス/追い出し等のカウンタを返す。"""
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def close(self) -> None:
+        """SQLite 接続を閉じる。"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+
+def cache_from_env() -> TranslationCache:
+    """環境変数の設定から TranslationCache を作る（共有バックエンドがあれば併用する）。"""
+    state = get_state()
+    return TranslationCache(
+        max_entries=int(
+            os.getenv("TRANSLATION_CACHE_SIZE", str(memory_profile().translation_cache_entries))
+        ),
+        ttl=float(os.getenv("TRANSLATION_CACHE_TTL", str(DEFAULT_TTL))),
+        db_path=os.getenv("TRANSLATION_CACHE_DB", "").strip() or None,
+        shared=state if state.shared else None,
+    )
@@ -0,0 +1,143 @@
+"""
+ソース言語検出
+
+1. 文字種（Unicode ブロック）だけで一意に決まる言語は即決する。
+   かな → ja / ハングル → ko / タイ文字 → th / アラビア文字 → ar (fa, ur)
+   キリル文字 → ru (uk) / ヘブライ文字 → he / ギリシャ文字 → el
+2. それ以外（ラテン文字・漢字のみ等）は langdetect にフォールバックする。
+
+langdetect はシード固定で決定的に動かし、プロファイルは warmup() で起動時に読み込む。
+結果はテキスト単位でメモ化し、同じメッセージを二度検出しない。
+"""
+
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = "en"
+DETECTION_CACHE_SIZE = 2048
+
+# (開始, 終了, 文字種)
+_SCRIPT_RANGES: tuple[tuple[int, int, str], ...] = (
+    (0x3040, 0x30FF, "kana"),       # ひらがな・カタカナ
+    (0x31F0, 0x31FF, "kana"),       # カタカナ拡張
+    (0xFF66, 0xFF9F, "kana"),       # 半角カタカナ
+    (0x1100, 0x11FF, "hangul"),     # ハングル字母
+    (0x3130, 0x318F, "hangul"),     # ハングル互換字母
+    (0xAC00, 0xD7AF, "hangul"),     # ハングル音節
+    (0x0E00, 0x0E7F, "thai"),
+    (0x0600, 0x06FF, "arabic"),
+    (0x0750, 0x077F, "arabic"),
+    (0xFB50, 0xFDFF, "arabic"),
+    (0xFE70, 0xFEFF, "arabic"),
+    (0x0400, 0x052F, "cyrillic"),
+    (0x0590, 0x05FF, "hebrew"),
+    (0x0370, 0x03FF, "greek"),
+    (0x1F00, 0x1FFF, "greek"),
+    (0x4E00, 0x9FFF, "han"),
+    (0x3400, 0x4DBF, "han"),
+)
+
+_SCRIPT_TO_LANG = {
+    "kana": "ja",
+    "hangul": "ko",
+    "thai": "th",
+    "arabic": "ar",
+    "cyrillic": "ru",
+    "hebrew": "he",
+    "greek": "el",
+}
+
+# 同じ文字種を使う言語を判別するための固有文字
+_PERSIAN_CHARS = frozenset("پچژگکی")
+_URDU_CHARS = frozenset("ٹڈڑںےہ")
+_UKRAINIAN_CHARS = frozenset("іїєґІЇЄҐ")
+
+
+def _script_of(char: str) -> str | None:
+    """文字の文字種を返す。ラテン文字・記号等は None。"""
+    code = ord(char)
+    if code < 0x0370:
+        return None
+    for start, end, script in _SCRIPT_RANGES:
+        if start <= code <= end:
+            return script
+    return None
+
+
+def detect_by_script(text: str) -> str | None:
+    """
+    文字種だけで言語が決まる場合はその言語コードを返す。
+    ラテン文字が主体、または漢字のみ（中国語/日本語が曖昧）の場合は None。
+    """
+    counts: dict[str, int] = {}
+    latin = 0
+    for char in text:
+        if not char.isalpha():
+            continue
+        script = _script_of(char)
+        if script is None:
+            latin += 1
+        else:
+            counts[script] = counts.get(script, 0) + 1
+
+    # かなが 1 文字でもあれば日本語（漢字かな交じり文）
+    if counts.get("kana"):
+        return "ja"
+    if not counts:
+        return None
+
+    script, count = max(counts.items(), key=lambda item: item[1])
+    if count < latin or script not in _SCRIPT_TO_LANG:
+        return None
+
+    lang = _SCRIPT_TO_LANG[script]
+    if lang == "ar":
+        if any(c in _URDU_CHARS for c in text):
+            return "ur"
+        if any(c in _PERSIAN_CHARS for c in text):
+            return "fa"
+    elif lang == "ru" and any(c in _UKRAINIAN_CHARS for c in text):
+        return "uk"
+    return lang
+
+
+def _detect_with_langdetect(text: str) -> str:
+    try:
+        from langdetect import detect
+        lang = detect(text)
+        # langdetect は "zh-cn", "zh-tw" 等を返す場合がある
+        return lang.lower()
+    except Exception:
+        return DEFAULT_LANGUAGE
+
+
+@lru_cache(maxsize=DETECTION_CACHE_SIZE)
+def detect_language(text: str) -> str:
+    """
+    テキストのソース言語を検出する（オフライン・無料）。
+    検出失敗時は "en" をデフォルトとして返す。
+    """
+    lang = detect_by_script(text)
+    if lang is not None:
+        return lang
+    return _detect_with_langdetect(text)
+
+
+def warmup() -> None:
+    """
+    langdetect のプロファイルを読み込み、シードを固定する。
+    初回リアクション時の読み込み待ちをなくすため、起動時に一度呼ぶ（ブロックするのでスレッドで実行する）。
+    """
+    try:
+        from langdetect import DetectorFactory, detect
+        from langdetect.detector_factory import init_factory
+    except ImportError as e:
+        logger.warning("langdetect を読み込めません: %s", e)
+        return
+    DetectorFactory.seed = 0
+    init_factory()
+    # 検出経路の残りの遅延初期化も済ませておく（結果はメモ化しない）
+    detect("warm up the language detector")
+    logger.info("langdetect のプロファイルを読み込みました")
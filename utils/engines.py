@@ -0,0 +1,298 @@
+"""
+翻訳エンジン
+
+すべてのエンジンは TranslationEngine の共通インターフェースを実装する。
+エンジンはコグ読み込み時に一度だけ作成され、共有の aiohttp.ClientSession
+（keep-alive 接続プール）を使い回す。テスト用の偽エンジンも同じ契約で差し替えられる。
+
+失敗は EngineError（文字数枠切れは QuotaExceededError、タイムアウトは
+EngineTimeoutError）として送出し、振り分けは utils.router が行う。
+"""
+
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+
+import aiohttp
+
+from utils.detection import detect_language
+from utils.markup import PLACEHOLDER, from_xml, to_xml
+
+logger = logging.getLogger(__name__)
+
+MYMEMORY_API_URL = "https://api.mymemory.translated.net/get"
+DEEPL_API_URL_FREE = "https://api-free.deepl.com/v2"
+DEEPL_API_URL_PRO = "https://api.deepl.com/v2"
+DEEPL_MAX_TEXTS = 50           # /translate 1 リクエストあたりの text パラメータ上限
+
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=10)
+HTTP_POOL_LIMIT = 100          # 同時接続数の上限（全ホスト合計）
+HTTP_KEEPALIVE_TIMEOUT = 60    # アイドル接続を保持する秒数
+BATCH_CONCURRENCY = 4          # 1 件ずつ送るエンジンでバッチを並行に投げる上限
+
+
+class EngineError(Exception):
+    """翻訳エンジンの呼び出し失敗。"""
+
+
+class QuotaExceededError(EngineError):
+    """文字数枠を使い切った（DeepL の HTTP 456、MyMemory の quotaFinished 等）。"""
+
+
+class EngineTimeoutError(EngineError):
+    """翻訳エンジンが時間内に応答しなかった。"""
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """翻訳エンジン共有の aiohttp.ClientSession を作成する（イベントループ内で呼ぶこと）。"""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+
+
+class TranslationEngine(ABC):
+    """
+    翻訳エンジンの共通インターフェース。
+
+    name:         投稿に表示するエンジン名（"DeepL" 等）
+    lang_key:     Language.codes（utils.languages）のうち、このエンジンが使う言語コードのキー
+    quota_period: 文字数枠のリセット周期（"day" / "month"）。枠が無ければ None
+    quota_limit:  周期あたりの文字数枠。不明・無制限なら None
+    """
+
+    name: str = ""
+    lang_key: str = ""
+    quota_period: str | None = None
+    quota_limit: int | None = None
+
+    async def start(self) -> None:
+        """起動時の準備処理（対応言語の取得など）。既定では何もしない。"""
+
+    def supports(self, target_lang: str) -> bool:
+        """ターゲット言語に対応しているか。既定ではすべて対応とみなす。"""
+        return True
+
+    async def usage(self) -> tuple[int, int] | None:
+        """エンジン側で集計された (使用文字数, 上限) を返す。取得できなければ None。"""
+        return None
+
+    @abstractmethod
+    async def translate(
+        self, text: str, target_lang: str, source_lang: str | None = None
+    ) -> str | None:
+        """
+        翻訳する。成功時は翻訳文字列、翻訳不要（同言語）なら None を返す。
+        失敗時は EngineError を送出する。
+        """
+
+    async def translate_batch(
+        self, texts: list[str], target_lang: str, source_lang: str | None = None
+    ) -> list[str] | None:
+        """
+        複数のテキストをまとめて翻訳する（結果は texts と同じ順序）。
+        既定では translate を BATCH_CONCURRENCY 件ずつ並行に呼ぶ。
+        1 リクエストで送れるエンジンはこれを上書きする。翻訳不要（同言語）なら None を返す。
+        """
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def one(text: str) -> str | None:
+            async with semaphore:
+                return await self.translate(text, target_lang, source_lang=source_lang)
+
+        results = await asyncio.gather(*(one(text) for text in texts))
+        if any(result is None for result in results):
+            return None
+        return list(results)
+
+    async def close(self) -> None:
+        """終了処理。既定では何もしない。"""
+
+
+# ── DeepL ──────────────────────────────────────────────────────────────────
+
+class DeepLEngine(TranslationEngine):
+    """DeepL API（REST）。対応ターゲット言語の一覧は起動時に一度だけ取得する。"""
+
+    name = "DeepL"
+    lang_key = "deepl"
+    quota_period = "month"
+
+    def __init__(
+        self, api_key: str, session: aiohttp.ClientSession, base_url: str | None = None
+    ):
+        self.session = session
+        # base_url はベンチマーク等でスタブサーバーに向けるときだけ指定する
+        self.base_url = base_url or (
+            DEEPL_API_URL_FREE if api_key.endswith(":fx") else DEEPL_API_URL_PRO
+        )
+        self._headers = {"Authorization": f"DeepL-Auth-Key {api_key}"}
+        self.target_languages: frozenset[str] | None = None
+
+    async def start(self) -> None:
+        """/languages から対応ターゲット言語を取得してキャッシュする。"""
+        try:
+            async with self.session.get(
+                f"{self.base_url}/languages",
+                params={"type": "target"},
+                headers=self._headers,
+            ) as resp:
+                resp.raise_for_status()
+                languages = await resp.json()
+            self.target_languages = frozenset(lang["language"].upper() for lang in languages)
+            logger.info("DeepL 対応言語を取得しました: %d 言語", len(self.target_languages))
+        except Exception as e:
+            # 取得できなかった場合はすべて対応とみなし、翻訳時の失敗に任せる
+            logger.warning("DeepL 対応言語の取得に失敗: %s", e)
+
+    def supports(self, target_lang: str) -> bool:
+        if self.target_languages is None:
+            return True
+        return target_lang.upper() in self.target_languages
+
+    async def usage(self) -> tuple[int, int] | None:
+        """/usage から今期の使用文字数と上限を取得する。"""
+        try:
+            async with self.session.get(f"{self.base_url}/usage", headers=self._headers) as resp:
+                resp.raise_for_status()
+                payload = await resp.json()
+            return int(payload["character_count"]), int(payload["character_limit"])
+        except Exception as e:
+            logger.warning("DeepL 使用量の取得に失敗: %s", e)
+            return None
+
+    async def translate(
+        self, text: str, target_lang: str, source_lang: str | None = None
+    ) -> str | None:
+        return (await self._translate_texts([text], target_lang))[0]
+
+    async def translate_batch(
+        self, texts: list[str], target_lang: str, source_lang: str | None = None
+    ) -> list[str] | None:
+        """text パラメータを複数並べ、DEEPL_MAX_TEXTS 件ずつ 1 リクエストで翻訳する。"""
+        results: list[str] = []
+        for i in range(0, len(texts), DEEPL_MAX_TEXTS):
+            results.extend(await self._translate_texts(texts[i:i + DEEPL_MAX_TEXTS], target_lang))
+        return results
+
+    async def _translate_texts(self, texts: list[str], target_lang: str) -> list[str]:
+        # 文中の保護スパンのプレースホルダ（utils.markup）は XML の空要素として送り、位置を保たせる
+        xml = any(PLACEHOLDER.search(text) for text in texts)
+        data = [("text", to_xml(text) if xml else text) for text in texts]
+        data.append(("target_lang", target_lang))
+        if xml:
+            data.append(("tag_handling", "xml"))
+        try:
+            async with self.session.post(
+                f"{self.base_url}/translate", data=data, headers=self._headers
+            ) as resp:
+                if resp.status == 456:
+                    raise QuotaExceededError("DeepL の文字数枠を使い切りました (HTTP 456)")
+                resp.raise_for_status()
+                payload = await resp.json()
+            translations = [item["text"] for item in payload["translations"]]
+            return [from_xml(text) for text in translations] if xml else translations
+        except EngineError:
+            raise
+        except asyncio.TimeoutError as e:
+            raise EngineTimeoutError(f"DeepL タイムアウト (target={target_lang})") from e
+        except Exception as e:
+            raise EngineError(f"DeepL 翻訳失敗 (target={target_lang}): {e}") from e
+
+
+# ── MyMemory ───────────────────────────────────────────────────────────────
+
+class MyMemoryEngine(TranslationEngine):
+    """
+    MyMemory API（公式 REST API、クレカ不要）。
+
+    無料枠:
+      - 登録なし: 5,000 文字/日
+      - メール登録 (MYMEMORY_EMAIL): 50,000 文字/日
+
+    MyMemory は "auto" をソース言語として受け付けないため、
+    source_lang が渡されない場合は langdetect でソース言語を自動検出する。
+    """
+
+    name = "MyMemory"
+    lang_key = "mymemory"
+    quota_period = "day"
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        email: str | None = None,
+        api_url: str = MYMEMORY_API_URL,
+    ):
+        self.session = session
+        self.email = email
+        self.api_url = api_url
+        self.quota_limit = 50_000 if email else 5_000
+
+    async def start(self) -> None:
+        """接続プールに API サーバーへの接続（DNS・TLS）を 1 本作っておく。文字数枠は消費しない。"""
+        try:
+            async with self.session.head(self.api_url) as resp:
+                await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug("MyMemory への事前接続に失敗: %s", e)
+
+    async def translate(
+        self, text: str, target_lang: str, source_lang: str | None = None
+    ) -> str | None:
+        if source_lang is None:
+            source_lang = detect_language(text)
+
+        # ソース言語とターゲット言語が同じ場合は翻訳不要
+        if source_lang == target_lang:
+            return None
+
+        params: dict = {
+            "q": text,
+            "langpair": f"{source_lang}|{target_lang}",
+        }
+        if self.email:
+            params["de"] = self.email
+
+        try:
+            async with self.session.get(self.api_url, params=params) as resp:
+                if resp.status == 429:
+                    raise QuotaExceededError("MyMemory の文字数枠を使い切りました (HTTP 429)")
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
+        except EngineError:
+            raise
+        except asyncio.TimeoutError as e:
+            raise EngineTimeoutError(f"MyMemory タイムアウト (target={target_lang})") from e
+        except Exception as e:
+            raise EngineError(f"MyMemory 翻訳失敗 (target={target_lang}): {e}") from e
+
+        if not isinstance(data, dict):
+            raise EngineError(f"MyMemory の応答が不正です (target={target_lang}): {data!r:.100}")
+        status = str(data.get("responseStatus"))
+        if data.get("quotaFinished") or status == "429":
+            raise QuotaExceededError(f"MyMemory の文字数枠を使い切りました: {data.get('responseDetails')}")
+        if status != "200":
+            raise EngineError(f"MyMemory API エラー: {data.get('responseDetails')}")
+        try:
+            return str(data["responseData"]["translatedText"])
+        except (KeyError, TypeError) as e:
+            raise EngineError(f"MyMemory の応答が不正です (target={target_lang}): {e!r}") from e
+
+
+# ── 既定構成 ───────────────────────────────────────────────────────────────
+
+def create_default_engines(session: aiohttp.ClientSession) -> list[TranslationEngine]:
+    """
+    環境変数から既定のエンジン列を優先順に作成する。
+    DEEPL_API_KEY が未設定の場合は MyMemory のみ。
+    """
+    engines: list[TranslationEngine] = []
+    api_key = os.getenv("DEEPL_API_KEY", "").strip()
+    if api_key:
+        engines.append(DeepLEngine(api_key, session))
+    email = os.getenv("MYMEMORY_EMAIL", "").strip() or None
+    engines.append(MyMemoryEngine(session, email))
+    return engines
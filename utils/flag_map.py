@@ -4,6 +4,8 @@
 deepl:     DeepL API の言語コード。None の場合 DeepL は非対応 → MyMemory に直行。
 mymemory:  MyMemory API の言語コード（ISO 639-1 ベース）。
 label:     人が読める言語名。
+
+実行時はこの表から utils.languages のレジストリを作って引く（同じコードの組は 1 つの Language を共有）。
 """
 
 FLAG_TO_LANG: dict[str, dict] = {
@@ -0,0 +1,259 @@
+"""
+チャンネル履歴の一括翻訳
+
+/translate-history から使う。チャンネルの履歴を新しい順に流し、非同期ジェネレータの
+パイプラインで処理する。
+
+    履歴の取得（HISTORY_BATCH_SIZE 件ずつ）
+      → マークアップ分割・ボット/地の文なしを除外
+      → ソース言語の検出（ターゲットと同じなら除外）
+      → エンジンへのまとめ送り（utils.translator.translate_texts。DeepL は 1 リクエスト 50 文）
+
+各段の間は大きさ 1 のキューでつなぐので、投稿中に次のバッチの取得・翻訳が進み、
+メモリに載るのは高々数バッチ分で済む。投稿（レート制限付き）はコグ側で行う。
+
+処理済みの位置（最後に処理したメッセージ ID）は HistoryCheckpoints に保存し、
+同じチャンネル・言語で再実行するとその続きから再開する。
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+
+import discord
+
+from utils.detection import detect_language
+from utils.languages import Language
+from utils.markup import segment
+from utils.translator import translate_texts
+
+logger = logging.getLogger(__name__)
+
+HISTORY_BATCH_SIZE = 50      # 1 バッチのメッセージ数（DeepL の 1 リクエスト上限に合わせる）
+STAGE_BUFFER = 1             # 段の間に溜めるバッチ数
+
+
+@dataclass
+class HistoryItem:
+    """翻訳対象のメッセージ 1 件。"""
+    message: discord.Message
+    content: str
+    source_lang: str
+    translated: str | None = None
+    engine: str = ""
+
+
+@dataclass
+class HistoryBatch:
+    """
+    パイプラインを流れる単位。
+
+    last_message_id: このバッチで最も古いメッセージの ID（ここまで処理済み = 再開位置）
+    scanned:         取得したメッセージ数（除外したものを含む）
+    """
+    last_message_id: int
+    scanned: int
+    items: list[HistoryItem] = field(default_factory=list)
+    skipped: int = 0
+
+
+# ── パイプラインの段 ───────────────────────────────────────────────────────
+
+async def fetch_batches(
+    channel: discord.abc.Messageable,
+    limit: int,
+    before: int | None = None,
+    size: int = HISTORY_BATCH_SIZE,
+) -> AsyncIterator[list[discord.Message]]:
+    """履歴を新しい順に size 件ずつ返す（before より前から）。"""
+    batch: list[discord.Message] = []
+    cursor = discord.Object(id=before) if before else None
+    async for message in channel.history(limit=limit, before=cursor):
+        batch.append(message)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def prepare_batches(
+    batches: AsyncIterator[list[discord.Message]],
+    language: Language,
+    bot_user: discord.abc.User,
+) -> AsyncIterator[HistoryBatch]:
+    """ボットの投稿・地の文の無いもの・ターゲットと同じ言語のものを除き、ソース言語を付ける。"""
+    async for messages in batches:
+        batch = HistoryBatch(messages[-1].id, len(messages))
+        for message in messages:
+            content = message.content.strip()
+            segmented = segment(content)
+            if message.author == bot_user or message.author.bot or not segmented.prose:
+                batch.skipped += 1
+                continue
+            source_lang = detect_language(segmented.prose_text)
+            if language.is_source(source_lang):
+                batch.skipped += 1
+                continue
+            batch.items.append(HistoryItem(message, content, source_lang))
+        yield batch
+
+
+async def translate_batches(
+    batches: AsyncIterator[HistoryBatch],
+    language: Language,
+) -> AsyncIterator[HistoryBatch]:
+    """バッチ内のメッセージをソース言語ごとにまとめてエンジンに送る。"""
+    async for batch in batches:
+        by_source: dict[str, list[HistoryItem]] = {}
+        for item in batch.items:
+            by_source.setdefault(item.source_lang, []).append(item)
+        for source_lang, items in by_source.items():
+            results = await translate_texts([item.content for item in items], language, source_lang)
+            for item, (translated, engine) in zip(items, results):
+                item.translated, item.engine = translated, engine
+        yield batch
+
+
+async def buffered(source: AsyncIterator, size: int = STAGE_BUFFER) -> AsyncIterator:
+    """上流を別タスクで先に進め、最大 size 件を溜める（段どうしを並行に動かす）。"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+    done = object()
+
+    async def pump() -> None:
+        try:
+            async for value in source:
+                await queue.put(value)
+            await queue.put(done)
+        except Exception as e:     # 例外は下流に渡して送出させる
+            await queue.put(e)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            value = await queue.get()
+            if value is done:
+                return
+            if isinstance(value, Exception):
+                raise value
+            yield value
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def history_pipeline(
+    channel: discord.abc.Messageable,
+    language: Language,
+    bot_user: discord.abc.User,
+    limit: int,
+    before: int | None = None,
+) -> AsyncIterator[HistoryBatch]:
+    """取得 → 分割・検出 → 翻訳 の各段をつないだパイプラインを返す。"""
+    batches = buffered(fetch_batches(channel, limit, before))
+    prepared = prepare_batches(batches, language, bot_user)
+    return buffered(translate_batches(prepared, language))
+
+
+# ── 再開位置 ───────────────────────────────────────────────────────────────
+
+@dataclass
+class HistoryCheckpoint:
+    """チャンネル × 言語ごとの進み具合。"""
+    channel_id: int
+    language: str                  # Language.key
+    thread_id: int
+    last_message_id: int | None = None
+    processed: int = 0
+    translated: int = 0
+
+
+class HistoryCheckpoints:
+    """
+    再開位置の SQLite 記録。path が None ならメモリ上（再起動で消える）。
+    HISTORY_CHECKPOINT_PATH を設定すると再起動後も続きから再開できる。
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " channel_id INTEGER NOT NULL,"
+            " language TEXT NOT NULL,"
+            " thread_id INTEGER NOT NULL,"
+            " last_message_id INTEGER,"
+            " processed INTEGER NOT NULL,"
+            " translated INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (channel_id, language))"
+        )
+        self._db.commit()
+
+    def _get(self, channel_id: int, language: str) -> HistoryCheckpoint | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT thread_id, last_message_id, processed, translated FROM history"
+                " WHERE channel_id = ? AND language = ?",
+                (channel_id, language),
+            ).fetchone()
+        if row is None:
+            return None
+        return HistoryCheckpoint(channel_id, language, *row)
+
+    def _put(self, checkpoint: HistoryCheckpoint) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO history (channel_id, language, thread_id, last_message_id,"
+                " processed, translated, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (checkpoint.channel_id, checkpoint.language, checkpoint.thread_id,
+                 checkpoint.last_message_id, checkpoint.processed, checkpoint.translated,
+                 time.time()),
+            )
+            self._db.commit()
+
+    def _delete(self, channel_id: int, language: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM history WHERE channel_id = ? AND language = ?", (channel_id, language)
+            )
+            self._db.commit()
+
+    async def get(self, channel_id: int, language: str) -> HistoryCheckpoint | None:
+        try:
+            return await asyncio.to_thread(self._get, channel_id, language)
+        except sqlite3.Error as e:
+            logger.warning("履歴翻訳の再開位置を読めません: %s", e)
+            return None
+
+    async def save(self, checkpoint: HistoryCheckpoint) -> None:
+        try:
+            await asyncio.to_thread(self._put, checkpoint)
+        except sqlite3.Error as e:
+            logger.warning("履歴翻訳の再開位置を保存できません: %s", e)
+
+    async def delete(self, channel_id: int, language: str) -> None:
+        try:
+            await asyncio.to_thread(self._delete, channel_id, language)
+        except sqlite3.Error as e:
+            logger.warning("履歴翻訳の再開位置を削除できません: %s", e)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def checkpoints_from_env() -> HistoryCheckpoints:
+    """環境変数 HISTORY_CHECKPOINT_PATH から再開位置の記録を作る（未設定ならメモリ上）。"""
+    path = os.getenv("HISTORY_CHECKPOINT_PATH", "").strip() or None
+    try:
+        return HistoryCheckpoints(path)
+    except sqlite3.Error as e:
+        logger.warning("履歴翻訳の再開位置ファイルを開けません（メモリ上で動作）: %s", e)
+        return HistoryCheckpoints(None)
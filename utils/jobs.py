@@ -0,0 +1,371 @@
+"""
+翻訳ジョブのスケジューラ
+
+国旗リアクションのリスナーと翻訳パイプラインの間に置く。
+
+- 固定数のワーカーで処理し、同時に走る翻訳ジョブの数に上限を設ける。
+- ギルドごとにキューを分けてラウンドロビンで取り出し、ギルドあたりの同時実行数も制限する
+  （1 つのギルドの大量リアクションで他のギルドが待たされない）。
+- キュー全体が上限に達したら、空きが出るまで投入側を待たせる（一定時間で諦めて破棄）。
+- JOB_JOURNAL_PATH を設定すると SQLite にジョブを記録し、完了したら消す。
+  終了時（SIGTERM）は猶予時間内にキューを処理し切り、残ったジョブは次回起動時に再投入する。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+from utils.languages import FlagEntry, registry_for
+from utils.metrics import (
+    JOB_QUEUE_WAIT_SECONDS,
+    JOBS_IN_FLIGHT,
+    JOBS_QUEUED,
+    JOBS_REJECTED,
+    JOBS_REPLAYED,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_GUILD_CONCURRENCY = 2
+DEFAULT_MAX_QUEUED = 500
+DEFAULT_SUBMIT_TIMEOUT = 30.0   # キューが満杯のとき投入側が待つ秒数
+DEFAULT_GRACE_PERIOD = 8.0      # 終了時にキューを処理し切る猶予（Cloud Run の SIGTERM 猶予は 10 秒）
+
+
+@dataclass
+class TranslationJob:
+    """1 メッセージ分の翻訳ジョブ（待ち時間中に届いた国旗をまとめる）。"""
+    guild_id: int | None
+    channel_id: int
+    message_id: int
+    emojis: dict[str, FlagEntry] = field(default_factory=dict)   # 絵文字 → FlagEntry（到着順）
+    created_at: float = field(default_factory=time.monotonic)
+    queued_at: float = 0.0
+    journal_id: int | None = None     # ジャーナルの行（同じメッセージのジョブが実行中に次のジョブが来ても別の行）
+
+
+# ── ジャーナル ─────────────────────────────────────────────────────────────
+
+class JobJournal:
+    """
+    未完了ジョブの SQLite 記録（投入時に書き、完了時に消す）。
+    行はジョブごと（メッセージごとではない）なので、実行中のジョブと、その間に
+    同じメッセージへ投入された次のジョブは別々に記録され、先に終わった方が後の方の記録を消さない。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        try:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if columns and "id" not in columns:
+                # メッセージ ID を主キーにしていた旧形式から移行する
+                conn.execute("ALTER TABLE jobs RENAME TO jobs_by_message")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " message_id INTEGER NOT NULL,"
+                " guild_id INTEGER,"
+                " channel_id INTEGER NOT NULL,"
+                " emojis TEXT NOT NULL,"
+                " queued_at REAL NOT NULL)"
+            )
+            if columns and "id" not in columns:
+                conn.execute(
+                    "INSERT INTO jobs (message_id, guild_id, channel_id, emojis, queued_at)"
+                    " SELECT message_id, guild_id, channel_id, emojis, queued_at FROM jobs_by_message"
+                )
+                conn.execute("DROP TABLE jobs_by_message")
+            conn.commit()
+            self._db = conn
+            logger.info("ジョブジャーナルを開きました: %s", path)
+        except sqlite3.Error as e:
+            logger.warning("ジョブジャーナルを開けません（再起動時の再実行なしで動作）: %s", e)
+
+    def _put(self, job: TranslationJob) -> int:
+        """ジョブの行を書く（記録済みなら国旗を更新する）。行の ID を返す。"""
+        emojis = json.dumps(list(job.emojis), ensure_ascii=False)
+        with self._lock:
+            updated = job.journal_id is not None and self._db.execute(
+                "UPDATE jobs SET emojis = ? WHERE id = ?", (emojis, job.journal_id)
+            ).rowcount
+            if updated:
+                row_id = job.journal_id
+            else:
+                row_id = self._db.execute(
+                    "INSERT INTO jobs (message_id, guild_id, channel_id, emojis, queued_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (job.message_id, job.guild_id, job.channel_id, emojis, time.time()),
+                ).lastrowid
+            self._db.commit()
+        return row_id
+
+    def _delete(self, row_id: int) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (row_id,))
+            self._db.commit()
+
+    def load(self) -> list[TranslationJob]:
+        """記録されている未完了ジョブを投入順に返す。"""
+        if self._db is None:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, guild_id, channel_id, message_id, emojis FROM jobs ORDER BY queued_at, id"
+            ).fetchall()
+        jobs = []
+        for row_id, guild_id, channel_id, message_id, emojis in rows:
+            job = TranslationJob(guild_id, channel_id, message_id, journal_id=row_id)
+            registry = registry_for(guild_id)
+            for emoji in json.loads(emojis):
+                flag = registry.get(emoji)
+                if flag is not None:
+                    job.emojis[emoji] = flag
+            jobs.append(job)
+        return jobs
+
+    async def add(self, job: TranslationJob) -> None:
+        if self._db is None:
+            return
+        try:
+            job.journal_id = await asyncio.to_thread(self._put, job)
+        except sqlite3.Error as e:
+            logger.warning("ジョブジャーナルへの書き込みに失敗: %s", e)
+
+    async def remove(self, job: TranslationJob) -> None:
+        if self._db is None or job.journal_id is None:
+            return
+        try:
+            await asyncio.to_thread(self._delete, job.journal_id)
+            job.journal_id = None
+        except sqlite3.Error as e:
+            logger.warning("ジョブジャーナルからの削除に失敗: %s", e)
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+            self._db = None
+
+
+# ── スケジューラ ───────────────────────────────────────────────────────────
+
+class JobScheduler:
+    """ギルド単位のラウンドロビンでジョブを取り出すワーカープール。"""
+
+    def __init__(
+        self,
+        handler: Callable[[TranslationJob], Awaitable[None]],
+        workers: int = DEFAULT_WORKERS,
+        guild_concurrency: int = DEFAULT_GUILD_CONCURRENCY,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        submit_timeout: float = DEFAULT_SUBMIT_TIMEOUT,
+        grace_period: float = DEFAULT_GRACE_PERIOD,
+        journal: JobJournal | None = None,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.guild_concurrency = guild_concurrency
+        self.max_queued = max_queued
+        self.submit_timeout = submit_timeout
+        self.grace_period = grace_period
+        self.journal = journal
+
+        self._queues: dict[int, deque[TranslationJob]] = {}   # guild → 待ちジョブ
+        self._ready: deque[int] = deque()                     # 待ちジョブのあるギルド（巡回順）
+        self._active: dict[int, int] = {}                     # guild → 実行中の数
+        self._queued: dict[int, TranslationJob] = {}          # message_id → 待ちジョブ
+        self._cond = asyncio.Condition()
+        self._workers: list[asyncio.Task] = []
+        self._closing = False
+
+    @property
+    def depth(self) -> int:
+        """キューで待っているジョブの数。"""
+        return len(self._queued)
+
+    @property
+    def idle(self) -> bool:
+        """待ちジョブが無く、ワーカーに空きがあるか（先読み等の低優先度の処理はこのときだけ行う）。"""
+        return not self._queued and sum(self._active.values()) < self.workers
+
+    async def start(self) -> None:
+        """
+        前回終了時に残ったジョブを再投入し、ワーカーを起動する。
+        再投入に失敗しても（ジャーナルの破損等）ワーカーは起動する。
+        """
+        if self.journal is not None:
+            try:
+                await self._replay()
+            except Exception as e:
+                logger.warning("未完了ジョブの再投入に失敗しました（再実行せずに起動します）: %s", e)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"translation-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def _replay(self) -> None:
+        jobs = await asyncio.to_thread(self.journal.load)
+        merged: list[TranslationJob] = []
+        async with self._cond:
+            for job in jobs:
+                queued = self._queued.get(job.message_id)
+                if queued is not None:
+                    # 実行中に次のジョブが来ていた等で同じメッセージの行が複数あれば 1 つにまとめる
+                    for emoji, flag in job.emojis.items():
+                        queued.emojis.setdefault(emoji, flag)
+                    merged.append(queued)
+                elif job.emojis:
+                    self._enqueue(job)
+        # まとめた分と、国旗・言語設定が変わって言語が無くなったジョブの行は消す
+        for job in merged:
+            await self.journal.add(job)
+        for job in jobs:
+            if self._queued.get(job.message_id) is not job:
+                await self.journal.remove(job)
+        if jobs:
+            JOBS_REPLAYED.inc(len(jobs))
+            logger.info("未完了の翻訳ジョブを再投入しました: %d 件", len(jobs))
+
+    async def submit(self, job: TranslationJob) -> bool:
+        """
+        ジョブを投入する。同じメッセージのジョブが待機中なら国旗をそこに合流させる。
+        キューが満杯なら submit_timeout 秒まで空きを待ち、それでも空かなければ破棄して False を返す。
+        """
+        async with self._cond:
+            queued = self._queued.get(job.message_id)
+            if queued is None:
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self.depth < self.max_queued),
+                        self.submit_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    JOBS_REJECTED.inc()
+                    logger.warning(
+                        "ジョブキューが満杯のため破棄しました: guild=%s message_id=%s",
+                        job.guild_id, job.message_id,
+                    )
+                    return False
+                queued = self._queued.get(job.message_id)
+            if queued is not None:
+                for emoji, flag in job.emojis.items():
+                    queued.emojis.setdefault(emoji, flag)
+                job = queued
+            # ワーカーが完了して消すより先に記録されるよう、キューに入れる前に書く
+            if self.journal is not None:
+                await self.journal.add(job)
+            if queued is None:
+                self._enqueue(job)
+        return True
+
+    def _enqueue(self, job: TranslationJob) -> None:
+        guild = job.guild_id or 0
+        job.queued_at = time.monotonic()
+        queue = self._queues.get(guild)
+        if queue is None:
+            queue = self._queues[guild] = deque()
+            self._ready.append(guild)
+        queue.append(job)
+        self._queued[job.message_id] = job
+        JOBS_QUEUED.set(self.depth)
+        self._cond.notify_all()
+
+    def _take(self) -> TranslationJob | None:
+        """同時実行数に空きのあるギルドから、巡回順に 1 件取り出す。"""
+        for _ in range(len(self._ready)):
+            guild = self._ready[0]
+            self._ready.rotate(-1)
+            if self._active.get(guild, 0) >= self.guild_concurrency:
+                continue
+            queue = self._queues[guild]
+            job = queue.popleft()
+            if not queue:
+                del self._queues[guild]
+                self._ready.remove(guild)
+            del self._queued[job.message_id]
+            self._active[guild] = self._active.get(guild, 0) + 1
+            JOBS_QUEUED.set(self.depth)
+            return job
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._cond:
+                while (job := self._take()) is None:
+                    if self._closing and not self._queued:
+                        return
+                    await self._cond.wait()
+                # 空きを待っている投入側を起こす
+                self._cond.notify_all()
+
+            JOB_QUEUE_WAIT_SECONDS.observe(time.monotonic() - job.queued_at)
+            JOBS_IN_FLIGHT.inc()
+            try:
+                await self.handler(job)
+            except asyncio.CancelledError:
+                # 猶予切れで打ち切られたジョブはジャーナルに残し、次回起動時に再実行する
+                raise
+            except Exception:
+                logger.exception("翻訳ジョブで予期しないエラー: message_id=%s", job.message_id)
+            finally:
+                JOBS_IN_FLIGHT.dec()
+                async with self._cond:
+                    guild = job.guild_id or 0
+                    self._active[guild] -= 1
+                    if not self._active[guild]:
+                        del self._active[guild]
+                    self._cond.notify_all()
+            if self.journal is not None:
+                await self.journal.remove(job)
+
+    async def drain(self, timeout: float | None = None) -> None:
+        """
+        新しいジョブを待たずに、キューに残っている分を処理し切ってワーカーを止める。
+        timeout（既定は grace_period）を過ぎたら打ち切り、残りはジャーナルに残す。
+        """
+        timeout = self.grace_period if timeout is None else timeout
+        async with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._workers:
+            logger.info(
+                "翻訳ジョブを処理し切ってから終了します: 待ち %d 件（猶予 %.0f 秒）",
+                self.depth, timeout,
+            )
+            _, pending = await asyncio.wait(self._workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if pending or self._queued:
+                logger.warning(
+                    "猶予時間内に終わらなかった翻訳ジョブは次回起動時に再実行します: 待ち %d 件",
+                    self.depth,
+                )
+        self._workers = []
+        if self.journal is not None:
+            self.journal.close()
+
+
+def scheduler_from_env(handler: Callable[[TranslationJob], Awaitable[None]]) -> JobScheduler:
+    """環境変数の設定から JobScheduler を作る。"""
+    journal_path = os.getenv("JOB_JOURNAL_PATH", "").strip()
+    return JobScheduler(
+        handler,
+        workers=int(os.getenv("JOB_WORKERS", str(DEFAULT_WORKERS))),
+        guild_concurrency=int(os.getenv("JOB_GUILD_CONCURRENCY", str(DEFAULT_GUILD_CONCURRENCY))),
+        max_queued=int(os.getenv("JOB_QUEUE_MAX", str(DEFAULT_MAX_QUEUED))),
+        grace_period=float(os.getenv("SHUTDOWN_GRACE_PERIOD", str(DEFAULT_GRACE_PERIOD))),
+        journal=JobJournal(journal_path) if journal_path else None,
+    )
@@ -0,0 +1,242 @@
+"""
+言語レジストリ
+
+utils.flag_map の FLAG_TO_LANG（国旗ごとの dict）から、起動時に一度だけ
+読み取り専用のレジストリを作る。
+
+  - Language:  翻訳ターゲット（DeepL / MyMemory の言語コードの組）。
+               同じ組は 1 つのオブジェクトを共有する（🇪🇸 🇲🇽 🇦🇷 … はすべて同じ Language）。
+               key（"ES/es" 等）が重複排除・キャッシュキーの正規形になる。
+  - FlagEntry: 絵文字 1 つ分（絵文字・表示ラベル・Language）。
+
+リアクションの処理・ジョブのまとめ・翻訳キャッシュはすべて Language を単位にする。
+
+LANGUAGE_CONFIG_PATH に JSON を置くと、ギルドごとに国旗やカスタム絵文字を追加できる
+（ファイルの更新は実行中にも反映される）。
+
+    {
+      "*":                  {"🏴‍☠️": {"deepl": "EN-GB", "mymemory": "en", "label": "Pirate"}},
+      "123456789012345678": {"<:kansai:987654321098765432>":
+                             {"deepl": "JA", "mymemory": "ja", "label": "Japanese (Kansai)"}}
+    }
+
+"*" は全ギルド共通。カスタム絵文字は ID だけ（"987654321098765432"）でも指定できる。
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections.abc import Iterator, Mapping
+from types import MappingProxyType
+
+from utils.flag_map import FLAG_TO_LANG
+
+logger = logging.getLogger(__name__)
+
+CONFIG_CHECK_INTERVAL = 30.0    # 設定ファイルの更新を確認する間隔（秒）
+ALL_GUILDS = "*"
+
+CUSTOM_EMOJI_PATTERN = re.compile(r"<a?:\w+:(\d+)>")
+
+
+class Language:
+    """翻訳ターゲット。intern_language() で作り、同じコードの組は同一オブジェクトを使う。"""
+
+    __slots__ = ("deepl", "mymemory", "key", "codes")
+
+    def __init__(self, deepl: str | None, mymemory: str):
+        self.deepl = sys.intern(deepl) if deepl else None
+        self.mymemory = sys.intern(mymemory)
+        # キャッシュキーにも使う正規形（既存の SQLite キャッシュと同じ形式）
+        self.key = sys.intern(f"{deepl or '-'}/{mymemory}")
+        # エンジンの lang_key（"deepl" / "mymemory"）→ 言語コード
+        self.codes: Mapping[str, str | None] = MappingProxyType(
+            {"deepl": self.deepl, "mymemory": self.mymemory}
+        )
+
+    def __repr__(self) -> str:
+        return f"Language({self.key!r})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Language) and other.key == self.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def is_source(self, detected: str | None) -> bool:
+        """検出したソース言語がこのターゲットと同じか（DeepL の "EN-US" 等はプレフィックスで比較）。"""
+        if detected is None:
+            return False
+        if detected == self.mymemory:
+            return True
+        return self.deepl is not None and detected == self.deepl.split("-")[0].lower()
+
+
+_languages: dict[tuple[str | None, str], Language] = {}
+
+
+def intern_language(deepl: str | None, mymemory: str) -> Language:
+    """コードの組に対応する共有の Language を返す（無ければ作る）。"""
+    language = _languages.get((deepl, mymemory))
+    if language is None:
+        language = _languages[(deepl, mymemory)] = Language(deepl, mymemory)
+    return language
+
+
+class FlagEntry:
+    """リアクションに使える絵文字 1 つ分。"""
+
+    __slots__ = ("emoji", "label", "language")
+
+    def __init__(self, emoji: str, label: str, language: Language):
+        self.emoji = emoji
+        self.label = sys.intern(label)
+        self.language = language
+
+    def __repr__(self) -> str:
+        return f"FlagEntry({self.emoji!r}, {self.label!r}, {self.language.key!r})"
+
+
+def emoji_key(emoji: str) -> str:
+    """レジストリの検索キー（カスタム絵文字は名前が変わっても引けるよう ID にする）。"""
+    if emoji.startswith("<"):
+        match = CUSTOM_EMOJI_PATTERN.fullmatch(emoji)
+        if match:
+            return match.group(1)
+    return emoji
+
+
+class LanguageRegistry:
+    """絵文字 → FlagEntry と、その逆引き（Language → 絵文字・ラベル → FlagEntry）。作成後は変更しない。"""
+
+    __slots__ = ("_flags", "_by_language", "_by_label")
+
+    def __init__(self, entries: list[FlagEntry]):
+        flags: dict[str, FlagEntry] = {}
+        by_language: dict[Language, list[str]] = {}
+        by_label: dict[str, FlagEntry] = {}
+        for entry in entries:
+            flags[emoji_key(entry.emoji)] = entry
+            by_language.setdefault(entry.language, []).append(entry.emoji)
+            by_label.setdefault(entry.label, entry)
+        self._flags: Mapping[str, FlagEntry] = MappingProxyType(flags)
+        self._by_language: Mapping[Language, tuple[str, ...]] = MappingProxyType(
+            {language: tuple(emojis) for language, emojis in by_language.items()}
+        )
+        self._by_label: Mapping[str, FlagEntry] = MappingProxyType(by_label)
+
+    @classmethod
+    def from_mapping(cls, mapping: Mapping[str, Mapping]) -> "LanguageRegistry":
+        """FLAG_TO_LANG 形式（絵文字 → {"deepl", "mymemory", "label"}）から作る。"""
+        return cls(list(_parse_entries(mapping)))
+
+    def extend(self, mapping: Mapping[str, Mapping]) -> "LanguageRegistry":
+        """絵文字を追加・上書きした新しいレジストリを返す（自身は変更しない）。"""
+        entries = dict(self._flags)
+        for entry in _parse_entries(mapping):
+            entries[emoji_key(entry.emoji)] = entry
+        return LanguageRegistry(list(entries.values()))
+
+    def get(self, emoji: str) -> FlagEntry | None:
+        """リアクションの絵文字（str(payload.emoji)）から FlagEntry を返す。未登録なら None。"""
+        return self._flags.get(emoji_key(emoji))
+
+    def by_label(self, label: str) -> FlagEntry | None:
+        """投稿済みの表示ラベルから FlagEntry を返す（同じラベルが複数あれば先に登録された方）。"""
+        return self._by_label.get(label)
+
+    def flags_for(self, language: Language) -> tuple[str, ...]:
+        """同じ翻訳ターゲットに対応する絵文字の一覧。"""
+        return self._by_language.get(language, ())
+
+    def languages(self) -> Iterator[Language]:
+        return iter(self._by_language)
+
+    def __contains__(self, emoji: str) -> bool:
+        return emoji_key(emoji) in self._flags
+
+    def __len__(self) -> int:
+        return len(self._flags)
+
+
+def _parse_entries(mapping: Mapping[str, Mapping]) -> Iterator[FlagEntry]:
+    for emoji, info in mapping.items():
+        yield FlagEntry(emoji, info["label"], intern_language(info.get("deepl"), info["mymemory"]))
+
+
+# 組み込みの国旗（import 時に一度だけ作る）
+REGISTRY = LanguageRegistry.from_mapping(FLAG_TO_LANG)
+
+
+# ── ギルドごとの設定 ────────────────────────────────────────────────────────
+
+class GuildLanguages:
+    """
+    ギルドごとのレジストリ。設定ファイルの更新時刻を CONFIG_CHECK_INTERVAL ごとに確認し、
+    変わっていれば読み直す。読み込みに失敗した場合は直前の設定のまま動く。
+    """
+
+    def __init__(self, path: str | None, base: LanguageRegistry = REGISTRY):
+        self.path = path
+        self.base = base
+        self._common = base
+        self._guilds: dict[int, LanguageRegistry] = {}
+        self._mtime: float | None = None
+        self._checked_at = 0.0
+        if path:
+            self._reload()
+
+    def for_guild(self, guild_id: int | None) -> LanguageRegistry:
+        """ギルドで使うレジストリ（設定が無ければ組み込みの REGISTRY）。"""
+        if self.path and time.monotonic() - self._checked_at > CONFIG_CHECK_INTERVAL:
+            self._reload()
+        if guild_id is not None:
+            registry = self._guilds.get(guild_id)
+            if registry is not None:
+                return registry
+        return self._common
+
+    def _reload(self) -> None:
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            if self._mtime is not None:
+                logger.warning("言語設定ファイルが見つかりません（直前の設定を使います）: %s", self.path)
+            self._mtime = None
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                config = json.load(f)
+            common = self.base.extend(config.get(ALL_GUILDS, {}))
+            guilds = {
+                int(guild_id): common.extend(mapping)
+                for guild_id, mapping in config.items()
+                if guild_id != ALL_GUILDS
+            }
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning("言語設定ファイルを読み込めません（直前の設定を使います）: %s", e)
+            return
+        self._mtime = mtime
+        self._common = common
+        self._guilds = guilds
+        logger.info(
+            "言語設定を読み込みました: %s（共通 %d 件・ギルド別 %d ギルド）",
+            self.path, len(config.get(ALL_GUILDS, {})), len(guilds),
+        )
+
+
+_guild_languages: GuildLanguages | None = None
+
+
+def registry_for(guild_id: int | None) -> LanguageRegistry:
+    """ギルドで使う言語レジストリを返す（初回呼び出し時に LANGUAGE_CONFIG_PATH を読む）。"""
+    global _guild_languages
+    if _guild_languages is None:
+        _guild_languages = GuildLanguages(os.getenv("LANGUAGE_CONFIG_PATH", "").strip() or None)
+    return _guild_languages.for_guild(guild_id)
@@ -0,0 +1,239 @@
+"""
+Discord マークダウンの分割
+
+翻訳エンジンに送るのは地の文（プローズ）だけにする。
+コードブロックと行頭の引用／箇条書き記号は「ブロックの保護スパン」として地の文を区切り、
+インラインコード・URL・メンション・カスタム絵文字・タイムスタンプは「インラインの保護スパン」として
+文の中にプレースホルダ（<x0/> 等）で残す。翻訳後はどちらも原文のまま元の位置へ戻す。
+
+    segmented = segment(text)
+    translations = await engine.translate_batch(segmented.prose, ...)
+    result = segmented.fill(translations)
+
+インラインの保護スパンを文から切り離さないので、エンジンは文全体を見て語順を決められる
+（「Hello <@1> can you check this?」は 1 文のまま送る）。
+保護スパンはほぼ文字数枠を消費せず、エンジンに崩されることもない。
+地の文はさらに文単位に分ける。文ごとに翻訳メモリ（utils.cache）を引けるので、
+編集や一部だけ違うテンプレートでも、変わった文だけをエンジンに送ればよい。
+プレースホルダは文ごとに 0 から振るので、メンション先だけ違う文も翻訳メモリを共有する。
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+SEGMENT_CACHE_SIZE = 256
+
+# 地の文を区切る保護スパン（上が優先。コードブロック内の URL 等はコードブロックとして扱う）
+BLOCK_PATTERN = re.compile(
+    "|".join((
+        r"(?s:```.*?```)",                        # コードブロック
+        r"(?m:^[ \t]*(?:>>> |> |[-*+] |#{1,3} |\d+\. ))",  # 行頭の引用・箇条書き・見出し
+    ))
+)
+
+# 文の中にプレースホルダとして残す保護スパン（上から順に優先）
+INLINE_PATTERN = re.compile(
+    "|".join((
+        r"``[^\n]+?``|`[^`\n]+`",                 # インラインコード
+        r"<a?:\w+:\d+>",                          # カスタム絵文字
+        r"<(?:@[!&]?|#)\d+>",                     # ユーザー・ロール・チャンネルのメンション
+        r"</[\w -]+:\d+>",                        # スラッシュコマンドのメンション
+        r"<t:-?\d+(?::[tTdDfFR])?>",              # タイムスタンプ
+        r"<https?://[^\s>]+>",                    # 埋め込み抑制 URL
+        r"https?://[^\s<>]*[^\s<>.,;:!?)\]'\"]",  # URL（メッセージリンク含む・末尾の句読点は除く）
+        r"@(?:everyone|here)\b",
+        r"<x\d+\s*/>",                            # 原文にたまたま含まれるプレースホルダと同じ形の文字列
+    ))
+)
+
+# インラインの保護スパンの代わりに文に埋め込む印（XML の空要素なので DeepL の tag_handling=xml で保たれる）
+PLACEHOLDER = re.compile(r"<x(\d+)\s*/>")
+
+# 文の区切り（終止符 + 空白、全角の終止符、改行）。区切り自体は保護スパンとして残す
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|(?<=[。！？])\s*|\s*\n\s*")
+
+# 後ろに続いても文の終わりとみなさない略語（小文字・末尾のピリオド抜き）
+ABBREVIATIONS = frozenset((
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "e.g", "i.e", "cf", "approx",
+    "no", "fig", "vol", "dept", "inc", "ltd", "co", "corp", "jan", "feb", "mar", "apr",
+    "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+))
+
+
+def _ends_sentence(text: str, match: re.Match) -> bool:
+    """
+    SENTENCE_BREAK の一致が本当に文の区切りか。改行・「!」「?」・全角の終止符は常に区切る。
+    「.」は、直前が略語（Mr. e.g. 等）・1 文字のイニシャル（J. R.）でなく、
+    次の語が小文字で始まらない（大文字・数字以外の文字種・記号）ときだけ区切る。
+    """
+    if "\n" in match.group() or text[match.start() - 1] != ".":
+        return True
+    following = text[match.end():match.end() + 1]
+    if following.islower():
+        return False
+    before = text[:match.start() - 1].split()
+    word = before[-1].lstrip("([\"'").lower() if before else ""
+    if len(word) == 1 and word.isalpha():
+        return False
+    return word not in ABBREVIATIONS
+
+
+@dataclass(frozen=True)
+class SegmentedText:
+    """
+    原文を断片に分けたもの。
+
+    parts:          原文の断片（翻訳対象の文はプレースホルダ入り。fill で原文に戻る）
+    prose_indexes:  parts のうち翻訳対象（地の文の 1 文ずつ）の位置
+    spans:          翻訳対象の文ごとの、プレースホルダ <x0/>, <x1/>, ... に戻すインラインの保護スパン
+    """
+
+    parts: tuple[str, ...]
+    prose_indexes: tuple[int, ...]
+    spans: tuple[tuple[str, ...], ...]
+
+    @property
+    def prose(self) -> list[str]:
+        """翻訳エンジンに送る地の文の一覧（順序は原文どおり・プレースホルダ入り）。"""
+        return [self.parts[i] for i in self.prose_indexes]
+
+    @property
+    def prose_text(self) -> str:
+        """地の文だけを改行でつないだもの（言語検出用。プレースホルダは除く）。"""
+        return PLACEHOLDER.sub("", "\n".join(self.prose))
+
+    def fill(self, translations: list[str]) -> str:
+        """地の文を翻訳結果に差し替え、保護スパンを元の位置に戻した文字列を返す。"""
+        if len(translations) != len(self.prose_indexes):
+            raise ValueError(
+                f"翻訳結果の数が一致しません: {len(translations)} != {len(self.prose_indexes)}"
+            )
+        parts = list(self.parts)
+        for i, translated, spans in zip(self.prose_indexes, translations, self.spans):
+            parts[i] = restore(translated, spans)
+        return "".join(parts)
+
+
+def restore(text: str, spans: tuple[str, ...]) -> str:
+    """
+    プレースホルダを保護スパンに戻す。エンジンが落としたスパンは文末に補い、
+    重複・範囲外のプレースホルダは取り除く（保護スパンを失わず、増やさない）。
+    """
+    if not spans and "<x" not in text:
+        return text
+    used: set[int] = set()
+
+    def replace(match: re.Match) -> str:
+        i = int(match.group(1))
+        if i >= len(spans) or i in used:
+            return ""
+        used.add(i)
+        return spans[i]
+
+    restored = PLACEHOLDER.sub(replace, text)
+    missing = [span for i, span in enumerate(spans) if i not in used]
+    if missing:
+        restored = " ".join([restored.rstrip(), *missing])
+    return restored
+
+
+def _is_prose(text: str) -> bool:
+    """プレースホルダ以外に文字（数字・記号以外）を含むか。"""
+    return any(ch.isalpha() for ch in PLACEHOLDER.sub("", text))
+
+
+class _Builder:
+    """segment() の途中経過。"""
+
+    def __init__(self):
+        self.parts: list[str] = []
+        self.prose_indexes: list[int] = []
+        self.spans: list[tuple[str, ...]] = []
+
+    def add_text(self, text: str) -> None:
+        """
+        ブロックの保護スパン間のテキストを、インラインの保護スパンをプレースホルダにしたうえで
+        文（地の文）と前後の空白・文の区切り（保護）に分けて追加する。
+        """
+        inline: list[str] = []
+
+        def hold(match: re.Match) -> str:
+            inline.append(match.group())
+            return f"<x{len(inline) - 1}/>"
+
+        templated = INLINE_PATTERN.sub(hold, text)
+        pos = 0
+        for match in SENTENCE_BREAK.finditer(templated):
+            if not _ends_sentence(templated, match):
+                continue
+            self._add_sentence(templated[pos:match.start()], inline)
+            if match.group():
+                self.parts.append(match.group())
+            pos = match.end()
+        self._add_sentence(templated[pos:], inline)
+
+    def _add_sentence(self, text: str, inline: list[str]) -> None:
+        if not text:
+            return
+        core = text.strip()
+        if not _is_prose(core):
+            self.parts.append(_restore_all(text, inline))
+            return
+        start = text.index(core)
+        if start:
+            self.parts.append(text[:start])
+        # 文の中のプレースホルダを 0 から振り直す
+        spans: list[str] = []
+
+        def renumber(match: re.Match) -> str:
+            spans.append(inline[int(match.group(1))])
+            return f"<x{len(spans) - 1}/>"
+
+        self.prose_indexes.append(len(self.parts))
+        self.parts.append(PLACEHOLDER.sub(renumber, core))
+        self.spans.append(tuple(spans))
+        if start + len(core) < len(text):
+            self.parts.append(text[start + len(core):])
+
+    def build(self) -> "SegmentedText":
+        return SegmentedText(tuple(self.parts), tuple(self.prose_indexes), tuple(self.spans))
+
+
+def _restore_all(text: str, inline: list[str]) -> str:
+    """翻訳しない断片のプレースホルダを原文に戻す。"""
+    return PLACEHOLDER.sub(lambda match: inline[int(match.group(1))], text)
+
+
+@lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+def segment(text: str) -> SegmentedText:
+    """テキストを保護スパンと地の文に分割する（同じテキストの再分割はメモ化）。"""
+    builder = _Builder()
+    pos = 0
+    for match in BLOCK_PATTERN.finditer(text):
+        builder.add_text(text[pos:match.start()])
+        builder.parts.append(match.group())
+        pos = match.end()
+    builder.add_text(text[pos:])
+    return builder.build()
+
+
+# ── DeepL の XML モード ────────────────────────────────────────────────────
+
+def to_xml(text: str) -> str:
+    """プレースホルダ以外の &, <, > をエスケープする（DeepL の tag_handling=xml に渡す用）。"""
+    pieces = PLACEHOLDER.split(text)
+    out = []
+    for i, piece in enumerate(pieces):
+        if i % 2:
+            out.append(f"<x{piece}/>")
+        else:
+            out.append(piece.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
+    return "".join(out)
+
+
+def from_xml(text: str) -> str:
+    """to_xml の逆（プレースホルダはそのまま残す）。"""
+    return text.replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"').replace(
+        "&apos;", "'"
+    ).replace("&amp;", "&")
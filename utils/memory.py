@@ -0,0 +1,177 @@
+"""
+省メモリモードとメモリ使用量の計測
+
+LOW_MEMORY=1 で、小さな VM（Fly.io の 1 GB など）向けにキャッシュを絞って起動する。
+翻訳に必要なのは「リアクションされたメッセージとそのスレッド」だけなので、
+
+  - Intents はギルド・ギルドのメッセージ・リアクション・メッセージ本文だけにする
+    （ボイス状態・入力中・招待・Webhook・絵文字・イベント等のイベントとキャッシュを受け取らない）
+  - discord.py のメンバーキャッシュは持たない（リアクションの payload.member で足りる）・
+    ギルドのチャンク（メンバー一覧の取得）は起動時に行わない
+  - discord.py のメッセージキャッシュ・解決キャッシュ・翻訳キャッシュ・スレッドインデックスを小さくする
+
+キャッシュがギルド数ではなく件数の上限で決まるので、参加ギルドが増えてもメモリはほぼ一定に保たれる
+（キャッシュに無いメッセージは REST で取得する）。
+
+プロセスの RSS と各キャッシュの件数は /metrics（translator_process_resident_memory_bytes・
+translator_cache_entries）で確認できる。
+"""
+
+import logging
+import os
+import sys
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import discord
+
+from utils.metrics import CallbackGauge
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MemoryProfile:
+    """キャッシュの大きさの設定。"""
+    low: bool
+    max_messages: int | None          # discord.py のメッセージキャッシュ（None で無効）
+    resolver_entries: int             # utils.resolver のメッセージ・スレッドのキャッシュ
+    translation_cache_entries: int    # utils.cache のメモリ LRU
+    thread_index_entries: int         # utils.thread_index のメモリ上のエントリ
+
+
+DEFAULT_PROFILE = MemoryProfile(
+    low=False,
+    max_messages=1000,
+    resolver_entries=512,
+    translation_cache_entries=1000,
+    thread_index_entries=50_000,
+)
+LOW_MEMORY_PROFILE = MemoryProfile(
+    low=True,
+    max_messages=100,
+    resolver_entries=128,
+    translation_cache_entries=300,
+    thread_index_entries=10_000,
+)
+
+_profile: MemoryProfile | None = None
+
+
+def memory_profile() -> MemoryProfile:
+    """
+    環境変数 LOW_MEMORY（1 で省メモリ）から設定を返す。
+    MESSAGE_CACHE_SIZE で discord.py のメッセージキャッシュだけ上書きできる（0 で無効）。
+    """
+    global _profile
+    if _profile is None:
+        low = os.getenv("LOW_MEMORY", "").strip().lower() in ("1", "true", "yes")
+        profile = LOW_MEMORY_PROFILE if low else DEFAULT_PROFILE
+        size = os.getenv("MESSAGE_CACHE_SIZE", "").strip()
+        if size:
+            profile = MemoryProfile(
+                profile.low,
+                int(size) or None,
+                profile.resolver_entries,
+                profile.translation_cache_entries,
+                profile.thread_index_entries,
+            )
+        _profile = profile
+    return _profile
+
+
+def gateway_options(intents: discord.Intents) -> dict:
+    """
+    Bot / AutoShardedBot に渡すキャッシュ関連のオプション。
+    省メモリモードでは intents を翻訳に必要なものだけに絞る。
+    """
+    profile = memory_profile()
+    if not profile.low:
+        return {"intents": intents, "max_messages": profile.max_messages}
+
+    low_intents = discord.Intents.none()
+    low_intents.guilds = True              # チャンネル・スレッドのキャッシュ
+    low_intents.guild_messages = True      # 先読み翻訳・編集/削除の追従
+    low_intents.guild_reactions = True     # 国旗リアクション
+    low_intents.message_content = True     # 翻訳する本文
+    logger.info(
+        "省メモリモード: メッセージキャッシュ=%s件・メンバーキャッシュなし・起動時のチャンクなし",
+        profile.max_messages or 0,
+    )
+    return {
+        "intents": low_intents,
+        "max_messages": profile.max_messages,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+    }
+
+
+# ── 計測 ───────────────────────────────────────────────────────────────────
+
+def rss_bytes() -> int | None:
+    """
+    プロセスの常駐メモリ（RSS）。Linux では /proc から現在値を、
+    それ以外では resource の最大値（ピーク）を返す。取得できなければ None。
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+_cache_sources: dict[str, Callable[[], dict[str, int]]] = {}
+
+
+def register_caches(source: str, sizes: Callable[[], dict[str, int]]) -> None:
+    """
+    translator_cache_entries に出すキャッシュを登録する。
+    sizes はキャッシュ名 → 件数を返す（同じ source で登録し直すと置き換わる）。
+    """
+    _cache_sources[source] = sizes
+
+
+def gateway_cache_sizes(client: discord.Client) -> dict[str, int]:
+    """discord.py のゲートウェイキャッシュの件数。"""
+    guilds = client.guilds
+    return {
+        "discord_guilds": len(guilds),
+        "discord_members": sum(len(guild.members) for guild in guilds),
+        "discord_threads": sum(len(guild.threads) for guild in guilds),
+        "discord_users": len(client.users),
+        "discord_messages": len(client.cached_messages),
+        "discord_emojis": len(client.emojis),
+    }
+
+
+def _rss_stats() -> dict[tuple[str, ...], float]:
+    rss = rss_bytes()
+    return {} if rss is None else {(): rss}
+
+
+def _cache_stats() -> dict[tuple[str, ...], float]:
+    return {
+        (name,): size
+        for sizes in _cache_sources.values()
+        for name, size in sizes().items()
+    }
+
+
+PROCESS_RSS = CallbackGauge(
+    "translator_process_resident_memory_bytes",
+    "Resident set size of this process (peak on platforms without /proc).",
+    (),
+    _rss_stats,
+)
+CACHE_ENTRIES = CallbackGauge(
+    "translator_cache_entries",
+    "Entries held in each in-memory cache (discord.py gateway caches and the bot's own caches).",
+    ("cache",),
+    _cache_stats,
+)
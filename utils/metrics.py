@@ -0,0 +1,361 @@
+"""
+Prometheus 形式のメトリクス
+
+外部ライブラリを使わない最小限の Counter / Gauge / Histogram と、
+ヘルスチェックサーバーの /metrics で返すテキスト出力（render）を提供する。
+リアクション処理の各段階・翻訳エンジン・イベントループ遅延・Discord のレート制限待ちを計測する。
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = tuple[str, ...]
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ラベルが一致しません: {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """単調増加するカウンタ。"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """増減する値。"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {} if self.labelnames else {(): 0}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class CallbackGauge(_Metric):
+    """出力時にコールバックで値を集める Gauge（キャッシュ統計など既存の値を公開する用）。"""
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...],
+        callback: Callable[[], dict[LabelValues, float]],
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self) -> list[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning("メトリクス %s の収集に失敗: %s", self.name, e)
+            return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """レイテンシ等の分布（累積バケット + 合計 + 件数）。"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * len(self.buckets)
+            self._sums[key] = 0.0
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """with ブロックの経過時間を記録する（ブロック内で await してもよい）。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """メトリクスの登録先。"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"メトリクス名が重複しています: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def render() -> str:
+    """登録済みメトリクスを Prometheus テキスト形式で返す。"""
+    return REGISTRY.render()
+
+
+# ── リアクション処理 ───────────────────────────────────────────────────────
+
+REACTIONS = Counter(
+    "translator_reactions_total",
+    "Reaction events received, by outcome (flag / ignored).",
+    ("result",),
+)
+JOBS_IN_FLIGHT = Gauge(
+    "translator_jobs_in_flight",
+    "Translation jobs currently being processed.",
+)
+JOBS_QUEUED = Gauge(
+    "translator_jobs_queued",
+    "Translation jobs waiting in the scheduler queue.",
+)
+JOBS_REJECTED = Counter(
+    "translator_jobs_rejected_total",
+    "Translation jobs dropped because the queue stayed full.",
+)
+JOBS_REPLAYED = Counter(
+    "translator_jobs_replayed_total",
+    "Unfinished translation jobs replayed from the journal at startup.",
+)
+JOB_QUEUE_WAIT_SECONDS = Histogram(
+    "translator_job_queue_wait_seconds",
+    "Time a translation job waited in the queue before a worker picked it up.",
+)
+STAGE_SECONDS = Histogram(
+    "translator_stage_duration_seconds",
+    "Duration of each stage of the reaction pipeline.",
+    ("stage",),
+)
+REACTION_TO_POST_SECONDS = Histogram(
+    "translator_reaction_to_post_seconds",
+    "Time from the first reaction of a job to its translations being posted.",
+)
+
+PREFETCHES = Counter(
+    "translator_prefetches_total",
+    "Speculative pre-translations, by result (translated / quota / expired / empty).",
+    ("result",),
+)
+PREFETCH_HITS = Counter(
+    "translator_prefetch_hits_total",
+    "Reactions whose target language had been pre-translated.",
+)
+HISTORY_MESSAGES = Counter(
+    "translator_history_messages_total",
+    "Messages scanned by /translate-history, by result (translated / skipped / failed).",
+    ("result",),
+)
+
+# ── 翻訳エンジン ───────────────────────────────────────────────────────────
+
+ENGINE_REQUESTS = Counter(
+    "translator_engine_requests_total",
+    "Translation engine calls, by engine and result (success / failure).",
+    ("engine", "result"),
+)
+ENGINE_FALLBACKS = Counter(
+    "translator_engine_fallbacks_total",
+    "Times an engine failed and the next engine was tried.",
+    ("engine",),
+)
+ENGINE_SECONDS = Histogram(
+    "translator_engine_duration_seconds",
+    "Latency of translation engine calls.",
+    ("engine",),
+)
+ENGINE_CHARACTERS = Counter(
+    "translator_engine_characters_total",
+    "Characters sent to each translation engine (quota consumption).",
+    ("engine",),
+)
+
+# ── ランタイム ─────────────────────────────────────────────────────────────
+
+EVENT_LOOP_LAG = Gauge(
+    "translator_event_loop_lag_seconds",
+    "Most recent event loop scheduling delay.",
+)
+RATE_LIMIT_WAITS = Counter(
+    "discord_rate_limit_waits_total",
+    "HTTP 429 responses from Discord that made discord.py sleep, by scope.",
+    ("scope",),
+)
+RATE_LIMIT_WAIT_SECONDS = Counter(
+    "discord_rate_limit_wait_seconds_total",
+    "Total seconds discord.py slept because of HTTP 429 responses.",
+)
+RATE_LIMIT_RESPONSES = Counter(
+    "discord_rate_limit_responses_total",
+    "HTTP 429 responses seen in Discord API response headers, by scope (user / global / shared).",
+    ("scope",),
+)
+OUTBOUND_WAITS = Counter(
+    "translator_outbound_waits_total",
+    "Outbound Discord calls held back before sending, by reason (bucket / global / pacer).",
+    ("reason",),
+)
+OUTBOUND_WAIT_SECONDS = Counter(
+    "translator_outbound_wait_seconds_total",
+    "Total seconds outbound Discord calls were held back before sending.",
+)
+THREAD_ARCHIVES = Counter(
+    "translator_thread_archives_total",
+    "Deferred thread archives, by result (archived / superseded).",
+    ("result",),
+)
+
+
+async def monitor_event_loop_lag(interval: float = 1.0) -> None:
+    """interval ごとに sleep の遅れを測り、イベントループの詰まり具合を記録する。"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.set(max(0.0, loop.time() - start - interval))
+
+
+class _RateLimitLogHandler(logging.Handler):
+    """discord.http のレート制限ログ（429 で再試行待ち）を数える。"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.msg if isinstance(record.msg, str) else ""
+        if message.startswith("We are being rate limited") and "Retrying in" in message:
+            RATE_LIMIT_WAITS.inc(scope="route")
+            if record.args:
+                RATE_LIMIT_WAIT_SECONDS.inc(float(record.args[-1]))
+        elif message.startswith("Global rate limit has been hit"):
+            RATE_LIMIT_WAITS.inc(scope="global")
+
+
+def install_rate_limit_hook() -> None:
+    """discord.py の HTTP ロガーにレート制限カウンタを取り付ける。"""
+    http_logger = logging.getLogger("discord.http")
+    if not any(isinstance(h, _RateLimitLogHandler) for h in http_logger.handlers):
+        http_logger.addHandler(_RateLimitLogHandler(level=logging.WARNING))
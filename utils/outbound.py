@@ -0,0 +1,246 @@
+"""
+Discord への送信（投稿・編集・削除・スレッドのアーカイブ）のスケジューラ
+
+- RateLimitTracker: discord.py の HTTP 応答ヘッダ（X-RateLimit-*）からルートごとの
+  残り回数とリセット時刻を追跡する（Client の http_trace に取り付ける）。
+- OutboundScheduler: 送信の前に、そのルートのバケットが尽きていればリセットまで待ち、
+  全体でも DISCORD_OUTBOUND_RATE 件/秒を超えないように間隔を空けてから送る。
+  429 を受けてから discord.py の中で眠るのではなく、送る前に待つので 429 自体が減る。
+  スレッドのアーカイブは THREAD_ARCHIVE_DELAY 秒遅らせ、その間に同じスレッドへ
+  次の投稿が来たら取り消す（続けて翻訳されたスレッドは開閉を繰り返さず、最後に 1 回だけ閉じる）。
+  投稿・編集はメンションを通知しない（訳文には原文の <@id>・@everyone 等がそのまま残るため）。
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+import aiohttp
+import discord
+
+from utils.metrics import OUTBOUND_WAIT_SECONDS, OUTBOUND_WAITS, RATE_LIMIT_RESPONSES, THREAD_ARCHIVES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOUND_RATE = 40.0     # 件/秒（Discord 全体の上限 50 件/秒から取得系の分を残す）
+DEFAULT_ARCHIVE_DELAY = 5.0      # 秒
+MAX_TRACKED_ROUTES = 10_000
+
+API_PREFIX = re.compile(r"^/api/v\d+")
+MAJOR_RESOURCES = ("channels", "guilds", "webhooks")
+
+# 訳文は原文のメンションを含むので、投稿・編集で誰にも通知しない
+NO_MENTIONS = discord.AllowedMentions.none()
+
+
+def route_key(method: str, path: str) -> str:
+    """
+    レート制限を追跡する単位（"POST /channels/123/messages" 等）。
+    Discord のバケットは「ルート + 主パラメータ」単位なので、
+    チャンネル・ギルド・Webhook の ID だけ残し、それ以外の ID は {id} にまとめる。
+    """
+    parts = API_PREFIX.sub("", path).strip("/").split("/")
+    major_seen = False
+    for i, part in enumerate(parts):
+        if part.isdigit():
+            if not major_seen and i > 0 and parts[i - 1] in MAJOR_RESOURCES:
+                major_seen = True
+            else:
+                parts[i] = "{id}"
+    return f"{method.upper()} /" + "/".join(parts)
+
+
+@dataclass
+class Bucket:
+    remaining: int
+    reset_at: float       # time.monotonic() 基準
+
+
+class RateLimitTracker:
+    """Discord の応答ヘッダからルートごとのレート制限を追跡する。"""
+
+    def __init__(self):
+        self._routes: dict[str, Bucket] = {}
+        self.global_until = 0.0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """discord.py の Client(http_trace=...) に渡す TraceConfig。"""
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(self._on_request_end)
+        return trace
+
+    async def _on_request_end(self, _session, _context, params: aiohttp.TraceRequestEndParams) -> None:
+        self.observe(params.method, params.url.path, params.response.status, params.response.headers)
+
+    def observe(self, method: str, path: str, status: int, headers) -> None:
+        """1 回の応答を記録する。"""
+        now = time.monotonic()
+        key = route_key(method, path)
+        if status == 429:
+            scope = headers.get("X-RateLimit-Scope", "user")
+            RATE_LIMIT_RESPONSES.inc(scope=scope)
+            retry_after = _float(headers.get("Retry-After")) or 1.0
+            if headers.get("X-RateLimit-Global", "").lower() == "true" or scope == "global":
+                self.global_until = max(self.global_until, now + retry_after)
+                return
+            self._put(key, Bucket(0, now + retry_after))
+            return
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = _float(headers.get("X-RateLimit-Reset-After"))
+        if remaining is None or reset_after is None:
+            return
+        self._put(key, Bucket(int(remaining), now + reset_after))
+
+    def _put(self, key: str, bucket: Bucket) -> None:
+        self._routes.pop(key, None)
+        self._routes[key] = bucket
+        if len(self._routes) > MAX_TRACKED_ROUTES:
+            del self._routes[next(iter(self._routes))]
+
+    def delay(self, key: str) -> tuple[float, str]:
+        """このルートに今送ると制限に掛かる場合、待つべき秒数と理由を返す（待たなくてよければ 0）。"""
+        now = time.monotonic()
+        if self.global_until > now:
+            return self.global_until - now, "global"
+        bucket = self._routes.get(key)
+        if bucket is not None and bucket.remaining <= 0 and bucket.reset_at > now:
+            return bucket.reset_at - now, "bucket"
+        return 0.0, ""
+
+    def reserve(self, key: str) -> None:
+        """送信前に残り回数を 1 減らしておく（応答が返る前の並行送信で使い切らないように）。"""
+        bucket = self._routes.get(key)
+        if bucket is not None and bucket.reset_at > time.monotonic():
+            bucket.remaining -= 1
+
+
+def _float(value: str | None) -> float | None:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+RATE_LIMITS = RateLimitTracker()
+
+
+class OutboundScheduler:
+    """レート制限を見ながら Discord へ送信し、スレッドのアーカイブをまとめる。"""
+
+    def __init__(
+        self,
+        tracker: RateLimitTracker = RATE_LIMITS,
+        rate: float = DEFAULT_OUTBOUND_RATE,
+        archive_delay: float = DEFAULT_ARCHIVE_DELAY,
+    ):
+        """rate: 全体の送信レート（件/秒、0 で無制限）。"""
+        self.tracker = tracker
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.archive_delay = archive_delay
+        self._next_slot = 0.0
+        self._archives: dict[int, tuple[asyncio.Task, Callable[[], Awaitable[None]]]] = {}
+
+    # ── 送信 ───────────────────────────────────────────────────────────────
+
+    async def _wait(self, key: str) -> None:
+        """ルートのバケットと全体の送信間隔が空くまで待つ。"""
+        while True:
+            delay, reason = self.tracker.delay(key)
+            if delay <= 0:
+                break
+            OUTBOUND_WAITS.inc(reason=reason)
+            OUTBOUND_WAIT_SECONDS.inc(delay)
+            logger.debug("レート制限のため送信を待ちます: %s %.2fs (%s)", key, delay, reason)
+            await asyncio.sleep(delay)
+        if self.interval:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            if slot > now:
+                OUTBOUND_WAITS.inc(reason="pacer")
+                OUTBOUND_WAIT_SECONDS.inc(slot - now)
+                await asyncio.sleep(slot - now)
+        self.tracker.reserve(key)
+
+    async def send(self, channel: discord.abc.Messageable, content: str) -> discord.Message:
+        await self._wait(route_key("POST", f"/channels/{channel.id}/messages"))
+        return await channel.send(content, allowed_mentions=NO_MENTIONS)
+
+    async def send_all(
+        self,
+        channel: discord.abc.Messageable,
+        contents: list[str],
+        sent: list[discord.Message] | None = None,
+    ) -> list[discord.Message]:
+        """
+        contents を順に投稿する（途中で失敗したら例外を送出する）。
+        sent を渡すと投稿できたメッセージをそこに追加していく（失敗時もそれまでの分が残る）。
+        """
+        sent = [] if sent is None else sent
+        for content in contents:
+            sent.append(await self.send(channel, content))
+        return sent
+
+    async def edit_message(self, channel_id: int, message: discord.PartialMessage, content: str) -> None:
+        await self._wait(route_key("PATCH", f"/channels/{channel_id}/messages/{message.id}"))
+        await message.edit(content=content, allowed_mentions=NO_MENTIONS)
+
+    async def delete_message(self, channel_id: int, message: discord.PartialMessage) -> None:
+        await self._wait(route_key("DELETE", f"/channels/{channel_id}/messages/{message.id}"))
+        await message.delete()
+
+    async def edit_thread(self, thread: discord.Thread, **fields) -> discord.Thread:
+        await self._wait(route_key("PATCH", f"/channels/{thread.id}"))
+        return await thread.edit(**fields)
+
+    # ── アーカイブの遅延 ───────────────────────────────────────────────────
+
+    def archive_later(self, thread_id: int, archive: Callable[[], Awaitable[None]]) -> None:
+        """
+        archive_delay 秒後に archive() を呼ぶ。同じスレッドの予約があれば置き換える。
+        予約の取り消し・置き換えは、archive() と同じロックを持った状態で行うこと
+        （アーカイブの要求中に取り消されることがないように）。
+        """
+        self.cancel_archive(thread_id)
+        task = asyncio.create_task(self._archive_after(thread_id, archive))
+        self._archives[thread_id] = (task, archive)
+
+    def cancel_archive(self, thread_id: int) -> bool:
+        """予約を取り消す。予約があった（スレッドはまだ開いている）なら True。"""
+        pending = self._archives.pop(thread_id, None)
+        if pending is None:
+            return False
+        pending[0].cancel()
+        THREAD_ARCHIVES.inc(result="superseded")
+        return True
+
+    async def _archive_after(self, thread_id: int, archive: Callable[[], Awaitable[None]]) -> None:
+        await asyncio.sleep(self.archive_delay)
+        try:
+            await archive()
+            THREAD_ARCHIVES.inc(result="archived")
+        finally:
+            if self._archives.get(thread_id, (None,))[0] is asyncio.current_task():
+                del self._archives[thread_id]
+
+    async def flush(self) -> None:
+        """予約中のアーカイブを今すぐ実行する（終了時に開いたままのスレッドを残さない）。"""
+        pending = list(self._archives.values())
+        self._archives.clear()
+        for task, _ in pending:
+            task.cancel()
+        await asyncio.gather(*(task for task, _ in pending), return_exceptions=True)
+        results = await asyncio.gather(*(archive() for _, archive in pending), return_exceptions=True)
+        THREAD_ARCHIVES.inc(sum(1 for r in results if not isinstance(r, BaseException)), result="archived")
+
+
+def outbound_from_env() -> OutboundScheduler:
+    """環境変数 DISCORD_OUTBOUND_RATE・THREAD_ARCHIVE_DELAY から OutboundScheduler を作る。"""
+    return OutboundScheduler(
+        rate=float(os.getenv("DISCORD_OUTBOUND_RATE", str(DEFAULT_OUTBOUND_RATE))),
+        archive_delay=float(os.getenv("THREAD_ARCHIVE_DELAY", str(DEFAULT_ARCHIVE_DELAY))),
+    )
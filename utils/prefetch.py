@@ -0,0 +1,268 @@
+"""
+先読み翻訳（オプトイン）
+
+ほぼすべてのメッセージに同じ国旗が付くチャンネル（国際チャンネル等）では、
+新しいメッセージが届いた時点で、よく求められる言語へ裏で翻訳してキャッシュに入れておく。
+後から国旗が付いたときは翻訳キャッシュにヒットするので、投稿するだけで済む。
+
+- 対象は PREFETCH_CHANNELS に挙げたチャンネルだけ（"*" で全チャンネル）。
+  そのうえで、リアクションの統計から「メッセージの PREFETCH_MIN_SHARE 以上に付く言語」を
+  多い順に PREFETCH_MAX_LANGUAGES 個まで先読みする。
+- 1 日に先読みに使う文字数は、エンジンの残り枠から割り出した 1 日分の
+  PREFETCH_QUOTA_SHARE 倍まで（ルーターの daily_allowance）。枠が分からないエンジン
+  （DeepL の使用量が取得できなかった等）は 0 文字として数え、分かった時点で決め直す。
+- 先読みは 1 件ずつ、スケジューラに待ちジョブが無いときだけ行う。
+  国旗リアクションによる翻訳を待たせることはない。
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import discord
+
+from utils.cache import TTLCache
+from utils.detection import detect_language
+from utils.jobs import JobScheduler
+from utils.languages import Language
+from utils.markup import segment
+from utils.metrics import PREFETCH_HITS, PREFETCHES
+from utils.state import get_state
+from utils.translator import get_router, translate_many
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUOTA_SHARE = 0.1
+DEFAULT_MIN_SHARE = 0.5
+DEFAULT_MAX_LANGUAGES = 3
+
+STATS_WINDOW = 200          # 統計の減衰（直近およそこの件数のメッセージを見る）
+MIN_MESSAGES = 20           # これより少ないチャンネルは先読みしない
+QUEUE_MAX = 100             # 待ちが溢れたら古いものから捨てる
+MAX_AGE = 120.0             # これより古いメッセージは先読みしない（秒）
+IDLE_POLL_INTERVAL = 0.5    # スケジューラが空くのを待つ間隔（秒）
+SEEN_TTL = 86400            # 統計に数えたリアクションを覚えておく時間（秒）
+SEEN_MAX_ENTRIES = 10_000
+
+
+class ChannelStats:
+    """チャンネル 1 つ分の減衰付きカウンタ（メッセージ数と、言語ごとのリアクションされた件数）。"""
+
+    __slots__ = ("messages", "languages")
+
+    def __init__(self):
+        self.messages = 0.0
+        self.languages: dict[Language, float] = {}
+
+    def decay(self, factor: float) -> None:
+        self.messages *= factor
+        for language in self.languages:
+            self.languages[language] *= factor
+
+
+class ReactionStats:
+    """チャンネルごとに「どの言語がメッセージの何割に求められるか」を数える。"""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self.factor = 1 - 1 / window
+        self._channels: dict[int, ChannelStats] = {}
+        # 同じメッセージに同じ言語の国旗が何度付いても 1 回と数える
+        self._seen: TTLCache[tuple[int, Language], bool] = TTLCache(SEEN_MAX_ENTRIES, SEEN_TTL)
+
+    def observe_message(self, channel_id: int) -> None:
+        stats = self._channels.get(channel_id)
+        if stats is None:
+            stats = self._channels[channel_id] = ChannelStats()
+        stats.decay(self.factor)
+        stats.messages += 1
+
+    def observe_reaction(self, channel_id: int, message_id: int, language: Language) -> None:
+        stats = self._channels.get(channel_id)
+        if stats is None or (message_id, language) in self._seen:
+            return
+        self._seen.put((message_id, language), True)
+        stats.languages[language] = stats.languages.get(language, 0.0) + 1
+
+    def hot_languages(
+        self, channel_id: int, min_share: float, limit: int
+    ) -> list[Language]:
+        """メッセージの min_share 以上に求められる言語を、多い順に limit 個まで返す。"""
+        stats = self._channels.get(channel_id)
+        if stats is None or stats.messages < MIN_MESSAGES:
+            return []
+        ranked = sorted(stats.languages.items(), key=lambda item: item[1], reverse=True)
+        return [
+            language for language, count in ranked[:limit]
+            if count / stats.messages >= min_share
+        ]
+
+
+@dataclass
+class PrefetchItem:
+    message_id: int
+    content: str
+    languages: list[Language]
+    received_at: float
+
+
+class Prefetcher:
+    """統計にもとづいて新着メッセージを先読み翻訳する、低優先度のワーカー 1 本。"""
+
+    def __init__(
+        self,
+        scheduler: JobScheduler,
+        channels: frozenset[int] | None,
+        quota_share: float = DEFAULT_QUOTA_SHARE,
+        min_share: float = DEFAULT_MIN_SHARE,
+        max_languages: int = DEFAULT_MAX_LANGUAGES,
+    ):
+        """channels: 対象チャンネル（None なら全チャンネル）。"""
+        self.scheduler = scheduler
+        self.channels = channels
+        self.quota_share = quota_share
+        self.min_share = min_share
+        self.max_languages = max_languages
+        self.stats = ReactionStats()
+        self._queue: deque[PrefetchItem] = deque(maxlen=QUEUE_MAX)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._prefetched: TTLCache[int, frozenset[Language]] = TTLCache(QUEUE_MAX * 10, MAX_AGE * 10)
+        self._budget_day = ""
+        self._budget: int | None = None
+        self._budget_known = False     # 全エンジンの枠が分かった状態で決めた枠か
+
+    def enabled_for(self, channel_id: int) -> bool:
+        return self.channels is None or channel_id in self.channels
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._worker(), name="prefetch-worker")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._queue.clear()
+
+    # ── 統計 ───────────────────────────────────────────────────────────────
+
+    def on_message(self, message: discord.Message) -> None:
+        """新着メッセージを数え、先読みする言語があれば待ち行列に入れる。"""
+        if not self.enabled_for(message.channel.id):
+            return
+        self.stats.observe_message(message.channel.id)
+        languages = self.stats.hot_languages(
+            message.channel.id, self.min_share, self.max_languages
+        )
+        content = message.content.strip()
+        if languages and content:
+            self._queue.append(PrefetchItem(message.id, content, languages, time.monotonic()))
+            self._wakeup.set()
+
+    def on_reactions(self, channel_id: int, message_id: int, languages: list[Language]) -> None:
+        """国旗リアクションで求められた言語を統計に加え、先読み済みなら命中として数える。"""
+        if not self.enabled_for(channel_id):
+            return
+        for language in languages:
+            self.stats.observe_reaction(channel_id, message_id, language)
+        prefetched = self._prefetched.get(message_id)
+        if prefetched:
+            hits = prefetched.intersection(languages)
+            if hits:
+                PREFETCH_HITS.inc(len(hits))
+                self._prefetched.put(message_id, prefetched - hits)
+
+    # ── 先読み ─────────────────────────────────────────────────────────────
+
+    async def _worker(self) -> None:
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # 国旗リアクションのジョブが待っている間は先読みしない
+            while not self.scheduler.idle:
+                await asyncio.sleep(IDLE_POLL_INTERVAL)
+            item = self._queue.pop()     # 新しいメッセージほど国旗が付く見込みが高い
+            if time.monotonic() - item.received_at > MAX_AGE:
+                PREFETCHES.inc(result="expired")
+                continue
+            try:
+                await self._prefetch(item)
+            except Exception:
+                logger.exception("先読み翻訳で予期しないエラー: message_id=%s", item.message_id)
+
+    async def _prefetch(self, item: PrefetchItem) -> None:
+        segmented = segment(item.content)
+        if not segmented.prose:
+            PREFETCHES.inc(result="empty")
+            return
+        # 文単位の翻訳メモリで実際の送信はこれより少なくなりうるが、上限で見積もって予約する
+        chars = len(segmented.prose_text) * len(item.languages)
+        if not await self._reserve(chars):
+            PREFETCHES.inc(result="quota")
+            return
+
+        source_lang = detect_language(segmented.prose_text)
+        results = await translate_many(item.content, item.languages, source_lang=source_lang)
+        done = frozenset(
+            language for language, (text, engine) in zip(item.languages, results)
+            if text is not None or engine == "same_language"
+        )
+        self._prefetched.put(item.message_id, done)
+        PREFETCHES.inc(result="translated")
+        logger.debug(
+            "先読み翻訳: langs=%s message_id=%s",
+            ", ".join(language.key for language in done), item.message_id,
+        )
+
+    async def _reserve(self, chars: int) -> bool:
+        """
+        今日の先読み枠から chars 文字を確保する（枠が無制限なら常に True）。
+        エンジンの枠が分からない間は分かっている分だけで見積もり（全部不明なら先読みしない）、
+        分かり次第決め直す。
+        """
+        day = datetime.now(timezone.utc).strftime("%Y%m%d")
+        if day != self._budget_day or not self._budget_known:
+            # 1 日の枠は日付が変わって最初の先読みで決める（使うほど枠が縮むのを避ける）
+            router = await get_router()
+            allowance = router.daily_allowance()
+            self._budget = None if allowance is None else int(allowance * self.quota_share)
+            self._budget_known = router.quota_known()
+            self._budget_day = day
+        if self._budget is None:
+            return True
+        state = get_state()
+        key = state.key(f"prefetch:{day}")
+        used = await state.incr(key, chars, ttl=2 * 86400)
+        if used > self._budget:
+            await state.incr(key, -chars)
+            logger.debug("先読みの文字数枠を使い切りました: %d / %d", used - chars, self._budget)
+            return False
+        return True
+
+
+def prefetcher_from_env(scheduler: JobScheduler) -> Prefetcher | None:
+    """環境変数 PREFETCH_CHANNELS 等から Prefetcher を作る（未設定なら None = 無効）。"""
+    channels_env = os.getenv("PREFETCH_CHANNELS", "").strip()
+    if not channels_env:
+        return None
+    channels = None if channels_env == "*" else frozenset(
+        int(channel) for channel in channels_env.split(",") if channel.strip()
+    )
+    prefetcher = Prefetcher(
+        scheduler,
+        channels,
+        quota_share=float(os.getenv("PREFETCH_QUOTA_SHARE", str(DEFAULT_QUOTA_SHARE))),
+        min_share=float(os.getenv("PREFETCH_MIN_SHARE", str(DEFAULT_MIN_SHARE))),
+        max_languages=int(os.getenv("PREFETCH_MAX_LANGUAGES", str(DEFAULT_MAX_LANGUAGES))),
+    )
+    logger.info(
+        "先読み翻訳を有効化: channels=%s quota_share=%.2f",
+        "all" if channels is None else len(channels), prefetcher.quota_share,
+    )
+    return prefetcher
@@ -0,0 +1,145 @@
+"""
+チャンネル・メッセージ・スレッド・ユーザーの解決
+
+まずゲートウェイのキャッシュ（bot.get_channel / bot.cached_messages / guild.get_thread /
+bot.get_user）を引き、無い場合だけ REST で取得する。
+直近にリアクションされたメッセージとそのスレッドは短い TTL で保持し、
+同じメッセージへの連続リアクションで fetch を繰り返さない。
+"""
+
+import logging
+
+import discord
+from discord.ext import commands
+
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+RESOLVER_TTL = 300           # 秒
+RESOLVER_MAX_ENTRIES = 512
+
+
+class DiscordResolver:
+    """ゲートウェイキャッシュ優先でチャンネル・メッセージ・スレッドを解決する。"""
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        ttl: float = RESOLVER_TTL,
+        max_entries: int = RESOLVER_MAX_ENTRIES,
+    ):
+        self.bot = bot
+        self._messages: TTLCache[int, discord.Message] = TTLCache(max_entries, ttl)
+        self._threads: TTLCache[int, discord.Thread] = TTLCache(max_entries, ttl)
+        # REST で取得したメッセージ（thread 情報を含むので再取得不要）
+        self._fetched: TTLCache[int, bool] = TTLCache(max_entries, ttl)
+
+    def cache_sizes(self) -> dict[str, int]:
+        return {"resolver_messages": len(self._messages), "resolver_threads": len(self._threads)}
+
+    # ── チャンネル・ユーザー ───────────────────────────────────────────────
+
+    async def channel(self, channel_id: int):
+        """チャンネル（スレッド含む）を返す。取得できなければ None。"""
+        channel = self.bot.get_channel(channel_id)
+        if channel is not None:
+            return channel
+        try:
+            return await self.bot.fetch_channel(channel_id)
+        except (discord.NotFound, discord.Forbidden, discord.HTTPException):
+            return None
+
+    async def user(self, payload: discord.RawReactionActionEvent):
+        """リアクションしたユーザーを返す（payload.member → キャッシュ → REST）。"""
+        user = payload.member or self.bot.get_user(payload.user_id)
+        if user is not None:
+            return user
+        try:
+            return await self.bot.fetch_user(payload.user_id)
+        except discord.HTTPException:
+            return None
+
+    # ── メッセージ ─────────────────────────────────────────────────────────
+
+    def _cached_message(self, message_id: int) -> discord.Message | None:
+        message = self._messages.get(message_id)
+        if message is not None:
+            return message
+        # discord.py のメッセージキャッシュ（新しいものほど後ろ）
+        for cached in reversed(self.bot.cached_messages):
+            if cached.id == message_id:
+                return cached
+        return None
+
+    async def message(self, channel, message_id: int) -> discord.Message | None:
+        """メッセージを返す。キャッシュに無ければ fetch する。"""
+        message = self._cached_message(message_id)
+        if message is None:
+            message = await self.fetch_message(channel, message_id)
+        else:
+            self._messages.put(message_id, message)
+        return message
+
+    async def fetch_message(self, channel, message_id: int) -> discord.Message | None:
+        """REST でメッセージを取得してキャッシュする。"""
+        try:
+            message = await channel.fetch_message(message_id)
+        except (discord.NotFound, discord.Forbidden, discord.HTTPException):
+            logger.error("メッセージの取得に失敗: message_id=%s", message_id)
+            return None
+        self._messages.put(message_id, message)
+        self._fetched.put(message_id, True)
+        return message
+
+    def forget_message(self, message_id: int) -> None:
+        """編集・削除されたメッセージをキャッシュから外す。"""
+        self._messages.pop(message_id)
+        self._fetched.pop(message_id)
+
+    # ── スレッド ───────────────────────────────────────────────────────────
+
+    async def thread_for(self, message: discord.Message) -> discord.Thread | None:
+        """
+        メッセージから作成されたスレッドを返す（無ければ None）。
+        アクティブなスレッドはゲートウェイキャッシュに、アーカイブ済みは
+        自前の TTL キャッシュか REST 取得したメッセージの thread 情報にある。
+        """
+        if message.guild is None:
+            return None
+        thread = message.guild.get_thread(message.id) or self._threads.get(message.id)
+        if thread is not None:
+            return thread
+        if message.id not in self._fetched:
+            fetched = await self.fetch_message(message.channel, message.id)
+            if fetched is None:
+                return None
+            message = fetched
+        thread = message.thread
+        if thread is not None:
+            self._threads.put(message.id, thread)
+        return thread
+
+    def cached_thread(self, message_id: int) -> discord.Thread | None:
+        """TTL キャッシュにあるスレッドを返す（REST は呼ばない）。"""
+        return self._threads.get(message_id)
+
+    def remember_thread(self, message_id: int, thread: discord.Thread) -> None:
+        """作成・編集したスレッドを記録する（edit は新しいオブジェクトを返すため）。"""
+        self._threads.put(message_id, thread)
+
+    def on_thread_update(self, payload: discord.RawThreadUpdateEvent) -> None:
+        """スレッド更新イベントでキャッシュ中のアーカイブ状態を追従させる。"""
+        thread = self._threads.get(payload.thread_id)
+        if thread is None:
+            return
+        if payload.thread is not None:
+            self._threads.put(payload.thread_id, payload.thread)
+            return
+        archived = payload.data.get("thread_metadata", {}).get("archived")
+        if archived is not None:
+            thread.archived = archived
+
+    def forget_thread(self, thread_id: int) -> None:
+        """削除されたスレッドをキャッシュから外す。"""
+        self._threads.pop(thread_id)
@@ -0,0 +1,432 @@
+"""
+翻訳エンジンのルーター
+
+- エンジンごとに使用文字数を追跡する（DeepL は /usage、MyMemory は日次の上限と応答から）。
+- 文字数枠切れ・連続タイムアウト・連続失敗でサーキットブレーカーを開き、
+  開いている間はそのエンジンを呼ばずに次のエンジンへ直行する。
+- hedge_delay を設定すると、優先エンジンがその時間内に応答しない場合に
+  次のエンジンへも並行してリクエストを投げ、先に成功した方を使う。
+- 使用文字数は状態バックエンド（utils.state）のカウンタに加算するので、
+  シャードを複数プロセスに分けても同じ枠を合算して追跡できる。
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from utils.engines import EngineError, EngineTimeoutError, QuotaExceededError, TranslationEngine
+from utils.metrics import (
+    ENGINE_CHARACTERS,
+    ENGINE_FALLBACKS,
+    ENGINE_REQUESTS,
+    ENGINE_SECONDS,
+    CallbackGauge,
+)
+from utils.state import MemoryBackend, StateBackend
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = 3          # 連続失敗でブレーカーを開く回数
+FAILURE_COOLDOWN = 30.0        # 連続失敗で開いたときの待機秒数
+QUOTA_RECHECK_INTERVAL = 3600  # 枠切れ時に使用量を再確認する間隔（秒）
+
+
+def next_quota_reset(period: str | None, now: datetime | None = None) -> float | None:
+    """文字数枠の次のリセット時刻（UNIX 時刻・UTC 基準）を返す。"""
+    now = now or datetime.now(timezone.utc)
+    if period == "day":
+        reset = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    elif period == "month":
+        first = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        reset = (first + timedelta(days=32)).replace(day=1)
+    else:
+        return None
+    return reset.timestamp()
+
+
+class BreakerOpenError(EngineError):
+    """呼び出す直前にブレーカーが開いていた（half-open で他の呼び出しが試行中を含む）。"""
+
+
+class CircuitBreaker:
+    """
+    closed（通常）→ open（呼ばない）→ half-open（1 件だけ試す）の 3 状態。
+    試行が成功すれば closed に戻り、失敗すれば再び open になる。
+    """
+
+    def __init__(self, threshold: int = FAILURE_THRESHOLD, cooldown: float = FAILURE_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.open_until == 0.0:
+            return "closed"
+        if time.time() < self.open_until:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """呼び出せる見込みがあるか（候補の絞り込み用。実際に呼ぶ直前には acquire() で確保する）。"""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._probing)
+
+    def acquire(self) -> bool:
+        """
+        呼び出しを確保する。確認と確保を 1 ステップで行う（間に await を挟まない）ので、
+        half-open で同時に何件来ても試行に通るのは 1 件だけ。
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def cancel(self) -> None:
+        """試行が結果を出さずに打ち切られた（ヘッジで不要になった等）。"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.threshold or self.open_until:
+            self.open_until = time.time() + self.cooldown
+
+    def trip(self, until: float) -> None:
+        """指定時刻まで開く（枠切れ時）。"""
+        self.open_until = until
+        self._probing = False
+
+
+@dataclass
+class EngineHealth:
+    """エンジン 1 つ分の状態（使用文字数とブレーカー）。"""
+    engine: TranslationEngine
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    used: int = 0
+    limit: int | None = None
+    period_reset_at: float | None = None
+
+    def __post_init__(self):
+        self.limit = self.engine.quota_limit
+        self.period_reset_at = next_quota_reset(self.engine.quota_period)
+
+    def _roll_period(self) -> None:
+        if self.period_reset_at is not None and time.time() >= self.period_reset_at:
+            self.used = 0
+            self.period_reset_at = next_quota_reset(self.engine.quota_period)
+
+    def has_quota(self, chars: int) -> bool:
+        self._roll_period()
+        return self.limit is None or self.used + chars <= self.limit
+
+    def usage_key(self) -> str:
+        """今期の使用文字数カウンタのキー（周期が変わるとキーも変わる）。"""
+        self._roll_period()
+        return f"usage:{self.engine.name}:{int(self.period_reset_at or 0)}"
+
+    def usage_ttl(self) -> float | None:
+        """カウンタの有効期限（次のリセットまで + 余裕 1 日）。"""
+        if self.period_reset_at is None:
+            return None
+        return self.period_reset_at - time.time() + 86400
+
+
+class EngineRouter:
+    """使用量とブレーカーの状態を見て、健全なエンジンへ翻訳を振り分ける。"""
+
+    def __init__(
+        self,
+        engines: list[TranslationEngine],
+        hedge_delay: float | None = None,
+        state: StateBackend | None = None,
+    ):
+        self.engines = engines
+        self.hedge_delay = hedge_delay
+        self.state = state or MemoryBackend()
+        self.health = {engine.name: EngineHealth(engine) for engine in engines}
+        self._last_usage_check: dict[str, float] = {}
+
+    async def start(self) -> None:
+        """各エンジンを並行して起動し、使用量を取得して追跡の初期値にする。"""
+        async def start_one(engine: TranslationEngine) -> None:
+            await engine.start()
+            await self.refresh_usage(engine)
+
+        await asyncio.gather(*(start_one(engine) for engine in self.engines))
+
+    async def refresh_usage(self, engine: TranslationEngine) -> None:
+        """エンジン側の使用量で追跡値を更新する（取得できない場合はそのまま）。"""
+        self._last_usage_check[engine.name] = time.time()
+        health = self.health[engine.name]
+        usage = await engine.usage()
+        if usage is None:
+            # エンジン側で取得できなければ、共有カウンタ（他プロセスの分も含む）を使う
+            await self._add_usage(health, 0)
+            return
+        health.used, health.limit = usage
+        logger.info("%s 使用量: %d / %d 文字", engine.name, health.used, health.limit)
+        if health.used < health.limit and health.breaker.state != "closed":
+            health.breaker.record_success()
+
+    def quota_known(self) -> bool:
+        """文字数枠のあるエンジンの上限がすべて分かっているか（DeepL の /usage が取れていない等なら False）。"""
+        return all(
+            health.limit is not None
+            for health in self.health.values()
+            if health.engine.quota_period is not None
+        )
+
+    def daily_allowance(self) -> int | None:
+        """
+        今日使ってよい文字数の目安（全エンジン合計）。残り枠を次のリセットまでの日数で割る。
+        枠の無い（無制限の）エンジンがあれば None。
+        上限が不明なエンジンは 0 文字として数え（枠を超えて使わないよう少なめに見積もる）、
+        使用量の再取得を予約する。不明なエンジンがあるうちは None を返さない。
+        """
+        total = 0
+        unlimited = False
+        now = time.time()
+        for health in self.health.values():
+            if health.engine.quota_period is None:
+                unlimited = True
+                continue
+            if health.limit is None:
+                self._maybe_recheck_usage(health.engine)
+                continue
+            health._roll_period()
+            days_left = max(1.0, (health.period_reset_at - now) / 86400)
+            total += int(max(0, health.limit - health.used) / days_left)
+        return None if unlimited and self.quota_known() else total
+
+    async def close(self) -> None:
+        for engine in self.engines:
+            await engine.close()
+
+    # ── 振り分け ───────────────────────────────────────────────────────────
+
+    def _candidates(
+        self, codes: Mapping[str, str | None], chars: int
+    ) -> list[tuple[TranslationEngine, str]]:
+        """対応言語・残り枠・ブレーカーの状態から、試すエンジンを優先順に返す。"""
+        candidates = []
+        for engine in self.engines:
+            code = codes.get(engine.lang_key)
+            if code is None or not engine.supports(code):
+                continue
+            health = self.health[engine.name]
+            if not health.has_quota(chars):
+                logger.debug("%s は文字数枠が不足のためスキップ", engine.name)
+                self._maybe_recheck_usage(engine)
+                continue
+            if not health.breaker.allow():
+                logger.debug("%s はブレーカーが開いているためスキップ", engine.name)
+                continue
+            candidates.append((engine, code))
+        return candidates
+
+    def _maybe_recheck_usage(self, engine: TranslationEngine) -> None:
+        """枠切れ扱いのエンジンは一定間隔で使用量を再確認する（プラン変更・リセット追従）。"""
+        last = self._last_usage_check.get(engine.name, 0.0)
+        if time.time() - last >= QUOTA_RECHECK_INTERVAL:
+            self._last_usage_check[engine.name] = time.time()
+            asyncio.get_running_loop().create_task(self.refresh_usage(engine))
+
+    async def _call(
+        self, engine: TranslationEngine, texts: list[str], code: str, source_lang: str | None
+    ) -> list[str] | None:
+        """1 エンジンを呼び出し、結果を使用量・ブレーカー・メトリクスに反映する。"""
+        health = self.health[engine.name]
+        probe = health.breaker.state == "half_open"
+        if not health.breaker.acquire():
+            raise BreakerOpenError(f"{engine.name} はブレーカーが開いているためスキップ")
+        try:
+            with ENGINE_SECONDS.time(engine=engine.name):
+                result = await engine.translate_batch(texts, code, source_lang=source_lang)
+        except asyncio.CancelledError:
+            if probe:
+                health.breaker.cancel()
+            raise
+        except QuotaExceededError as e:
+            ENGINE_REQUESTS.inc(engine=engine.name, result="quota_exceeded")
+            # 共有カウンタも上限まで進め、他のプロセスにも枠切れを伝える
+            await self._add_usage(health, max(0, (health.limit or 0) - health.used))
+            reset_at = next_quota_reset(engine.quota_period) or time.time() + QUOTA_RECHECK_INTERVAL
+            health.breaker.trip(min(reset_at, time.time() + QUOTA_RECHECK_INTERVAL))
+            logger.warning("%s → ブレーカーを開きます", e)
+            raise
+        except EngineTimeoutError as e:
+            ENGINE_REQUESTS.inc(engine=engine.name, result="timeout")
+            health.breaker.record_failure()
+            logger.warning("%s", e)
+            raise
+        except EngineError as e:
+            ENGINE_REQUESTS.inc(engine=engine.name, result="failure")
+            health.breaker.record_failure()
+            logger.warning("%s", e)
+            raise
+        except Exception as e:
+            # 想定外の例外も失敗として数え、half-open の試行中のままにしない
+            ENGINE_REQUESTS.inc(engine=engine.name, result="failure")
+            health.breaker.record_failure()
+            logger.exception("%s の呼び出しで予期しないエラー", engine.name)
+            raise EngineError(f"{engine.name} 翻訳失敗: {e!r}") from e
+
+        chars = sum(len(text) for text in texts)
+        ENGINE_REQUESTS.inc(engine=engine.name, result="success")
+        ENGINE_CHARACTERS.inc(chars, engine=engine.name)
+        health.breaker.record_success()
+        await self._add_usage(health, chars)
+        return result
+
+    async def _add_usage(self, health: EngineHealth, chars: int) -> None:
+        """共有カウンタに加算し、全プロセス合計の使用文字数を追跡値にする。"""
+        try:
+            total = await self.state.incr(
+                self.state.key(health.usage_key()), chars, ttl=health.usage_ttl()
+            )
+        except Exception as e:
+            logger.warning("使用文字数カウンタの更新に失敗: %s", e)
+            health.used += chars
+            return
+        health.used = max(health.used + chars, total)
+
+    async def translate(
+        self, text: str, codes: Mapping[str, str | None], source_lang: str | None = None
+    ) -> tuple[str | None, str]:
+        """
+        健全なエンジンから順に翻訳を試みる。
+
+        Args:
+            codes: lang_key（"deepl" / "mymemory"）→ 言語コード
+
+        Returns:
+            (translated_text, engine_name)。すべて失敗した場合は (None, "")
+        """
+        results, engine_name = await self.translate_batch([text], codes, source_lang=source_lang)
+        return (results[0] if results else None), engine_name
+
+    async def translate_batch(
+        self, texts: list[str], codes: Mapping[str, str | None], source_lang: str | None = None
+    ) -> tuple[list[str] | None, str]:
+        """
+        複数のテキストを同じエンジンでまとめて翻訳する（1 件でも欠けたら次のエンジンへ）。
+
+        Returns:
+            (translated_texts, engine_name)。すべて失敗した場合は (None, "")
+        """
+        candidates = self._candidates(codes, sum(len(text) for text in texts))
+        i = 0
+        while i < len(candidates):
+            engine, code = candidates[i]
+            primary = asyncio.ensure_future(self._call(engine, texts, code, source_lang))
+
+            # ヘッジ: 優先エンジンが遅ければ次のエンジンも並行して呼ぶ
+            if self.hedge_delay and i + 1 < len(candidates):
+                done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay)
+                if not done:
+                    backup_engine, backup_code = candidates[i + 1]
+                    logger.info(
+                        "%s の応答が %.1f 秒以内になく、%s へヘッジします",
+                        engine.name, self.hedge_delay, backup_engine.name,
+                    )
+                    backup = asyncio.ensure_future(
+                        self._call(backup_engine, texts, backup_code, source_lang)
+                    )
+                    result = await self._first_success(
+                        {primary: engine.name, backup: backup_engine.name}
+                    )
+                    if result is not None:
+                        return result
+                    i += 2
+                    continue
+
+            try:
+                result = await primary
+            except EngineError:
+                result = None
+            if result is not None:
+                return result, engine.name
+            ENGINE_FALLBACKS.inc(engine=engine.name)
+            logger.info("%s 失敗 → 次のエンジンにフォールバック", engine.name)
+            i += 1
+
+        return None, ""
+
+    @staticmethod
+    async def _first_success(
+        tasks: dict[asyncio.Future, str]
+    ) -> tuple[list[str], str] | None:
+        """先に成功したタスクの結果を返し、残りはキャンセルする。"""
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result() is not None:
+                        return task.result(), tasks[task]
+                    ENGINE_FALLBACKS.inc(engine=tasks[task])
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict[str, dict]:
+        """エンジンごとの使用量とブレーカー状態を返す。"""
+        return {
+            name: {
+                "used": health.used,
+                "limit": health.limit,
+                "breaker": health.breaker.state,
+            }
+            for name, health in self.health.items()
+        }
+
+
+def hedge_delay_from_env() -> float | None:
+    """ROUTER_HEDGE_DELAY（秒）を読む。未設定・0 ならヘッジしない。"""
+    value = float(os.getenv("ROUTER_HEDGE_DELAY", "0") or 0)
+    return value or None
+
+
+_router: EngineRouter | None = None
+
+
+def set_router(router: EngineRouter | None) -> None:
+    """メトリクス出力の対象にするルーターを設定する。"""
+    global _router
+    _router = router
+
+
+def _usage_stats() -> dict[tuple[str, ...], float]:
+    if _router is None:
+        return {}
+    values: dict[tuple[str, ...], float] = {}
+    for name, health in _router.health.items():
+        values[(name, "used")] = health.used
+        if health.limit is not None:
+            values[(name, "limit")] = health.limit
+        values[(name, "breaker_open")] = 0 if health.breaker.state == "closed" else 1
+    return values
+
+
+ENGINE_STATE = CallbackGauge(
+    "translator_engine_state",
+    "Per-engine characters used / limit in the current quota period and breaker_open (0/1).",
+    ("engine", "kind"),
+    _usage_stats,
+)
@@ -0,0 +1,99 @@
+"""
+起動時間の計測と準備完了（readiness）の管理
+
+起動の各段階（import・コグ読み込み・ログイン・ゲートウェイ接続・ウォームアップの各項目）の
+所要時間を記録し、準備が整った時点で内訳をログに出す。
+
+準備完了の条件は「ゲートウェイ接続（on_ready）」と「ウォームアップ（言語検出のプロファイル・
+翻訳エンジン・キャッシュ DB・ジョブの再投入）」の両方。ヘルスチェックサーバーの /ready は
+これを返すので、Cloud Run の起動プローブ等に使えば、最初のリアクションから
+ウォーム状態で処理できるインスタンスにだけトラフィックが来る。
+"""
+
+import logging
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from utils.metrics import CallbackGauge
+
+logger = logging.getLogger(__name__)
+
+# 準備完了に必要な条件
+GATEWAY = "gateway"
+WARMUP = "warmup"
+
+
+class Startup:
+    """起動の段階ごとの所要時間と、準備完了までに残っている条件。"""
+
+    def __init__(self, started_at: float | None = None):
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.phases: dict[str, float] = {}
+        self._running: dict[str, float] = {}
+        self._waiting = {GATEWAY, WARMUP}
+        self.ready_after: float | None = None    # 起動から準備完了までの秒数
+
+    # ── 計測 ───────────────────────────────────────────────────────────────
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases[name] = seconds
+
+    def begin(self, name: str) -> None:
+        self._running[name] = time.perf_counter()
+
+    def end(self, name: str) -> None:
+        """begin() した段階を締める（begin していなければ何もしない）。"""
+        began = self._running.pop(name, None)
+        if began is not None:
+            self.phases[name] = time.perf_counter() - began
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """with の中の所要時間を name として記録する（中で await してもよい）。"""
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    # ── 準備完了 ───────────────────────────────────────────────────────────
+
+    @property
+    def ready(self) -> bool:
+        return not self._waiting
+
+    @property
+    def waiting(self) -> list[str]:
+        """準備完了までに残っている条件。"""
+        return sorted(self._waiting)
+
+    def mark_ready(self, condition: str) -> None:
+        """条件を満たしたことを記録し、すべて揃ったら内訳をログに出す。"""
+        if condition not in self._waiting:
+            return
+        self._waiting.discard(condition)
+        if not self._waiting:
+            self.ready_after = time.perf_counter() - self.started_at
+            logger.info("準備完了: 起動から %.2fs（%s）", self.ready_after, self.summary())
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+
+
+STARTUP = Startup()
+
+
+def _startup_stats() -> dict[tuple[str, ...], float]:
+    stats = {(name,): seconds for name, seconds in STARTUP.phases.items()}
+    if STARTUP.ready_after is not None:
+        stats[("total",)] = STARTUP.ready_after
+    return stats
+
+
+STARTUP_SECONDS = CallbackGauge(
+    "translator_startup_seconds",
+    "Time spent in each startup phase, and total time from process start to ready.",
+    ("phase",),
+    _startup_stats,
+)
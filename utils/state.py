@@ -0,0 +1,191 @@
+"""
+共有状態のバックエンド
+
+翻訳キャッシュ・エンジンの使用文字数・翻訳スレッドのインデックスを、
+プロセス間で共有できるキー・バリューストアに置くための差し替え口。
+
+  - MemoryBackend: プロセス内の辞書（既定。単一プロセスならこれで十分）
+  - RedisBackend:  Redis 互換ストア（STATE_BACKEND_URL=redis://...）。
+                   シャードを複数プロセスに分けても二重翻訳・使用量の数え漏れが起きない
+
+RedisBackend は redis.asyncio.Redis と同じメソッドを持つクライアントなら何でも受け付けるので、
+テストではローカルの代替実装（fakeredis 等）に差し替えられる。
+"""
+
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEY_PREFIX = "translator:"
+MEMORY_PRUNE_THRESHOLD = 10_000   # これを超えたら期限切れのキーを掃除する
+
+
+class StateBackend(ABC):
+    """
+    文字列のキー・バリューストア。
+
+    shared: 他のプロセスと状態を共有しているか。False のバックエンドでは、
+            呼び出し側はプロセス内のキャッシュで足りる処理を省略してよい。
+    """
+
+    shared: bool = False
+
+    def __init__(self, prefix: str = DEFAULT_KEY_PREFIX):
+        self.prefix = prefix
+
+    def key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    @abstractmethod
+    async def get_many(self, keys: list[str]) -> list[str | None]:
+        """複数のキーを一度に読む（無いキーは None）。"""
+
+    @abstractmethod
+    async def set_many(self, items: dict[str, str], ttl: float | None = None) -> None:
+        """複数のキーを一度に書く（ttl 秒で失効。None なら無期限）。"""
+
+    @abstractmethod
+    async def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        """整数値を加算して加算後の値を返す（キーが新規なら ttl 秒で失効させる）。"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """キーを消す。"""
+
+    async def get(self, key: str) -> str | None:
+        return (await self.get_many([key]))[0]
+
+    async def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        await self.set_many({key: value}, ttl)
+
+    async def close(self) -> None:
+        """接続を閉じる。既定では何もしない。"""
+
+
+class MemoryBackend(StateBackend):
+    """プロセス内の辞書による実装（TTL 付き）。"""
+
+    def __init__(self, prefix: str = DEFAULT_KEY_PREFIX):
+        super().__init__(prefix)
+        self._data: dict[str, tuple[float | None, str]] = {}
+
+    def _get(self, key: str) -> str | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at is not None and time.monotonic() > expires_at:
+            del self._data[key]
+            return None
+        return value
+
+    def _put(self, key: str, value: str, ttl: float | None) -> None:
+        self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+        if len(self._data) > MEMORY_PRUNE_THRESHOLD:
+            now = time.monotonic()
+            for stale in [k for k, (exp, _) in self._data.items() if exp is not None and now > exp]:
+                del self._data[stale]
+
+    async def get_many(self, keys: list[str]) -> list[str | None]:
+        return [self._get(key) for key in keys]
+
+    async def set_many(self, items: dict[str, str], ttl: float | None = None) -> None:
+        for key, value in items.items():
+            self._put(key, value, ttl)
+
+    async def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        current = self._get(key)
+        if current is None:
+            value = amount
+            self._put(key, str(value), ttl)
+        else:
+            value = int(current) + amount
+            self._data[key] = (self._data[key][0], str(value))
+        return value
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+class RedisBackend(StateBackend):
+    """Redis 互換ストアによる実装（redis.asyncio.Redis 互換のクライアントを受け取る）。"""
+
+    shared = True
+
+    def __init__(self, client, prefix: str = DEFAULT_KEY_PREFIX):
+        super().__init__(prefix)
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = DEFAULT_KEY_PREFIX) -> "RedisBackend":
+        """URL から接続する（redis パッケージはこのバックエンドを使う場合だけ必要）。"""
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError(
+                "STATE_BACKEND_URL に redis:// を指定する場合は redis パッケージが必要です"
+                "（pip install redis）"
+            ) from e
+        return cls(redis.from_url(url, decode_responses=True), prefix)
+
+    async def get_many(self, keys: list[str]) -> list[str | None]:
+        if not keys:
+            return []
+        return list(await self.client.mget(keys))
+
+    async def set_many(self, items: dict[str, str], ttl: float | None = None) -> None:
+        if not items:
+            return
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, value, px=int(ttl * 1000) if ttl else None)
+            await pipe.execute()
+
+    async def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        value = int(await self.client.incrby(key, amount))
+        if ttl and value == amount:
+            # 新規に作られたキーだけ失効時刻を付ける
+            await self.client.pexpire(key, int(ttl * 1000))
+        return value
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(key)
+
+    async def close(self) -> None:
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+
+
+def state_from_env() -> StateBackend:
+    """環境変数 STATE_BACKEND_URL からバックエンドを作る（未設定ならプロセス内）。"""
+    url = os.getenv("STATE_BACKEND_URL", "").strip()
+    prefix = os.getenv("STATE_KEY_PREFIX", DEFAULT_KEY_PREFIX)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        logger.info("共有状態のバックエンド: Redis")
+        return RedisBackend.from_url(url, prefix)
+    if url:
+        logger.warning("未対応の STATE_BACKEND_URL のためプロセス内の状態を使います: %s", url)
+    return MemoryBackend(prefix)
+
+
+_state: StateBackend | None = None
+
+
+def get_state() -> StateBackend:
+    """共有の状態バックエンドを返す（初回呼び出し時に環境変数から作成）。"""
+    global _state
+    if _state is None:
+        _state = state_from_env()
+    return _state
+
+
+async def close_state() -> None:
+    """状態バックエンドを閉じる（コグのアンロード時に呼ぶ）。"""
+    global _state
+    if _state is not None:
+        await _state.close()
+    _state = None
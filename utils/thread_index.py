@@ -0,0 +1,384 @@
+"""
+翻訳スレッドのインデックス
+
+元メッセージ ID → 翻訳スレッド ID と、そのスレッドに投稿済みの言語ラベルを保持する。
+ボット自身の投稿から更新するため、重複チェックに Discord API 呼び出しは不要。
+インデックスに無いメッセージは呼び出し側がスレッド履歴を 1 回だけ走査して再構築する。
+
+元メッセージが編集されたときに訳文を書き換えられるよう、投稿した翻訳メッセージの ID と
+翻訳時点の原文ダイジェストも記録する（履歴走査で再構築したエントリには無い）。
+
+THREAD_INDEX_PATH を設定すると SQLite に保存し、再起動後も引き継ぐ。書き出しは 1 秒ごとに
+変更のあったエントリの行だけなので、エントリ数が多くても書き込み量は変更量に比例する
+（以前の JSON 形式のファイルは初回に取り込み、.json.bak に退避する）。
+共有の状態バックエンド（utils.state、Redis 等）があればエントリ単位でそこにも書き込み、
+手元に無いエントリはそこから読む。シャードを分けた複数プロセスでも投稿済み言語を共有できる。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+
+from utils.memory import memory_profile
+from utils.state import StateBackend, get_state
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 50_000    # これを超えたら古いものから捨てる（捨てても履歴走査で再構築される）
+SHARED_TTL = 90 * 24 * 60 * 60    # 共有バックエンド上のエントリの有効期限（90 日）
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+
+@dataclass
+class TranslationPost:
+    """
+    1 回の投稿分（pack_posts で詰めた 1 件以上のメッセージ）。
+
+    message_ids: 投稿した翻訳メッセージの ID（投稿順）
+    flags:       言語ラベル → 国旗絵文字（投稿順）
+    """
+    message_ids: list[int]
+    flags: dict[str, str]
+
+
+@dataclass
+class ThreadEntry:
+    """1 メッセージ分の翻訳スレッド情報。"""
+    thread_id: int
+    languages: set[str] = field(default_factory=set)
+    posts: list[TranslationPost] = field(default_factory=list)
+    source_digest: str | None = None    # 翻訳した原文の utils.cache.text_digest
+
+
+class ThreadIndex:
+    """message_id → ThreadEntry のインデックスと、メッセージ単位のロック。"""
+
+    def __init__(
+        self,
+        path: str | None = None,
+        shared: StateBackend | None = None,
+        max_entries: int = MAX_ENTRIES,
+    ):
+        self.path = path
+        self.shared = shared
+        self.max_entries = max_entries
+        self._entries: dict[int, ThreadEntry] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._lock_users: dict[int, int] = {}
+        self._save_task: asyncio.Task | None = None
+        self._dirty: set[int] = set()       # 共有バックエンドへ未反映のメッセージ ID
+        self._unsaved: set[int] = set()     # SQLite へ未反映のメッセージ ID
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        if path:
+            self._open_db(path)
+
+    # ── ロック ─────────────────────────────────────────────────────────────
+
+    def lock(self, message_id: int) -> asyncio.Lock:
+        """
+        メッセージ単位の非同期ロックを返す。
+        同じメッセージへの処理を直列化し、スレッドの二重作成を防ぐ。
+        使い終わったら必ず release() を呼ぶこと。
+        """
+        lock = self._locks.get(message_id)
+        if lock is None:
+            lock = self._locks[message_id] = asyncio.Lock()
+        self._lock_users[message_id] = self._lock_users.get(message_id, 0) + 1
+        return lock
+
+    def release(self, message_id: int) -> None:
+        """ロックの利用を終える。利用者がいなくなったロックは破棄する。"""
+        users = self._lock_users.get(message_id, 0) - 1
+        if users > 0:
+            self._lock_users[message_id] = users
+            return
+        self._lock_users.pop(message_id, None)
+        self._locks.pop(message_id, None)
+
+    # ── インデックス ───────────────────────────────────────────────────────
+
+    def get(self, message_id: int) -> ThreadEntry | None:
+        return self._entries.get(message_id)
+
+    async def fetch(self, message_id: int) -> ThreadEntry | None:
+        """手元に無ければ共有バックエンドから読み込んで返す。"""
+        entry = self._entries.get(message_id)
+        if entry is not None or self.shared is None:
+            return entry
+        try:
+            value = await self.shared.get(self._shared_key(message_id))
+        except Exception as e:
+            logger.warning("共有スレッドインデックスの読み込み失敗: %s", e)
+            return None
+        if value is None:
+            return None
+        # 待っている間に手元で作られていればそちらを優先する
+        entry = self._entries.get(message_id)
+        if entry is None:
+            entry = self._entries[message_id] = _entry_from_dict(json.loads(value))
+            self._trim()
+        return entry
+
+    def set_thread(self, message_id: int, thread_id: int) -> ThreadEntry:
+        """メッセージとスレッドの対応を登録する（既存なら言語は引き継ぐ）。"""
+        entry = self._entries.get(message_id)
+        if entry is None or entry.thread_id != thread_id:
+            entry = ThreadEntry(thread_id)
+            self._entries[message_id] = entry
+            self._trim()
+            self._schedule_save(message_id)
+        return entry
+
+    def add_languages(self, message_id: int, languages: set[str]) -> None:
+        """投稿済みの言語ラベルを記録する。"""
+        entry = self._entries.get(message_id)
+        if entry is None or languages <= entry.languages:
+            return
+        entry.languages |= languages
+        self._schedule_save(message_id)
+
+    def add_post(
+        self,
+        message_id: int,
+        message_ids: list[int],
+        flags: dict[str, str],
+        source_digest: str,
+    ) -> None:
+        """投稿した翻訳メッセージを記録する（編集時の書き換え用）。"""
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return
+        entry.posts.append(TranslationPost(message_ids, flags))
+        entry.source_digest = source_digest
+        self._schedule_save(message_id)
+
+    def update_post(self, message_id: int, post: TranslationPost, message_ids: list[int]) -> None:
+        """書き換えた投稿のメッセージ ID を更新する（分割数が変わった場合）。"""
+        if message_ids != post.message_ids:
+            post.message_ids = message_ids
+            self._schedule_save(message_id)
+
+    def set_source_digest(self, message_id: int, source_digest: str) -> None:
+        """訳文が対応している原文のダイジェストを更新する。"""
+        entry = self._entries.get(message_id)
+        if entry is None or entry.source_digest == source_digest:
+            return
+        entry.source_digest = source_digest
+        self._schedule_save(message_id)
+
+    def forget(self, message_id: int) -> None:
+        """メッセージをインデックスから外す（スレッド削除時など）。"""
+        if self._entries.pop(message_id, None) is not None:
+            self._schedule_save(message_id)
+
+    def forget_thread(self, thread_id: int) -> None:
+        """スレッド ID に対応するエントリを外す。"""
+        stale = [mid for mid, entry in self._entries.items() if entry.thread_id == thread_id]
+        for message_id in stale:
+            self.forget(message_id)
+
+    # ── 永続化 ─────────────────────────────────────────────────────────────
+
+    def _open_db(self, path: str) -> None:
+        """SQLite を開き、新しい順に max_entries 件だけ残して読み込む。"""
+        legacy = _read_legacy_json(path)
+        try:
+            if legacy is not None:
+                os.replace(path, f"{path}.json.bak")
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS threads ("
+                " message_id INTEGER PRIMARY KEY,"
+                " entry TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            if legacy:
+                now = time.time()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO threads (message_id, entry, updated_at) VALUES (?, ?, ?)",
+                    [
+                        (int(message_id), json.dumps(value, ensure_ascii=False), now + i * 1e-6)
+                        for i, (message_id, value) in enumerate(legacy.items())
+                    ],
+                )
+            conn.execute(
+                "DELETE FROM threads WHERE message_id NOT IN"
+                " (SELECT message_id FROM threads ORDER BY updated_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            rows = conn.execute("SELECT message_id, entry FROM threads ORDER BY updated_at").fetchall()
+            conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("スレッドインデックスを開けません（メモリのみで動作）: %s", e)
+            return
+        self._db = conn
+        for message_id, value in rows:
+            self._entries[message_id] = _entry_from_dict(json.loads(value))
+        if legacy is not None:
+            logger.info("JSON 形式のスレッドインデックスを取り込みました: %d 件", len(legacy))
+        logger.info("スレッドインデックスを読み込みました: %d 件", len(self._entries))
+
+    def _trim(self) -> None:
+        """上限を超えた分を古いものから捨てる（捨てても履歴走査で再構築される）。"""
+        while len(self._entries) > self.max_entries:
+            message_id = next(iter(self._entries))
+            del self._entries[message_id]
+            if self._db is not None:
+                self._unsaved.add(message_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _shared_key(self, message_id: int) -> str:
+        return self.shared.key(f"thread:{message_id}")
+
+    async def _flush_shared(self) -> None:
+        """変更のあったエントリを共有バックエンドへ書き込む（消えたものは削除）。"""
+        if self.shared is None or not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        items = {}
+        try:
+            for message_id in dirty:
+                key = self._shared_key(message_id)
+                entry = self._entries.get(message_id)
+                if entry is None:
+                    await self.shared.delete(key)
+                else:
+                    items[key] = json.dumps(_entry_to_dict(entry), ensure_ascii=False)
+            await self.shared.set_many(items, SHARED_TTL)
+        except Exception as e:
+            logger.warning("共有スレッドインデックスの書き込み失敗: %s", e)
+            self._dirty |= dirty
+
+    def _take_unsaved(self) -> tuple[set[int], list[tuple[int, str, float]], list[tuple[int]]]:
+        """SQLite へ未反映の変更を取り出す（ループ内で呼び、書き込みだけを別スレッドで行う）。"""
+        unsaved, self._unsaved = self._unsaved, set()
+        now = time.time()
+        upserts, deletes = [], []
+        for message_id in unsaved:
+            entry = self._entries.get(message_id)
+            if entry is None:
+                deletes.append((message_id,))
+            else:
+                upserts.append((message_id, json.dumps(_entry_to_dict(entry), ensure_ascii=False), now))
+        return unsaved, upserts, deletes
+
+    def _write(self, upserts: list[tuple[int, str, float]], deletes: list[tuple[int]]) -> None:
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO threads (message_id, entry, updated_at) VALUES (?, ?, ?)",
+                upserts,
+            )
+            self._db.executemany("DELETE FROM threads WHERE message_id = ?", deletes)
+            self._db.commit()
+
+    def _schedule_save(self, message_id: int) -> None:
+        """連続した更新をまとめて 1 回で書き出す。"""
+        if self.shared is not None:
+            self._dirty.add(message_id)
+        if self._db is not None:
+            self._unsaved.add(message_id)
+        elif self.shared is None:
+            return
+        if self._save_task is not None and not self._save_task.done():
+            return
+        try:
+            self._save_task = asyncio.get_running_loop().create_task(self._save_soon())
+        except RuntimeError:
+            self.save()
+
+    async def _save_soon(self) -> None:
+        await asyncio.sleep(1)
+        await self._flush_shared()
+        if self._db is None or not self._unsaved:
+            return
+        unsaved, upserts, deletes = self._take_unsaved()
+        try:
+            await asyncio.to_thread(self._write, upserts, deletes)
+        except sqlite3.Error as e:
+            logger.warning("スレッドインデックスの保存に失敗: %s", e)
+            self._unsaved |= unsaved
+
+    async def flush(self) -> None:
+        """未反映の変更を共有バックエンドと SQLite へ即座に書き出す（終了時に呼ぶ）。"""
+        await self._flush_shared()
+        self.save()
+
+    def save(self) -> None:
+        """SQLite へ未反映の変更を即座に書き出す。"""
+        if self._db is None or not self._unsaved:
+            return
+        unsaved, upserts, deletes = self._take_unsaved()
+        try:
+            self._write(upserts, deletes)
+        except sqlite3.Error as e:
+            logger.warning("スレッドインデックスの保存に失敗: %s", e)
+            self._unsaved |= unsaved
+
+    def close(self) -> None:
+        """未反映の変更を書き出して SQLite を閉じる。"""
+        self.save()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+
+def _read_legacy_json(path: str) -> dict | None:
+    """以前の JSON 形式のインデックスなら中身を返す（SQLite・未作成・読めない場合は None）。"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(len(SQLITE_HEADER))
+            if not head or head == SQLITE_HEADER:
+                return None
+            f.seek(0)
+            return json.loads(f.read().decode("utf-8"))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("JSON 形式のスレッドインデックスを読み込めません: %s", e)
+        return None
+
+
+def _entry_to_dict(entry: ThreadEntry) -> dict:
+    value: dict = {"thread_id": entry.thread_id, "languages": sorted(entry.languages)}
+    if entry.posts:
+        value["posts"] = [
+            {"message_ids": list(post.message_ids), "flags": dict(post.flags)}
+            for post in entry.posts
+        ]
+        value["source_digest"] = entry.source_digest
+    return value
+
+
+def _entry_from_dict(value: dict) -> ThreadEntry:
+    return ThreadEntry(
+        int(value["thread_id"]),
+        set(value.get("languages", [])),
+        [
+            TranslationPost([int(i) for i in post["message_ids"]], dict(post["flags"]))
+            for post in value.get("posts", [])
+        ],
+        value.get("source_digest"),
+    )
+
+
+def index_from_env() -> ThreadIndex:
+    """
+    環境変数 THREAD_INDEX_PATH から ThreadIndex を作る（未設定ならメモリのみ）。
+    共有の状態バックエンドがあれば併用する。
+    """
+    state = get_state()
+    return ThreadIndex(
+        os.getenv("THREAD_INDEX_PATH", "").strip() or None,
+        shared=state if state.shared else None,
+        max_entries=memory_profile().thread_index_entries,
+    )
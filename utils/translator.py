@@ -2,150 +2,258 @@
 翻訳処理モジュール
 
 優先順位:
-  1. DeepL API Free（deepl_lang が None の言語はスキップ）
+  1. DeepL API Free（Language.deepl が None、または DeepL 非対応の言語はスキップ）
   2. MyMemory API（公式・無料・クレカ不要）
+
+エンジン（utils.engines）はコグ読み込み時に start_engines() で一度だけ作成され、
+共有の aiohttp.ClientSession（keep-alive 接続プール）を使い回す。
+どのエンジンを呼ぶかは utils.router.EngineRouter が残り枠とブレーカーの状態で決める。
+コード・URL・メンション等は utils.markup で取り除き、地の文だけをまとめてエンジンに送る。
+地の文は文単位で翻訳メモリ（キャッシュ）を引き、未翻訳の文だけをエンジンに送る。
+すべての HTTP 呼び出しは非同期で行い、discord.py のイベントループをブロックしない。
 """
 
+import asyncio
 import logging
-import os
 
-import requests
+import aiohttp
 
-logger = logging.getLogger(__name__)
+from utils.cache import TranslationCache, cache_from_env
+from utils.detection import detect_language
+from utils.engines import TranslationEngine, create_default_engines, create_http_session
+from utils.languages import Language
+from utils.markup import SegmentedText, segment
+from utils.metrics import CallbackGauge
+from utils.router import EngineRouter, hedge_delay_from_env, set_router
+from utils.state import get_state
 
-MYMEMORY_API_URL = "https://api.mymemory.translated.net/get"
+logger = logging.getLogger(__name__)
 
 
-# ── DeepL ──────────────────────────────────────────────────────────────────
+# ── エンジン ───────────────────────────────────────────────────────────────
 
-def _get_deepl_translator():
-    """deepl.Translator インスタンスを返す。APIキー未設定時は None。"""
-    api_key = os.getenv("DEEPL_API_KEY", "").strip()
-    if not api_key:
-        return None
-    try:
-        import deepl
-        return deepl.Translator(api_key)
-    except Exception as e:
-        logger.warning("DeepL の初期化に失敗しました: %s", e)
-        return None
+_session: aiohttp.ClientSession | None = None
+_router: EngineRouter | None = None
 
 
-def translate_deepl(text: str, target_lang: str) -> str | None:
+async def start_engines(engines: list[TranslationEngine] | None = None) -> EngineRouter:
     """
-    DeepL API で翻訳する。
-    成功時は翻訳文字列、失敗時は None を返す。
+    翻訳エンジンとルーターを作成・起動する（コグ読み込み時に一度だけ呼ぶ）。
+    engines を渡した場合はそれを優先順に使う（テスト用の偽エンジン等）。
     """
-    translator = _get_deepl_translator()
-    if translator is None:
-        return None
-    try:
-        result = translator.translate_text(text, target_lang=target_lang)
-        return result.text
-    except Exception as e:
-        logger.warning("DeepL 翻訳失敗 (target=%s): %s", target_lang, e)
-        return None
+    global _session, _router
+    if engines is None:
+        if _session is None or _session.closed:
+            _session = create_http_session()
+        engines = create_default_engines(_session)
+    router = EngineRouter(engines, hedge_delay=hedge_delay_from_env(), state=get_state())
+    await router.start()
+    _router = router
+    set_router(router)
+    logger.info("翻訳エンジン: %s", " → ".join(e.name for e in engines))
+    return router
 
 
-# ── MyMemory ───────────────────────────────────────────────────────────────
+async def get_router() -> EngineRouter:
+    """起動済みのルーターを返す。未起動なら既定構成で起動する。"""
+    if _router is None:
+        return await start_engines()
+    return _router
 
-def _detect_language(text: str) -> str:
-    """
-    テキストのソース言語を検出する（langdetect 使用・オフライン・無料）。
-    検出失敗時は "en" をデフォルトとして返す。
-    """
-    try:
-        from langdetect import detect
-        lang = detect(text)
-        # langdetect は "zh-cn", "zh-tw" 等を返す場合がある
-        return lang.lower()
-    except Exception:
-        return "en"
 
+async def close_engines() -> None:
+    """エンジン・共有セッション・キャッシュ DB をクローズする（コグのアンロード時に呼ぶ）。"""
+    global _session, _router, _cache
+    if _router is not None:
+        await _router.close()
+    _router = None
+    set_router(None)
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    if _cache is not None:
+        _cache.close()
+        _cache = None
 
-def translate_mymemory(text: str, target_lang: str) -> str | None:
-    """
-    MyMemory API で翻訳する（公式 REST API、クレカ不要）。
 
-    無料枠:
-      - 登録なし: 5,000 文字/日
-      - メール登録 (MYMEMORY_EMAIL): 50,000 文字/日
+# ── 翻訳キャッシュ ──────────────────────────────────────────────────────────
+
+_cache: TranslationCache | None = None
+
+
+def get_cache() -> TranslationCache:
+    """共有の翻訳キャッシュを返す（初回呼び出し時に環境変数から作成）。"""
+    global _cache
+    if _cache is None:
+        _cache = cache_from_env()
+    return _cache
 
-    MyMemory は "auto" をソース言語として受け付けないため、
-    langdetect でソース言語を自動検出して使用する。
-    成功時は翻訳文字列、失敗時は None を返す。
-    """
-    email = os.getenv("MYMEMORY_EMAIL", "").strip()
-    source_lang = _detect_language(text)
-
-    # ソース言語とターゲット言語が同じ場合は翻訳不要
-    if source_lang == target_lang:
-        return None
-
-    params: dict = {
-        "q": text,
-        "langpair": f"{source_lang}|{target_lang}",
-    }
-    if email:
-        params["de"] = email
-
-    try:
-        resp = requests.get(MYMEMORY_API_URL, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("responseStatus") == 200:
-            return data["responseData"]["translatedText"]
-        logger.warning("MyMemory API エラー: %s", data.get("responseDetails"))
-        return None
-    except Exception as e:
-        logger.warning("MyMemory 翻訳失敗 (target=%s): %s", target_lang, e)
-        return None
+
+def _cache_stats() -> dict[tuple[str, ...], float]:
+    if _cache is None:
+        return {}
+    return {(name,): value for name, value in _cache.stats().items()}
+
+
+CACHE_STATS = CallbackGauge(
+    "translator_cache_stats",
+    "Translation cache counters (entries, hits, shared_hits, disk_hits, misses, evictions, "
+    "expirations).",
+    ("stat",),
+    _cache_stats,
+)
 
 
 # ── 統合エントリポイント ────────────────────────────────────────────────────
 
-def translate(
+async def translate(
     text: str,
-    deepl_lang: str | None,
-    mymemory_lang: str,
+    language: Language,
+    source_lang: str | None = None,
 ) -> tuple[str | None, str]:
     """
     テキストを翻訳する。
 
     Args:
-        text:          翻訳対象テキスト
-        deepl_lang:    DeepL 言語コード。None の場合は DeepL をスキップ。
-        mymemory_lang: MyMemory 言語コード（フォールバック用）
+        text:        翻訳対象テキスト
+        language:    翻訳ターゲット（DeepL コードが None なら DeepL をスキップ）
+        source_lang: 検出済みのソース言語。None の場合はここで検出する。
 
     Returns:
         (translated_text, engine_name)
         翻訳不要時は (None, "same_language")
         翻訳失敗時は (None, "")
     """
-    if not text or not text.strip():
+    # 翻訳する地の文が無い（コード・URL・メンションだけ等）
+    segmented = segment(text)
+    if not segmented.prose:
         return None, ""
 
+    # キャッシュにあれば検出・API 呼び出しをすべて省略
+    cache = get_cache()
+    target = language.key
+    cached = await cache.get(text, target, exact=True)
+    if cached is not None:
+        logger.info("翻訳キャッシュヒット: engine=%s target=%s", cached.engine, target)
+        return cached.text, cached.engine
+
     # 0. ソース言語を検出し、ターゲットと同じならAPI呼び出しをスキップ
-    detected = _detect_language(text)
-    # DeepL コードは "EN-US", "PT-BR" 等なのでプレフィックスで比較
-    deepl_prefix = deepl_lang.split("-")[0].lower() if deepl_lang else None
-    if detected == mymemory_lang or (deepl_prefix and detected == deepl_prefix):
+    detected = source_lang or detect_language(segmented.prose_text)
+    if language.is_source(detected):
         logger.info(
             "ソース言語(%s)とターゲット言語が同一のため翻訳スキップ", detected
         )
         return None, "same_language"
 
-    # 1. DeepL が対応している言語のみ試みる
-    if deepl_lang is not None:
-        result = translate_deepl(text, deepl_lang)
-        if result:
-            return result, "DeepL"
-        logger.info("DeepL 失敗 → MyMemory にフォールバック")
+    (result,) = await _translate_segmented([(text, segmented)], language, detected)
+    return result
+
+
+async def translate_texts(
+    texts: list[str],
+    language: Language,
+    source_lang: str,
+) -> list[tuple[str | None, str]]:
+    """
+    同じソース言語の複数テキストを 1 つのターゲットへまとめて翻訳する（チャンネル履歴の一括翻訳用）。
+    全テキストの未翻訳の文を 1 バッチにしてエンジンに送る。同言語の判定は呼び出し側で済ませておくこと。
+
+    Returns:
+        texts と同じ順序の (translated_text, engine_name) のリスト。
+        地の文が無いもの・翻訳失敗は (None, "")
+    """
+    cache = get_cache()
+    cached = await cache.get_many(texts, language.key, exact=True)
+    results: list[tuple[str | None, str]] = [
+        (hit.text, hit.engine) if hit is not None else (None, "") for hit in cached
+    ]
+    pending = [
+        (i, text, segmented)
+        for i, (text, hit) in enumerate(zip(texts, cached))
+        if hit is None and (segmented := segment(text)).prose
+    ]
+    if pending:
+        translated = await _translate_segmented(
+            [(text, segmented) for _, text, segmented in pending], language, source_lang
+        )
+        for (i, _, _), result in zip(pending, translated):
+            results[i] = result
+    return results
+
+
+async def _translate_segmented(
+    items: list[tuple[str, SegmentedText]],
+    language: Language,
+    source_lang: str,
+) -> list[tuple[str | None, str]]:
+    """
+    文単位の翻訳メモリを引き、未翻訳の文だけを 1 バッチでエンジンに送って訳文を組み立てる。
+    保護スパンは元の位置に戻し、文・全文の両方をキャッシュに保存する
+    （全文は保護スパンを含むので、空白を畳み込まない exact のキーで保存する）。
+    """
+    cache = get_cache()
+    target = language.key
+    prose = list(dict.fromkeys(s for _, segmented in items for s in segmented.prose))
+    memory = dict(zip(prose, await cache.get_many(prose, target)))
+    missing = [s for s in prose if memory[s] is None]
 
-    # 2. MyMemory（公式フォールバック）
-    result = translate_mymemory(text, mymemory_lang)
-    if result:
-        return result, "MyMemory"
+    # 1. DeepL → 2. MyMemory の順に、対応していて健全なエンジンで試みる
+    fresh: dict[str, str] = {}
+    engine_name = ""
+    if missing:
+        router = await get_router()
+        translations, engine_name = await router.translate_batch(
+            missing, language.codes, source_lang=source_lang
+        )
+        if not translations:
+            return [(None, "")] * len(items)
+        fresh = dict(zip(missing, translations))
+        await cache.put_many(list(fresh.items()), target, engine_name)
+        logger.info(
+            "翻訳メモリ: %d/%d 文がヒット、%d 文を %s で翻訳",
+            len(prose) - len(missing), len(prose), len(missing), engine_name,
+        )
 
-    return None, ""
+    results: list[tuple[str | None, str]] = []
+    by_engine: dict[str, list[tuple[str, str]]] = {}
+    for text, segmented in items:
+        if any(memory[s] is None for s in segmented.prose):
+            engine = engine_name
+        else:
+            engine = memory[segmented.prose[0]].engine
+        result = segmented.fill(
+            [fresh[s] if memory[s] is None else memory[s].text for s in segmented.prose]
+        )
+        results.append((result, engine))
+        by_engine.setdefault(engine, []).append((text, result))
+    for engine, entries in by_engine.items():
+        await cache.put_many(entries, target, engine, exact=True)
+    return results
 
+
+async def translate_many(
+    text: str,
+    targets: list[Language],
+    source_lang: str | None = None,
+) -> list[tuple[str | None, str]]:
+    """
+    1 つのテキストを複数のターゲット言語へ同時に翻訳する。
+
+    DeepL API は 1 リクエストにつきターゲット言語が 1 つなので、
+    同じターゲットを 1 回にまとめたうえで共有セッション上で並行に投げる。
+
+    Args:
+        text:        翻訳対象テキスト
+        targets:     翻訳ターゲットのリスト
+        source_lang: 検出済みのソース言語。None の場合はここで一度だけ検出する。
+
+    Returns:
+        targets と同じ順序の (translated_text, engine_name) のリスト
+    """
+    source_lang = source_lang or detect_language(segment(text).prose_text)
+    unique = list(dict.fromkeys(targets))
+    results = await asyncio.gather(
+        *(translate(text, language, source_lang=source_lang) for language in unique)
+    )
+    by_target = dict(zip(unique, results))
+    return [by_target[target] for target in targets]